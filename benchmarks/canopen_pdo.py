@@ -0,0 +1,49 @@
+"""
+PDOs per second decoded by PdoDecoder, for a byte aligned mapping (one struct unpack) and a bit field mapping.
+
+    python -m benchmarks.canopen_pdo [frame count]
+"""
+
+import sys
+import time
+
+import can
+
+from can_explorer.transport.canopen.pdo import DataType, MappedVariable, PdoDecoder, PdoMapping
+
+MAPPINGS = {
+    'aligned': PdoMapping(
+        0x181,
+        (
+            MappedVariable(0x6041, 0, 16, DataType.UNSIGNED16, 'statusword'),
+            MappedVariable(0x6061, 0, 8, DataType.INTEGER8, 'mode'),
+            MappedVariable(0x0005, 0, 8, DataType.UNSIGNED8, 'dummy8'),
+            MappedVariable(0x6064, 0, 32, DataType.INTEGER32, 'position'),
+        ),
+    ),
+    'bit fields': PdoMapping(
+        0x281,
+        (
+            MappedVariable(0x2000, 1, 1, DataType.BOOLEAN, 'enabled'),
+            MappedVariable(0x2000, 2, 12, DataType.INTEGER16, 'current'),
+            MappedVariable(0x2000, 3, 3, DataType.UNSIGNED8, 'state'),
+            MappedVariable(0x2000, 4, 24, DataType.UNSIGNED24, 'counter'),
+            MappedVariable(0x2000, 5, 24, DataType.INTEGER24, 'torque'),
+        ),
+    ),
+}
+
+
+def main(count: int) -> None:
+    decoder = PdoDecoder(MAPPINGS.values())
+    print(f'{"":12}{"decode_frames":>16}  [PDOs/s]')
+    for name, mapping in MAPPINGS.items():
+        msg = can.Message(arbitration_id=mapping.cob_id, data=bytes(range(8)), is_extended_id=False)
+        frames = [msg] * count
+        start = time.perf_counter()
+        decoder.decode_frames(frames)
+        print(f'{name:12}{count / (time.perf_counter() - start):16,.0f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,55 @@
+"""
+Frames per second decoded by DbcDecoder: one message of 8 signals, decoded frame by frame and in batches of one id.
+
+    python -m benchmarks.dbc_decode [frame count]
+"""
+
+import sys
+import time
+
+import cantools
+import numpy as np
+
+from can_explorer.database.dbc import DbcDecoder
+
+DBC = '''VERSION ""
+
+BS_:
+
+BU_: ECU
+
+BO_ 256 Engine: 8 ECU
+ SG_ Speed : 0|16@1+ (0.01,0) [0|655.35] "km/h" ECU
+ SG_ Temperature : 16|8@1- (1,-40) [-40|215] "C" ECU
+ SG_ Torque : 31|12@0- (0.5,0) [0|0] "Nm" ECU
+ SG_ Counter : 35|4@0+ (1,0) [0|15] "" ECU
+ SG_ Position : 40|12@1+ (1,0) [0|0] "" ECU
+ SG_ Gear : 52|4@1+ (1,0) [0|0] "" ECU
+ SG_ Load : 56|7@1+ (1,0) [0|0] "" ECU
+ SG_ Valid : 63|1@1+ (1,0) [0|0] "" ECU
+'''
+
+
+def main(count: int) -> None:
+    database = cantools.database.load_string(DBC, database_format='dbc')
+    message = database.get_message_by_frame_id(256)
+    decoder = DbcDecoder(database)
+    data = np.random.default_rng(0).integers(0, 256, (count, 8), dtype=np.uint8)
+    rows = [row.tobytes() for row in data[: min(count, 100_000)]]
+    start = time.perf_counter()
+    for row in rows:
+        message.decode(row, decode_choices=False)
+    cantools_rate = len(rows) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for row in rows:
+        decoder.decode(256, row)
+    frame_rate = len(rows) / (time.perf_counter() - start)
+    start = time.perf_counter()
+    decoder.decode_columns(256, data)
+    batch_rate = count / (time.perf_counter() - start)
+    print(f'{"cantools":>14}{"decode":>14}{"decode_columns":>16}  [frames/s]')
+    print(f'{cantools_rate:14,.0f}{frame_rate:14,.0f}{batch_rate:16,.0f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000)
@@ -0,0 +1,38 @@
+"""
+Offline reassembly of a synthetic recording: half of the frames are other traffic, the other half ISO-TP messages of
+4000 bytes.
+
+    python -m benchmarks.isotp_offline [frame count]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from can_explorer.transport.isotp.addressing import AddressInfo, TargetAddressingType
+from can_explorer.transport.isotp.offline import reassemble_arrays
+
+MESSAGE_LENGTH = 4000
+
+
+def main(count: int) -> None:
+    frames_per_message = 1 + MESSAGE_LENGTH // 7
+    timestamp = np.arange(count) * 1e-4
+    arbitration_id = np.full(count, 0x100, dtype=np.uint32)
+    length = np.full(count, 8, dtype=np.uint8)
+    data = np.random.default_rng(0).integers(0, 0xFF, (count, 8), dtype=np.uint8)
+    rows = np.arange(0, count, 2)
+    index = np.arange(len(rows)) % frames_per_message
+    arbitration_id[rows] = 0x12
+    data[rows, 0] = np.where(index == 0, 0x10 | MESSAGE_LENGTH >> 8, 0x20 | index & 0x0F)
+    data[rows[index == 0], 1] = MESSAGE_LENGTH & 0xFF
+    addressing = AddressInfo(0x01, 0x02, 0x00, TargetAddressingType.PHYSICAL, is_fd=False)
+    start = time.perf_counter()
+    messages = sum(1 for _ in reassemble_arrays(timestamp, arbitration_id, length, data, addressing))
+    duration = time.perf_counter() - start
+    print(f'{count:,} frames, {messages:,} messages in {duration:.2f}s: {count / duration:,.0f} frames/s')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000)
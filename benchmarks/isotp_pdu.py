@@ -0,0 +1,53 @@
+"""
+Frames per second parsed by the ISO-TP layer, for each frame type on CAN and CAN FD.
+parse_pci() is the path taken by IsoTpSession, PDU.from_can() builds the PDU dataclass.
+
+    python -m benchmarks.isotp_pdu [frame count]
+"""
+
+import sys
+import time
+
+import can
+
+from can_explorer.transport.isotp.addressing import AddressInfo, TargetAddressingType
+from can_explorer.transport.isotp.pdu import PDU, parse_pci
+
+FRAMES = {
+    'CAN': {
+        'SF': bytes([0x07, 1, 2, 3, 4, 5, 6, 7]),
+        'FF': bytes([0x10, 0x40, 1, 2, 3, 4, 5, 6]),
+        'CF': bytes([0x21, 1, 2, 3, 4, 5, 6, 7]),
+        'FC': bytes([0x30, 0x08, 0x05, 0xCC, 0xCC, 0xCC, 0xCC, 0xCC]),
+    },
+    'CAN FD': {
+        'SF': bytes([0x00, 62]) + bytes(62),
+        'FF': bytes([0x10, 0x00, 0x00, 0x01, 0x00, 0x00]) + bytes(58),
+        'CF': bytes([0x21]) + bytes(63),
+        'FC': bytes([0x30, 0x00, 0xF5]) + bytes([0xCC]) * 61,
+    },
+}
+
+
+def frames_per_second(parse, frames) -> float:
+    start = time.perf_counter()
+    for frame in frames:
+        parse(frame)
+    return len(frames) / (time.perf_counter() - start)
+
+
+def main(count: int) -> None:
+    addressing = AddressInfo(0x01, 0x02, 0x00, TargetAddressingType.PHYSICAL, max_payload_length=64)
+    print(f'{"":8}{"":4}{"parse_pci":>14}{"from_can":>14}  [frames/s]')
+    for bus_type, frames in FRAMES.items():
+        for frame_type, data in frames.items():
+            msg = can.Message(arbitration_id=0x12, data=data, is_fd=len(data) > 8)
+            raw = [msg.data] * count
+            messages = [msg] * count
+            fast = frames_per_second(parse_pci, raw)
+            full = frames_per_second(lambda m: PDU.from_can(m, addressing), messages)
+            print(f'{bus_type:8}{frame_type:4}{fast:14,.0f}{full:14,.0f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000)
@@ -0,0 +1,114 @@
+import gc
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from importlib import metadata
+from pathlib import Path
+from typing import Dict, Optional
+
+import cantools
+from cantools.database import Database
+
+from can_explorer.database.dbc import DbcDecoder, MessageLayout
+
+logger = logging.getLogger(__name__)
+
+CACHE_FORMAT = 1  # Bumped whenever MessageLayout or CompiledSignal change
+CACHE_SUFFIX = '.dbc.pickle'
+DBC_ENCODING = 'cp1252'  # Default encoding of cantools.database.load_file()
+
+
+def default_cache_directory() -> Path:
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'can_explorer' / 'dbc'
+
+
+def _application_version() -> str:
+    try:
+        return metadata.version('can-explorer')
+    except metadata.PackageNotFoundError:
+        return '0'
+
+
+class DatabaseCache:
+    """
+    On-disk cache of compiled DBC databases. Entries are keyed by the content of the file and the versions of the
+    tools that compiled it, so that an edited file or an upgrade misses the cache instead of returning stale
+    layouts. A hit loads the compiled messages only: the cantools database itself is parsed when first accessed.
+    """
+
+    def __init__(self, directory: Optional[str | os.PathLike] = None):
+        self.directory = Path(directory) if directory is not None else default_cache_directory()
+        self.hits = 0
+        self.misses = 0
+        self._tools = f'{CACHE_FORMAT}:{_application_version()}:{cantools.__version__}:{sys.version_info[:2]}'
+
+    def key(self, content: bytes, strict: bool = False) -> str:
+        digest = hashlib.sha256(content)
+        digest.update(f'{self._tools}:{strict}'.encode())
+        return digest.hexdigest()
+
+    def entry(self, key: str) -> Path:
+        return self.directory / f'{key}{CACHE_SUFFIX}'
+
+    def load(self, path: str | os.PathLike, strict: bool = False) -> DbcDecoder:
+        """:return: a decoder of the DBC file, from the cache if it was compiled before"""
+        content = Path(path).read_bytes()
+
+        def load_database() -> Database:
+            return cantools.database.load_string(content.decode(DBC_ENCODING), database_format='dbc', strict=strict)
+
+        entry = self.entry(self.key(content, strict))
+        layouts = self._read(entry)
+        if layouts is not None:
+            self.hits += 1
+            return DbcDecoder(load_database, layouts)
+        self.misses += 1
+        decoder = DbcDecoder(load_database())
+        self._write(entry, decoder.layouts())
+        return decoder
+
+    def clear(self) -> int:
+        """Removes every entry. :return: the number of entries removed"""
+        removed = 0
+        for entry in self.directory.glob(f'*{CACHE_SUFFIX}'):
+            try:
+                entry.unlink()
+                removed += 1
+            except OSError as e:
+                logger.warning(f'Could not remove {entry}: {e}')
+        return removed
+
+    def _read(self, entry: Path) -> Optional[Dict[int, MessageLayout]]:
+        try:
+            data = entry.read_bytes()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f'Could not read {entry}: {e}')
+            return None
+        # The layouts hold no reference cycles: collections during the load would only slow it down
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return pickle.loads(data)
+        except (pickle.UnpicklingError, EOFError, ValueError, TypeError) as e:
+            logger.warning(f'Discarding corrupted cache entry {entry}: {e}')
+            entry.unlink(missing_ok=True)
+            return None
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _write(self, entry: Path, layouts: Dict[int, MessageLayout]) -> None:
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # Written aside and renamed, so that concurrent readers never see a partial entry
+            with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False) as file:
+                pickle.dump(layouts, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(file.name, entry)
+        except OSError as e:
+            logger.warning(f'Could not write {entry}: {e}')
@@ -1 +1,351 @@
+import logging
+import os
+import struct
+from dataclasses import astuple, dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cantools
+import numpy as np
 from cantools.database import Database
+from cantools.database.can import Message, Signal
+from cantools.database.utils import start_bit
+
+from can_explorer.transport.can_message import FrameBatch
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SIZE = 8  # Bytes read as one uint64 to extract the signals of a batch
+
+# Compiled message as plain values, cheap to store and load: name, frame id, length and the fields of its signals
+MessageLayout = Tuple[str, int, int, Tuple[tuple, ...]]
+
+
+def load_dbc(path: str | os.PathLike, strict: bool = False) -> Database:
+    return cantools.database.load_file(path, database_format='dbc', strict=strict)
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledSignal:
+    """
+    Bit position and scaling of a signal, resolved once. Batches are decoded from the 8 bytes of the payload
+    starting at `window`, read as one uint64 in the byte order of the signal
+    """
+
+    name: str
+    length: int
+    is_big_endian: bool
+    is_signed: bool
+    is_float: bool
+    scale: float
+    offset: float
+    window: Optional[int]  # None if the signal spans more than 8 bytes: decoded frame by frame
+    shift: int  # Position of the LSB in the window
+    end: int  # Little endian: LSB position in the payload. Big endian: bit after the LSB, in network order
+    multiplexer: Optional[str]
+    multiplexer_ids: Tuple[int, ...]
+
+    @classmethod
+    def from_signal(cls, signal: Signal) -> 'CompiledSignal':
+        length = signal.length
+        if signal.byte_order == 'big_endian':
+            # Network order: bit 0 is the MSB of the first byte
+            msb = start_bit(signal)
+            first_byte, last_byte = msb // 8, (msb + length - 1) // 8
+            end = msb + length
+        else:
+            first_byte, last_byte = signal.start // 8, (signal.start + length - 1) // 8
+            end = signal.start
+        window = max(0, last_byte + 1 - WINDOW_SIZE)
+        if first_byte < window:
+            window = None
+            shift = 0
+        elif signal.byte_order == 'big_endian':
+            shift = WINDOW_SIZE * 8 - (end - window * 8)
+        else:
+            shift = signal.start - window * 8
+        return cls(
+            name=signal.name,
+            length=length,
+            is_big_endian=signal.byte_order == 'big_endian',
+            is_signed=signal.is_signed,
+            is_float=signal.is_float,
+            scale=signal.scale,
+            offset=signal.offset,
+            window=window,
+            shift=shift,
+            end=end,
+            multiplexer=signal.multiplexer_signal,
+            multiplexer_ids=tuple(signal.multiplexer_ids or ()),
+        )
+
+    def raw_value(self, data: bytes | bytearray) -> int:
+        if self.is_big_endian:
+            raw = int.from_bytes(data, 'big') >> (8 * len(data) - self.end)
+        else:
+            raw = int.from_bytes(data, 'little') >> self.end
+        return raw & ((1 << self.length) - 1)
+
+    def physical_value(self, raw: int) -> int | float:
+        if self.is_float:
+            return struct.unpack('<f' if self.length == 32 else '<d', raw.to_bytes(self.length // 8, 'little'))[0]
+        if self.is_signed and raw & (1 << (self.length - 1)):
+            raw -= 1 << self.length
+        if self.scale == 1 and self.offset == 0:
+            return raw
+        return raw * self.scale + self.offset
+
+    def raw_column(self, windows: Dict[Tuple[int, bool], np.ndarray], data: np.ndarray) -> np.ndarray:
+        """:return: the raw values of a batch, as uint64"""
+        if self.window is None:
+            return np.fromiter((self.raw_value(row.tobytes()) for row in data), dtype=np.uint64, count=len(data))
+        key = (self.window, self.is_big_endian)
+        raw = windows.get(key)
+        if raw is None:
+            raw = windows[key] = _read_window(data, self.window, self.is_big_endian)
+        if self.shift:
+            raw = raw >> np.uint64(self.shift)
+        if self.length < 64:
+            raw = raw & np.uint64((1 << self.length) - 1)
+        return raw
+
+    def physical_column(self, raw: np.ndarray) -> np.ndarray:
+        """:return: the physical values of a batch, as int64, uint64 or float64"""
+        length = self.length
+        if self.is_float:
+            if length == 32:
+                return raw.astype(np.uint32).view(np.float32).astype(np.float64)
+            return raw.view(np.float64)
+        if self.is_signed:
+            if length == 64:
+                values = raw.view(np.int64)
+            else:
+                sign = np.int64(1 << (length - 1))
+                values = (raw.astype(np.int64) ^ sign) - sign
+        else:
+            values = raw
+        if self.scale == 1 and self.offset == 0:
+            return values
+        return values * self.scale + self.offset
+
+
+def _multiplexers_first(signals: List[CompiledSignal]) -> Tuple[CompiledSignal, ...]:
+    """Orders the signals so that every multiplexer comes before the signals it selects"""
+    names = {signal.name for signal in signals}
+    ordered: List[CompiledSignal] = []
+    placed = set()
+    pending = signals
+    while pending:
+        remaining = []
+        for signal in pending:
+            if signal.multiplexer is None or signal.multiplexer in placed or signal.multiplexer not in names:
+                ordered.append(signal)
+                placed.add(signal.name)
+            else:
+                remaining.append(signal)
+        if len(remaining) == len(pending):
+            # Multiplexer loop in the database
+            ordered += remaining
+            break
+        pending = remaining
+    return tuple(ordered)
+
+
+def _read_window(data: np.ndarray, window: int, is_big_endian: bool) -> np.ndarray:
+    count, width = data.shape
+    if width < window + WINDOW_SIZE:
+        padded = np.zeros((count, window + WINDOW_SIZE), dtype=np.uint8)
+        padded[:, :width] = data
+        data = padded
+    block = np.ascontiguousarray(data[:, window : window + WINDOW_SIZE])
+    return block.view('>u8' if is_big_endian else '<u8').ravel().astype(np.uint64, copy=False)
+
+
+class CompiledMessage:
+    """Decoder of the signals of one message of a database"""
+
+    def __init__(self, name: str, frame_id: int, length: int, signals: Sequence[CompiledSignal]):
+        """:param signals: ordered with every multiplexer before the signals it selects"""
+        self.name = name
+        self.frame_id = frame_id
+        self.length = length
+        self.signals: Tuple[CompiledSignal, ...] = tuple(signals)
+        self._by_name = {signal.name: signal for signal in self.signals}
+        self._fields = tuple(
+            (
+                signal,
+                signal.name,
+                signal.is_big_endian,
+                signal.end,
+                (1 << signal.length) - 1,
+                1 << (signal.length - 1) if signal.is_signed else 0,
+                signal.is_float or signal.scale != 1 or signal.offset != 0,
+                signal.multiplexer,
+            )
+            for signal in self.signals
+        )
+
+    @classmethod
+    def from_message(cls, message: Message) -> 'CompiledMessage':
+        signals = _multiplexers_first([CompiledSignal.from_signal(signal) for signal in message.signals])
+        return cls(message.name, message.frame_id, message.length, signals)
+
+    @classmethod
+    def from_layout(cls, layout: MessageLayout) -> 'CompiledMessage':
+        name, frame_id, length, signals = layout
+        return cls(name, frame_id, length, [CompiledSignal(*fields) for fields in signals])
+
+    def layout(self) -> MessageLayout:
+        return self.name, self.frame_id, self.length, tuple(astuple(signal) for signal in self.signals)
+
+    def decode(self, data: bytes | bytearray) -> Dict[str, int | float]:
+        """:return: the physical values of the signals of one frame. Signals of other multiplexer values are left out"""
+        if len(data) < self.length:
+            data = bytes(data) + bytes(self.length - len(data))
+        # The payload is read once in each byte order
+        little = int.from_bytes(data, 'little')
+        big = int.from_bytes(data, 'big')
+        bits = 8 * len(data)
+        raw = {}
+        values = {}
+        for signal, name, is_big_endian, end, mask, sign, scaled, multiplexer in self._fields:
+            if multiplexer is not None:
+                selector = raw.get(multiplexer)
+                if selector is None or selector not in signal.multiplexer_ids:
+                    continue
+            value = (big >> (bits - end) if is_big_endian else little >> end) & mask
+            raw[name] = value
+            if scaled:
+                value = signal.physical_value(value)
+            elif sign and value & sign:
+                value -= sign << 1
+            values[name] = value
+        return values
+
+    def decode_columns(self, data: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Decodes a batch of frames of the message in one vectorized pass per signal.
+        :param data: payload matrix, one row per frame
+        :return: the physical values of every signal. Multiplexed signals are NaN in the frames of other multiplexer
+        values
+        """
+        if data.ndim != 2:
+            raise ValueError(f'Payload matrix expected, got shape {data.shape}')
+        windows: Dict[Tuple[int, bool], np.ndarray] = {}
+        raw: Dict[str, np.ndarray] = {}
+        present: Dict[str, Optional[np.ndarray]] = {}
+        values = {}
+        for signal in self.signals:
+            raw[signal.name] = column = signal.raw_column(windows, data)
+            physical = signal.physical_column(column)
+            mask = self._present(signal, raw, present, windows, data)
+            if mask is not None:
+                physical = np.where(mask, physical, np.nan)
+            values[signal.name] = physical
+        return values
+
+    def _present(
+        self,
+        signal: CompiledSignal,
+        raw: Dict[str, np.ndarray],
+        present: Dict[str, Optional[np.ndarray]],
+        windows: Dict[Tuple[int, bool], np.ndarray],
+        data: np.ndarray,
+    ) -> Optional[np.ndarray]:
+        """:return: the frames holding the signal, None for all"""
+        if signal.name in present:
+            return present[signal.name]
+        mask = None
+        if signal.multiplexer is not None:
+            multiplexer = self._by_name[signal.multiplexer]
+            selector = raw.get(multiplexer.name)
+            if selector is None:
+                selector = raw[multiplexer.name] = multiplexer.raw_column(windows, data)
+            mask = np.isin(selector, np.array(signal.multiplexer_ids, dtype=np.uint64))
+            parent = self._present(multiplexer, raw, present, windows, data)
+            if parent is not None:
+                mask &= parent
+        present[signal.name] = mask
+        return mask
+
+
+class DbcDecoder:
+    """
+    Decodes frames with the messages of a database. Messages are compiled on first use and kept by frame id, so
+    that frames of one id are decoded by a lookup and one vectorized pass per signal.
+    """
+
+    def __init__(self, database: Database | Callable[[], Database], layouts: Optional[Dict[int, MessageLayout]] = None):
+        """
+        :param database: the database, or a function loading it when first needed
+        :param layouts: compiled messages of the database by frame id, e.g. from layouts() of a previous decoder.
+        When given, frames are decoded without the database
+        """
+        self._database = database if isinstance(database, Database) else None
+        self._load_database = None if isinstance(database, Database) else database
+        self._layouts = layouts
+        self._compiled: Dict[int, Optional[CompiledMessage]] = {}
+
+    @property
+    def database(self) -> Database:
+        if self._database is None:
+            self._database = self._load_database()
+            self._load_database = None
+        return self._database
+
+    def message(self, arbitration_id: int) -> Optional[CompiledMessage]:
+        """:return: the compiled message of the id, None if the database has none"""
+        try:
+            return self._compiled[arbitration_id]
+        except KeyError:
+            pass
+        if self._layouts is not None:
+            layout = self._layouts.get(arbitration_id)
+            compiled = CompiledMessage.from_layout(layout) if layout is not None else None
+        else:
+            try:
+                compiled = CompiledMessage.from_message(self.database.get_message_by_frame_id(arbitration_id))
+            except KeyError:
+                compiled = None
+        self._compiled[arbitration_id] = compiled
+        return compiled
+
+    def decode(self, arbitration_id: int, data: bytes | bytearray) -> Optional[Dict[str, int | float]]:
+        message = self.message(arbitration_id)
+        return message.decode(data) if message is not None else None
+
+    def decode_columns(self, arbitration_id: int, data: np.ndarray) -> Optional[Dict[str, np.ndarray]]:
+        """Decodes a payload matrix of frames of one id. See CompiledMessage.decode_columns()"""
+        message = self.message(arbitration_id)
+        return message.decode_columns(data) if message is not None else None
+
+    def decode_batch(self, batch: FrameBatch) -> Dict[int, Tuple[np.ndarray, Dict[str, np.ndarray]]]:
+        """
+        Decodes the frames of a batch, grouped by id.
+        :return: for every id of the database: the indices of its frames in the batch and its signal values
+        """
+        if not len(batch):
+            return {}
+        order = np.argsort(batch.arbitration_id, kind='stable')
+        ids = batch.arbitration_id[order]
+        starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+        ends = np.append(starts[1:], len(ids))
+        decoded = {}
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            arbitration_id = int(ids[start])
+            message = self.message(arbitration_id)
+            if message is None:
+                continue
+            indices = order[start:end]
+            decoded[arbitration_id] = (indices, message.decode_columns(batch.data[indices]))
+        return decoded
+
+    def messages(self) -> List[CompiledMessage]:
+        """Compiles every message of the database. :return: the compiled messages"""
+        frame_ids = (
+            self._layouts if self._layouts is not None else [message.frame_id for message in self.database.messages]
+        )
+        return [self.message(frame_id) for frame_id in frame_ids]
+
+    def layouts(self) -> Dict[int, MessageLayout]:
+        """:return: every message of the database compiled, as plain values to build another decoder from"""
+        return {message.frame_id: message.layout() for message in self.messages()}
@@ -1,14 +1,21 @@
+import collections
 import logging
 
 import can
 from PyQt6 import QtCore, QtGui, QtWidgets
 from PyQt6.QtCore import Qt, pyqtSignal, pyqtSlot, QModelIndex, QThreadPool
 from can.message import Message
-from typing import Dict, List
+from typing import Dict, List, Optional
 from PyQt6.QtWidgets import QHeaderView
 import asyncio
 
+from can_explorer.gui.can_trace_viewer import CanTraceModel, CanTraceView
 from can_explorer.gui.can_worker import CanWorker
+from can_explorer.gui.frame_ingest import REFRESH_RATE_HZ, FrameIngest
+from can_explorer.gui.frame_filter import FilterEngine, FrameFilter, SequenceVector
+from can_explorer.gui.frame_storage import DEFAULT_CAPACITY, FrameStorage
+from can_explorer.gui.hex_delegate import CHANGED_MASK_ROLE, PAYLOAD_ROLE, HexPayloadDelegate, format_hex
+from can_explorer.transport.can_message import CanFrameFlag
 from can_explorer.util.canutils import CanConfiguration
 
 logger = logging.getLogger(__name__)
@@ -16,10 +23,13 @@ logger = logging.getLogger(__name__)
 
 class RawCanViewerModel(QtCore.QAbstractTableModel):
     HEADER_ROWS = ('Time [s]', 'Tx/RX', 'Message Type', 'Arbitration ID [hex]', 'DLC [hex]', 'Data Bytes [hex]')
+    DATA_COLUMN = len(HEADER_ROWS) - 1
 
-    def __init__(self):
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
         super(RawCanViewerModel, self).__init__()
-        self._data: List[can.Message] = []
+        self._storage = FrameStorage(capacity)
+        self._filters = FilterEngine(self._storage)
+        self._rows: Optional[SequenceVector] = None
         self.configure()
 
     def configure(self):
@@ -31,7 +41,19 @@ class RawCanViewerModel(QtCore.QAbstractTableModel):
         return super().headerData(section, orientation, role)
 
     def rowCount(self, parent) -> int:
-        return len(self._data)
+        if self._rows is not None:
+            return len(self._rows)
+        return len(self._storage)
+
+    @property
+    def frame_filter(self) -> Optional[FrameFilter]:
+        return self._filters.filter
+
+    def storage_index(self, row: int) -> int:
+        """Returns the physical storage index of the frame shown at the given row"""
+        if self._rows is not None:
+            return self._rows[row] % self._storage.capacity
+        return self._storage.index(row)
 
     def columnCount(self, parent) -> int:
         return len(self.HEADER_ROWS)
@@ -43,24 +65,36 @@ class RawCanViewerModel(QtCore.QAbstractTableModel):
                 return f'{value: 8.5f}'
             case int():
                 return hex(value)
-            case bytearray():
-                return ' '.join([f"{x:02X}" for x in value])
+            case bytearray() | bytes() | memoryview():
+                return format_hex(value)
         return value
 
     def data(self, index: QModelIndex, role):
         row = index.row()
         col = index.column()
         if role == QtCore.Qt.ItemDataRole.DisplayRole:
-            data = self._data[row]
-            row_data = (
-                data.timestamp,
-                'Rx' if data.is_rx else 'Tx',
-                'F' if data.is_fd else 'S',
-                data.arbitration_id,
-                data.dlc,
-                data.data,
-            )
-            return self.format_data(row_data[col])
+            storage = self._storage
+            index = self.storage_index(row)
+            match col:
+                case 0:
+                    value = float(storage.timestamp[index])
+                case 1:
+                    value = 'Rx' if storage.flags[index] & CanFrameFlag.RX else 'Tx'
+                case 2:
+                    value = 'F' if storage.flags[index] & CanFrameFlag.FD else 'S'
+                case 3:
+                    value = int(storage.arbitration_id[index])
+                case 4:
+                    value = int(storage.dlc[index])
+                case _:
+                    value = storage.payload(index)
+            return self.format_data(value)
+        elif role == PAYLOAD_ROLE:
+            if col == self.DATA_COLUMN:
+                return self._storage.payload(self.storage_index(row))
+        elif role == CHANGED_MASK_ROLE:
+            if col == self.DATA_COLUMN:
+                return int(self._storage.changed[self.storage_index(row)])
         elif role == QtCore.Qt.ItemDataRole.TextAlignmentRole:
             aligment = QtCore.Qt.AlignmentFlag
             row_pos = (
@@ -77,43 +111,165 @@ class RawCanViewerModel(QtCore.QAbstractTableModel):
         return QtCore.Qt.ItemFlag.ItemIsSelectable
 
     def insert(self, data: can.Message):
-        logger.info(f'Added {data=} to container')
-        self._data.append(data)
-        # self.dataChanged.emit()
-        # self.modelReset.emit()
-        self.layoutChanged.emit()
+        self.append_batch([data])
+
+    def append_batch(self, messages: List[can.Message]) -> None:
+        """Stores the given frames and notifies the views with a single removal/insertion per batch"""
+        count = len(messages)
+        if count == 0:
+            return
+        storage = self._storage
+        rows = self._rows
+        first_sequence = storage.total
+        stored = len(storage)
+        inserted = min(count, storage.capacity)
+        evicted = min(stored, max(0, stored + inserted - storage.capacity))
+        if rows is None:
+            if evicted:
+                self.beginRemoveRows(QModelIndex(), 0, evicted - 1)
+                storage.discard(evicted)
+                self.endRemoveRows()
+                stored -= evicted
+            self.beginInsertRows(QModelIndex(), stored, stored + inserted - 1)
+            storage.extend(messages)
+            self._filters.add(first_sequence)
+            self.endInsertRows()
+            return
+        removed = rows.count_below(storage.head + evicted)
+        if removed:
+            self.beginRemoveRows(QModelIndex(), 0, removed - 1)
+            storage.discard(evicted)
+            rows.discard_below(storage.head)
+            self.endRemoveRows()
+        else:
+            storage.discard(evicted)
+        storage.extend(messages)
+        matches = self._filters.add(first_sequence)
+        if len(matches):
+            shown = len(rows)
+            self.beginInsertRows(QModelIndex(), shown, shown + len(matches) - 1)
+            rows.extend(matches)
+            self.endInsertRows()
+
+    def set_filter(self, frame_filter: Optional[FrameFilter]) -> None:
+        """Shows only the frames matching the given filter, or all frames if None"""
+        self.beginResetModel()
+        sequences = self._filters.apply(frame_filter)
+        if frame_filter is None:
+            self._rows = None
+        else:
+            self._rows = SequenceVector(len(sequences) + 16)
+            self._rows.extend(sequences)
+        self.endResetModel()
 
 
 class RawCanViewerView(QtWidgets.QTableView):
     data_received_signal = pyqtSignal(Message)
+    unseen_frames_changed = pyqtSignal(int)
+    filter_status_changed = pyqtSignal(str)
 
-    def __init__(self, configuration: CanConfiguration):
+    def __init__(self, configuration: CanConfiguration, refresh_rate_hz: int = REFRESH_RATE_HZ):
         super().__init__()
         self._configuration = configuration
+        self._auto_scroll = True
+        self._frozen = False
+        self._backlog = collections.deque(maxlen=configuration.max_frames)
+        self._ingest = FrameIngest(refresh_rate_hz, self, max_pending=configuration.max_frames)
+        # Frames captured since the last shown batch but dropped by the ingest or evicted from the backlog
+        self._dropped = 0
+        self._ingest_dropped = 0
         self._model = self._configure()
-        self._can_handler = CanWorker(self._configuration, lambda x: self._model.insert(x))
+        self._trace_model = CanTraceModel()
+        self._can_handler = CanWorker(self._configuration, self._ingest.push_many)
         self._connect_signals()
 
     @property
     def configuration_data(self) -> CanConfiguration:
         return self._configuration
 
+    def create_trace_view(self) -> CanTraceView:
+        """Returns a per-arbitration-ID view fed with the frames of this viewer"""
+        return CanTraceView(self, self._trace_model)
+
+    @property
+    def unseen_frames(self) -> int:
+        """Number of frames captured but not yet shown, including those dropped since the last shown batch"""
+        dropped = self._dropped + self._ingest.dropped_count - self._ingest_dropped
+        return len(self._backlog) + self._ingest.pending_count + dropped
+
     def start_listening(self, threadpool: QThreadPool):
+        self._ingest.start()
         threadpool.start(self._can_handler)
-        # self._can_handler.protocol.on_data_received.connect(lambda x: logger.info(f'Received CAN message: {x}'))
         logger.info('Signal connected')
 
     def _configure(self):
-        model = RawCanViewerModel()
+        model = RawCanViewerModel(self._configuration.max_frames)
         self.setModel(model)
         self.horizontalHeader().setStretchLastSection(True)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.setItemDelegateForColumn(model.DATA_COLUMN, HexPayloadDelegate(self))
         self.resizeColumnsToContents()
+        self.setContextMenuPolicy(Qt.ContextMenuPolicy.ActionsContextMenu)
+        auto_scroll_action = QtGui.QAction('Auto-scroll', self, checkable=True, checked=self._auto_scroll)
+        auto_scroll_action.toggled.connect(self.set_auto_scroll)
+        frozen_action = QtGui.QAction('Freeze view', self, checkable=True, checked=self._frozen)
+        frozen_action.toggled.connect(self.set_frozen)
+        self.addActions([auto_scroll_action, frozen_action])
         return model
 
     def _connect_signals(self):
-        pass
+        self._ingest.batch_ready.connect(self._on_batch_ready)
+        self._ingest.batch_ready.connect(self._trace_model.update_batch)
+
+    def set_filter(self, frame_filter: Optional[FrameFilter]) -> None:
+        """
+        Filters the shown frames. The ID part is also installed as bus acceptance filters,
+        so frames with other IDs are not received at all while the filter is active.
+        """
+        self._model.set_filter(frame_filter)
+        if frame_filter is None:
+            self._can_handler.set_filters(None)
+            status = 'No filter'
+        else:
+            placement = self._can_handler.set_filters(frame_filter.to_can_filters())
+            status = ', '.join(frame_filter.describe(placement)) or 'No filter'
+        self.setToolTip(status)
+        self.filter_status_changed.emit(status)
+
+    @pyqtSlot(bool)
+    def set_auto_scroll(self, enabled: bool) -> None:
+        self._auto_scroll = enabled
+
+    @pyqtSlot(bool)
+    def set_frozen(self, frozen: bool) -> None:
+        self._frozen = frozen
+        if not frozen and self._backlog:
+            backlog = list(self._backlog)
+            self._backlog.clear()
+            self._show_batch(backlog)
+            self._dropped = 0
+        self.unseen_frames_changed.emit(self.unseen_frames)
+
+    @pyqtSlot(list)
+    def _on_batch_ready(self, batch: List[Message]) -> None:
+        ingest_dropped = self._ingest.dropped_count
+        self._dropped += ingest_dropped - self._ingest_dropped
+        self._ingest_dropped = ingest_dropped
+        if self._frozen:
+            # Frames older than the retention would be evicted on display anyway
+            backlog = self._backlog
+            self._dropped += max(0, len(backlog) + len(batch) - backlog.maxlen)
+            backlog.extend(batch)
+        else:
+            self._show_batch(batch)
+            self._dropped = 0
+        self.unseen_frames_changed.emit(self.unseen_frames)
+
+    def _show_batch(self, batch: List[Message]) -> None:
+        self._model.append_batch(batch)
+        if self._auto_scroll:
+            self.scrollToBottom()
 
     @pyqtSlot(Message)
     def add_can_raw_message(self, message: Message):
-        logger.info(f'Received {message=}')
-        # self._model.insertRow()
+        self._ingest.push(message)
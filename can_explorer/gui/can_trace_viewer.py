@@ -0,0 +1,209 @@
+import bisect
+import logging
+import math
+from typing import Dict, List, Optional, Tuple
+
+import can
+from PyQt6 import QtCore, QtWidgets
+from PyQt6.QtCore import Qt, QModelIndex, pyqtSlot
+from PyQt6.QtWidgets import QHeaderView
+
+from can_explorer.gui.hex_delegate import CHANGED_MASK_ROLE, PAYLOAD_ROLE, HexPayloadDelegate, format_hex
+
+logger = logging.getLogger(__name__)
+
+
+def changed_bytes_mask(previous: bytes, current: bytes) -> int:
+    """Returns a bitmask with bit n set if the byte n differs between both payloads"""
+    diff = int.from_bytes(previous, 'little') ^ int.from_bytes(current, 'little')
+    mask = 0
+    position = 0
+    while diff:
+        if diff & 0xFF:
+            mask |= 1 << position
+        diff >>= 8
+        position += 1
+    if len(previous) != len(current):
+        shortest, longest = sorted((len(previous), len(current)))
+        mask |= ((1 << longest) - 1) ^ ((1 << shortest) - 1)
+    return mask
+
+
+class TraceEntry:
+    __slots__ = (
+        'arbitration_id',
+        'is_extended_id',
+        'is_rx',
+        'count',
+        'timestamp',
+        'period',
+        'min_period',
+        'max_period',
+        'payload',
+        'previous_payload',
+        'changed_mask',
+    )
+
+    def __init__(self, msg: can.Message):
+        self.arbitration_id = msg.arbitration_id
+        self.is_extended_id = msg.is_extended_id
+        self.is_rx = msg.is_rx
+        self.count = 1
+        self.timestamp = msg.timestamp
+        self.period = math.nan
+        self.min_period = math.inf
+        self.max_period = -math.inf
+        self.payload = bytes(msg.data)
+        self.previous_payload = self.payload
+        self.changed_mask = 0
+
+    def update(self, msg: can.Message) -> None:
+        period = msg.timestamp - self.timestamp
+        self.period = period
+        if period < self.min_period:
+            self.min_period = period
+        if period > self.max_period:
+            self.max_period = period
+        self.timestamp = msg.timestamp
+        self.is_rx = msg.is_rx
+        self.count += 1
+        self.previous_payload = self.payload
+        self.payload = bytes(msg.data)
+
+
+class CanTraceModel(QtCore.QAbstractTableModel):
+    """
+    Fixed-row model showing one row per arbitration ID, overwritten by every new frame of that ID.
+    Views are notified once per batch, so the rendering cost depends on the number of distinct IDs
+    and not on the frame rate.
+    """
+
+    HEADER_ROWS = (
+        'Arbitration ID [hex]',
+        'Tx/RX',
+        'Count',
+        'Period [ms]',
+        'Min Period [ms]',
+        'Max Period [ms]',
+        'DLC [hex]',
+        'Data Bytes [hex]',
+    )
+    DATA_COLUMN = len(HEADER_ROWS) - 1
+
+    def __init__(self):
+        super(CanTraceModel, self).__init__()
+        self._keys: List[Tuple[int, bool]] = []
+        self._entries: List[TraceEntry] = []
+        self._rows: Dict[Tuple[int, bool], int] = {}
+
+    def headerData(self, section, orientation, role, *args, **kwargs):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADER_ROWS[section]
+        return super().headerData(section, orientation, role)
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return len(self._entries)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return len(self.HEADER_ROWS)
+
+    def flags(self, index: QModelIndex):
+        return QtCore.Qt.ItemFlag.ItemIsSelectable | QtCore.Qt.ItemFlag.ItemIsEnabled
+
+    def entry(self, row: int) -> Optional[TraceEntry]:
+        return self._entries[row] if 0 <= row < len(self._entries) else None
+
+    @staticmethod
+    def format_period(period: float) -> str:
+        if math.isnan(period) or math.isinf(period):
+            return '-'
+        return f'{period * 1_000: 8.3f}'
+
+    def data(self, index: QModelIndex, role):
+        entry = self._entries[index.row()]
+        col = index.column()
+        if role == QtCore.Qt.ItemDataRole.DisplayRole:
+            match col:
+                case 0:
+                    return f'{entry.arbitration_id:08X}' if entry.is_extended_id else f'{entry.arbitration_id:03X}'
+                case 1:
+                    return 'Rx' if entry.is_rx else 'Tx'
+                case 2:
+                    return str(entry.count)
+                case 3:
+                    return self.format_period(entry.period)
+                case 4:
+                    return self.format_period(entry.min_period)
+                case 5:
+                    return self.format_period(entry.max_period)
+                case 6:
+                    return hex(len(entry.payload))
+                case _:
+                    return format_hex(entry.payload)
+        elif role == PAYLOAD_ROLE:
+            if col == self.DATA_COLUMN:
+                return entry.payload
+        elif role == CHANGED_MASK_ROLE:
+            if col == self.DATA_COLUMN:
+                return entry.changed_mask
+        elif role == QtCore.Qt.ItemDataRole.TextAlignmentRole:
+            aligment = QtCore.Qt.AlignmentFlag
+            horizontal = aligment.AlignLeft if col == self.DATA_COLUMN else aligment.AlignRight
+            return horizontal | aligment.AlignVCenter
+
+    def clear(self) -> None:
+        self.beginResetModel()
+        self._keys.clear()
+        self._entries.clear()
+        self._rows.clear()
+        self.endResetModel()
+
+    @pyqtSlot(list)
+    def update_batch(self, messages: List[can.Message]) -> None:
+        """Folds a batch of frames into the per-ID rows and notifies the views once"""
+        rows = self._rows
+        entries = self._entries
+        updated = set()
+        created: Dict[Tuple[int, bool], TraceEntry] = {}
+        for msg in messages:
+            key = (msg.arbitration_id, msg.is_extended_id)
+            row = rows.get(key)
+            if row is not None:
+                entries[row].update(msg)
+                updated.add(row)
+            elif key in created:
+                created[key].update(msg)
+            else:
+                created[key] = TraceEntry(msg)
+        for row in updated:
+            entry = entries[row]
+            entry.changed_mask = changed_bytes_mask(entry.previous_payload, entry.payload)
+        if updated:
+            self.dataChanged.emit(self.index(min(updated), 0), self.index(max(updated), self.DATA_COLUMN))
+        for key, entry in sorted(created.items()):
+            entry.changed_mask = changed_bytes_mask(entry.previous_payload, entry.payload)
+            row = bisect.bisect_left(self._keys, key)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self._keys.insert(row, key)
+            entries.insert(row, entry)
+            self.endInsertRows()
+        if created:
+            self._rows = {key: row for row, key in enumerate(self._keys)}
+
+
+class CanTraceView(QtWidgets.QTableView):
+    """Per-arbitration-ID view fed by the frames received by a raw viewer"""
+
+    def __init__(self, source: QtWidgets.QWidget, model: CanTraceModel):
+        super().__init__()
+        self._source = source
+        self.setModel(model)
+        self.horizontalHeader().setStretchLastSection(True)
+        self.verticalHeader().setVisible(False)
+        self.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
+        self.setItemDelegateForColumn(model.DATA_COLUMN, HexPayloadDelegate(self))
+        self.resizeColumnsToContents()
+
+    @property
+    def source(self) -> QtWidgets.QWidget:
+        return self._source
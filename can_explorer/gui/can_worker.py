@@ -1,20 +1,23 @@
-import asyncio
+import can
+from PyQt6.QtCore import Qt
 from can_explorer.gui.base_worker import Worker
-from can_explorer.transport.can_connection import create_can_connection
-from can_explorer.transport.isocan import IsoCanProtocol, IsoCanTransport
+from can_explorer.transport.can_connection import CanType, create_can_connection
+from can_explorer.transport.isocan.isocan import IsoCanProtocol, IsoCanTransport
 from can_explorer.util.canutils import CanConfiguration
-from typing import Optional
+from typing import List, Optional
+from can_explorer.transport.can_filter import CanFilter, FilterPlacement
 import logging
 
 logger = logging.getLogger(__name__)
 
 
 class CanWorker(Worker):
-    def __init__(self, config: CanConfiguration, on_data_received):
+    def __init__(self, config: CanConfiguration, on_frames_received):
         self._config = config
         self.protocol: Optional[IsoCanProtocol] = None
         self.transport: Optional[IsoCanTransport] = None
-        self._on_data_received = on_data_received
+        self._on_frames_received = on_frames_received
+        self._can_filters: Optional[List[CanFilter]] = None
         self._progress_callback = None
         self._configure()
         super().__init__(self.start_listening)
@@ -24,21 +27,38 @@ class CanWorker(Worker):
 
     def start_listening(self, progress_callback):
         try:
-            running_loop = None
             self._progress_callback = progress_callback
-            self.protocol, self.transport = create_can_connection(
-                running_loop,
-                protocol_factory=None,
-                url=None,
+            bus = can.Bus(
                 channel=self._config.channel,
                 interface=self._config.interface,
+                bitrate=self._config.bitrate,
                 fd=self._config.fd,
             )
-            self.protocol.on_data_received.connect(self._on_data_received)
-            self.transport._parse_can_frames()
+            # Without event loop, the transport calls the protocol on its reader thread
+            self.protocol, self.transport = create_can_connection(None, CanType.ISOCAN, self._create_protocol, bus)
+            self.transport.set_filters(self._can_filters)
         except Exception as e:
             logger.error(f'Error while listening to can frame: {e}')
             self._signals.error.emit(e)
 
+    def _create_protocol(self) -> IsoCanProtocol:
+        protocol = IsoCanProtocol()
+        protocol.on_frames_received.connect(self._on_frames_received, type=Qt.ConnectionType.DirectConnection)
+        return protocol
+
+    def stop(self) -> None:
+        if self.transport is not None:
+            self.transport.close()
+
+    def set_filters(self, can_filters: Optional[List[CanFilter]]) -> Optional[FilterPlacement]:
+        """
+        Installs acceptance filters on the transport.
+        :return: where the filters run, None if not connected yet. They are then installed once connected.
+        """
+        self._can_filters = can_filters
+        if self.transport is None:
+            return None
+        return self.transport.set_filters(can_filters)
+
     def send(self):
         pass
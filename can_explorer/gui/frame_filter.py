@@ -0,0 +1,278 @@
+import enum
+import logging
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from can_explorer.gui.frame_storage import MAX_PAYLOAD_LENGTH, FrameStorage
+from can_explorer.transport.can_filter import CAN_EFF_MASK, CanFilter, FilterPlacement
+from can_explorer.transport.can_message import CanFrameFlag
+
+logger = logging.getLogger(__name__)
+
+
+@enum.unique
+class Direction(enum.IntEnum):
+    ANY = enum.auto()
+    RX = enum.auto()
+    TX = enum.auto()
+
+
+@enum.unique
+class FrameKind(enum.IntEnum):
+    ANY = enum.auto()
+    CLASSIC = enum.auto()
+    FD = enum.auto()
+
+
+@dataclass(frozen=True, slots=True)
+class PayloadMask:
+    """Matches frames whose payload satisfies: data[n] & mask[n] == value[n] for every byte n of the mask"""
+
+    mask: bytes
+    value: bytes
+
+    def __post_init__(self):
+        if len(self.mask) != len(self.value) or len(self.mask) > MAX_PAYLOAD_LENGTH:
+            raise ValueError(f'Invalid payload mask: {self.mask=}, {self.value=}')
+
+
+@dataclass(frozen=True, slots=True)
+class FrameFilter:
+    """
+    Frame predicate made of an arbitration ID part, answered through the per-ID index, and of residual
+    parts (direction, frame kind, payload) evaluated on the candidate rows only.
+    A frame matches the ID part if its ID is listed in `arbitration_ids` or matches one of the
+    (can_id, can_mask) pairs of `id_masks`. Without both, every ID matches.
+    """
+
+    arbitration_ids: FrozenSet[int] = frozenset()
+    id_masks: Tuple[Tuple[int, int], ...] = ()
+    direction: Direction = Direction.ANY
+    kind: FrameKind = FrameKind.ANY
+    payload: Optional[PayloadMask] = None
+
+    @property
+    def has_id_predicate(self) -> bool:
+        return bool(self.arbitration_ids or self.id_masks)
+
+    @property
+    def has_residual_predicate(self) -> bool:
+        return self.direction != Direction.ANY or self.kind != FrameKind.ANY or self.payload is not None
+
+    def matches_id(self, arbitration_id: int) -> bool:
+        if not self.has_id_predicate or arbitration_id in self.arbitration_ids:
+            return True
+        return any(arbitration_id & can_mask == can_id & can_mask for can_id, can_mask in self.id_masks)
+
+    def to_can_filters(self) -> Optional[List[CanFilter]]:
+        """Returns the ID part as bus acceptance filters, None if every ID is accepted"""
+        if not self.has_id_predicate:
+            return None
+        can_filters = [
+            {'can_id': arbitration_id, 'can_mask': CAN_EFF_MASK} for arbitration_id in sorted(self.arbitration_ids)
+        ]
+        can_filters.extend({'can_id': can_id, 'can_mask': can_mask} for can_id, can_mask in self.id_masks)
+        return can_filters
+
+    def describe(self, id_placement: Optional[FilterPlacement]) -> List[str]:
+        """
+        Lists every part of the filter along with where it runs.
+        :param id_placement: where the bus runs the ID part, None if not installed on a bus yet
+        """
+        id_status = str(id_placement) if id_placement is not None else 'pending'
+        parts = [f'ID {arbitration_id:X}: {id_status}' for arbitration_id in sorted(self.arbitration_ids)]
+        parts.extend(f'ID {can_id:X}/{can_mask:X}: {id_status}' for can_id, can_mask in self.id_masks)
+        software = str(FilterPlacement.SOFTWARE)
+        if self.direction != Direction.ANY:
+            parts.append(f'Direction {self.direction.name}: {software}')
+        if self.kind != FrameKind.ANY:
+            parts.append(f'Kind {self.kind.name}: {software}')
+        if self.payload is not None:
+            parts.append(f'Payload {self.payload.value.hex().upper()}/{self.payload.mask.hex().upper()}: {software}')
+        return parts
+
+    def matches_rows(self, storage: FrameStorage, indices: np.ndarray) -> np.ndarray:
+        """Evaluates the residual predicates on the given physical indices. Returns a boolean array"""
+        keep = np.ones(len(indices), dtype=bool)
+        if self.direction != Direction.ANY:
+            is_rx = (storage.flags[indices] & CanFrameFlag.RX) != 0
+            keep &= is_rx if self.direction == Direction.RX else ~is_rx
+        if self.kind != FrameKind.ANY:
+            is_fd = (storage.flags[indices] & CanFrameFlag.FD) != 0
+            keep &= is_fd if self.kind == FrameKind.FD else ~is_fd
+        if self.payload is not None:
+            length = len(self.payload.mask)
+            mask = np.frombuffer(self.payload.mask, dtype=np.uint8)
+            value = np.frombuffer(self.payload.value, dtype=np.uint8)
+            payload = storage.data[indices, :length]
+            keep &= np.all((payload & mask) == (value & mask), axis=1)
+            keep &= storage.dlc[indices] >= length
+        return keep
+
+
+class SequenceVector:
+    """Growable sorted array of frame sequence numbers, trimmed from the front as frames get evicted"""
+
+    __slots__ = ('_values', '_start', '_stop')
+
+    def __init__(self, capacity: int = 16):
+        self._values = np.empty(capacity, dtype=np.int64)
+        self._start = 0
+        self._stop = 0
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, position: int) -> int:
+        return int(self._values[self._start + position])
+
+    @property
+    def values(self) -> np.ndarray:
+        return self._values[self._start : self._stop]
+
+    def count_below(self, sequence: int) -> int:
+        return int(np.searchsorted(self.values, sequence))
+
+    def discard_below(self, sequence: int) -> int:
+        count = self.count_below(sequence)
+        self._start += count
+        return count
+
+    def extend(self, sequences: np.ndarray) -> None:
+        length = len(sequences)
+        if self._stop + length > len(self._values):
+            values = self.values
+            capacity = max(16, 2 * (len(values) + length))
+            grown = np.empty(capacity, dtype=np.int64)
+            grown[: len(values)] = values
+            self._values = grown
+            self._start = 0
+            self._stop = len(values)
+        self._values[self._stop : self._stop + length] = sequences
+        self._stop += length
+
+
+class FrameIndex:
+    """Keeps, for every arbitration ID seen, the sequence numbers of its frames"""
+
+    def __init__(self):
+        self._ids: Dict[int, SequenceVector] = {}
+
+    def __contains__(self, arbitration_id: int) -> bool:
+        return arbitration_id in self._ids
+
+    @property
+    def arbitration_ids(self) -> Iterable[int]:
+        return self._ids.keys()
+
+    def clear(self) -> None:
+        self._ids.clear()
+
+    def add(self, arbitration_ids: np.ndarray, first_sequence: int, head: int) -> None:
+        """
+        Indexes consecutive frames, the first one having the given sequence number.
+        Entries of frames evicted before `head` are dropped from the vectors that grow.
+        """
+        if len(arbitration_ids) == 0:
+            return
+        order = np.argsort(arbitration_ids, kind='stable')
+        unique_ids, starts = np.unique(arbitration_ids[order], return_index=True)
+        sequences = order.astype(np.int64) + first_sequence
+        bounds = np.append(starts, len(order))
+        for arbitration_id, start, stop in zip(unique_ids.tolist(), bounds[:-1], bounds[1:]):
+            vector = self._ids.get(arbitration_id)
+            if vector is None:
+                vector = self._ids[arbitration_id] = SequenceVector()
+            else:
+                vector.discard_below(head)
+            vector.extend(sequences[start:stop])
+
+    def sequences(self, arbitration_ids: Iterable[int], head: int) -> np.ndarray:
+        """Returns the sorted sequence numbers of the retained frames with the given IDs"""
+        parts = []
+        for arbitration_id in arbitration_ids:
+            vector = self._ids.get(arbitration_id)
+            if vector is not None:
+                vector.discard_below(head)
+                parts.append(vector.values)
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        if len(parts) == 1:
+            return parts[0].copy()
+        return np.sort(np.concatenate(parts))
+
+
+class FilterEngine:
+    """
+    Applies a FrameFilter to a FrameStorage. A filter change only reads the index entries of the matching IDs,
+    and new frames are matched batch-wise as they arrive.
+    """
+
+    def __init__(self, storage: FrameStorage):
+        self._storage = storage
+        self._index = FrameIndex()
+        self._filter: Optional[FrameFilter] = None
+        self._id_matches: Dict[int, bool] = {}
+
+    @property
+    def filter(self) -> Optional[FrameFilter]:
+        return self._filter
+
+    def clear(self) -> None:
+        self._index.clear()
+
+    def add(self, first_sequence: int) -> np.ndarray:
+        """
+        Indexes the frames stored from the given sequence number onwards.
+        :return: the sequence numbers of the new frames matching the current filter
+        """
+        storage = self._storage
+        first_sequence = max(first_sequence, storage.head)
+        sequences = np.arange(first_sequence, storage.total, dtype=np.int64)
+        indices = sequences % storage.capacity
+        arbitration_ids = storage.arbitration_id[indices]
+        self._index.add(arbitration_ids, first_sequence, storage.head)
+        if self._filter is None:
+            return sequences
+        return sequences[self._matches(arbitration_ids, indices)]
+
+    def apply(self, frame_filter: Optional[FrameFilter]) -> np.ndarray:
+        """Sets the current filter. Returns the sequence numbers of the retained frames matching it"""
+        storage = self._storage
+        self._filter = frame_filter
+        self._id_matches = {}
+        if frame_filter is None:
+            return np.arange(storage.head, storage.total, dtype=np.int64)
+        if frame_filter.has_id_predicate:
+            matching_ids = [
+                arbitration_id for arbitration_id in self._index.arbitration_ids if self._match_id(arbitration_id)
+            ]
+            sequences = self._index.sequences(matching_ids, storage.head)
+        else:
+            sequences = np.arange(storage.head, storage.total, dtype=np.int64)
+        if frame_filter.has_residual_predicate:
+            sequences = sequences[frame_filter.matches_rows(storage, sequences % storage.capacity)]
+        return sequences
+
+    def _match_id(self, arbitration_id: int) -> bool:
+        matches = self._id_matches.get(arbitration_id)
+        if matches is None:
+            matches = self._id_matches[arbitration_id] = self._filter.matches_id(arbitration_id)
+        return matches
+
+    def _matches(self, arbitration_ids: np.ndarray, indices: np.ndarray) -> np.ndarray:
+        frame_filter = self._filter
+        keep = np.ones(len(indices), dtype=bool)
+        if frame_filter.has_id_predicate:
+            unique_ids, inverse = np.unique(arbitration_ids, return_inverse=True)
+            id_matches = np.fromiter(
+                (self._match_id(arbitration_id) for arbitration_id in unique_ids.tolist()),
+                dtype=bool,
+                count=len(unique_ids),
+            )
+            keep &= id_matches[inverse]
+        if frame_filter.has_residual_predicate:
+            keep &= frame_filter.matches_rows(self._storage, indices)
+        return keep
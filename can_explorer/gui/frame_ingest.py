@@ -0,0 +1,76 @@
+import collections
+import logging
+import threading
+from typing import Sequence
+
+import can
+from PyQt6.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot
+
+from can_explorer.gui.frame_storage import DEFAULT_CAPACITY
+
+logger = logging.getLogger(__name__)
+
+REFRESH_RATE_HZ = 30
+
+
+class FrameIngest(QObject):
+    """
+    Collects frames received on any thread and hands them over to the GUI thread in batches,
+    at most `refresh_rate_hz` times per second.
+    At most `max_pending` frames are kept between batches, the oldest ones being dropped: more would not fit in the
+    frame storage anyway, and a stalled GUI thread must not let the backlog grow without bound.
+    """
+
+    batch_ready = pyqtSignal(list)
+
+    def __init__(
+        self, refresh_rate_hz: int = REFRESH_RATE_HZ, parent: QObject = None, max_pending: int = DEFAULT_CAPACITY
+    ):
+        super().__init__(parent)
+        if refresh_rate_hz <= 0:
+            raise ValueError(f'Refresh rate must be positive. Got: {refresh_rate_hz=}')
+        if max_pending <= 0:
+            raise ValueError(f'Pending frames limit must be positive. Got: {max_pending=}')
+        self._pending = collections.deque(maxlen=max_pending)
+        self._lock = threading.Lock()
+        self._dropped = 0
+        self._timer = QTimer(self)
+        self._timer.setInterval(max(1, round(1000 / refresh_rate_hz)))
+        self._timer.timeout.connect(self.flush)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    @property
+    def dropped_count(self) -> int:
+        """Number of frames dropped because the pending frames exceeded `max_pending`"""
+        return self._dropped
+
+    def start(self) -> None:
+        self._timer.start()
+
+    def stop(self) -> None:
+        self._timer.stop()
+        self.flush()
+
+    def push(self, msg: can.Message) -> None:
+        """Thread safe. Queues a single frame for the next batch"""
+        self.push_many((msg,))
+
+    def push_many(self, messages: Sequence[can.Message]) -> None:
+        """Thread safe. Queues frames for the next batch, dropping the oldest pending ones beyond `max_pending`"""
+        pending = self._pending
+        with self._lock:
+            self._dropped += max(0, len(pending) + len(messages) - pending.maxlen)
+            pending.extend(messages)
+
+    @pyqtSlot()
+    def flush(self) -> None:
+        pending = self._pending
+        with self._lock:
+            if not pending:
+                return
+            batch = list(pending)
+            pending.clear()
+        self.batch_ready.emit(batch)
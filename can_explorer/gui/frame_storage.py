@@ -0,0 +1,169 @@
+import logging
+from typing import Dict, Sequence
+
+import can
+import numpy as np
+
+from can_explorer.transport.can_message import MAX_PAYLOAD_LENGTH, CanFrameFlag, FrameBatch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CAPACITY = 500_000
+
+
+class FrameStorage:
+    """
+    Fixed capacity ring buffer holding CAN frames in preallocated columns.
+
+    Every stored frame gets an absolute sequence number. The oldest retained frame has the number `head`
+    and the next frame to be stored will get the number `total`. Once the buffer is full, new frames evict
+    the oldest ones, so the memory used stays constant no matter how long a capture runs.
+    Rows are addressed oldest-first, row 0 being the frame with the sequence number `head`.
+
+    Along with every frame, a bitmask of the payload bytes that changed since the previous frame
+    with the same arbitration ID is stored in the `changed` column.
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        if capacity <= 0:
+            raise ValueError(f'Storage capacity must be positive. Got: {capacity=}')
+        self._capacity = capacity
+        self._head = 0
+        self._total = 0
+        self.timestamp = np.zeros(capacity, dtype=np.float64)
+        self.arbitration_id = np.zeros(capacity, dtype=np.uint32)
+        self.flags = np.zeros(capacity, dtype=np.uint8)
+        self.dlc = np.zeros(capacity, dtype=np.uint8)
+        self.data = np.zeros((capacity, MAX_PAYLOAD_LENGTH), dtype=np.uint8)
+        self.changed = np.zeros(capacity, dtype=np.uint64)
+        self._last_sequence: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return self._total - self._head
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def head(self) -> int:
+        return self._head
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    def index(self, row: int) -> int:
+        """Returns the physical column index of the given row"""
+        return (self._head + row) % self._capacity
+
+    def payload_length(self, index: int) -> int:
+        if self.flags[index] & CanFrameFlag.REMOTE:
+            return 0
+        return min(int(self.dlc[index]), MAX_PAYLOAD_LENGTH)
+
+    def payload(self, index: int) -> memoryview:
+        """Returns a view on the payload stored at the given physical index"""
+        return self.data[index, : self.payload_length(index)].data
+
+    def clear(self) -> None:
+        self._head = self._total
+        self._last_sequence.clear()
+
+    def discard(self, count: int) -> None:
+        """Drops the given number of oldest frames"""
+        self._head = min(self._total, self._head + count)
+
+    def append(self, msg: can.Message) -> int:
+        return self.extend((msg,))
+
+    def extend(self, messages: Sequence[can.Message]) -> int:
+        """
+        Stores the given frames, evicting the oldest ones if required.
+        :param messages: frames to store, oldest first
+        :return: the number of evicted frames
+        """
+        if not messages:
+            return 0
+        return self.extend_batch(FrameBatch.from_messages(messages, width=MAX_PAYLOAD_LENGTH))
+
+    def extend_batch(self, batch: FrameBatch) -> int:
+        """
+        Stores a batch of frames, evicting the oldest ones if required.
+        :return: the number of evicted frames
+        """
+        data = batch.data
+        if batch.width != MAX_PAYLOAD_LENGTH:
+            width = min(batch.width, MAX_PAYLOAD_LENGTH)
+            data = np.zeros((len(batch), MAX_PAYLOAD_LENGTH), dtype=np.uint8)
+            data[:, :width] = batch.data[:, :width]
+        return self.extend_columns(batch.timestamp, batch.arbitration_id, batch.flags, batch.dlc, data)
+
+    def extend_columns(
+        self,
+        timestamps: np.ndarray,
+        arbitration_ids: np.ndarray,
+        flags: np.ndarray,
+        dlcs: np.ndarray,
+        data: np.ndarray,
+    ) -> int:
+        """
+        Stores frames given as columns of equal length, evicting the oldest ones if required.
+        :param data: payload matrix with one row of MAX_PAYLOAD_LENGTH bytes per frame
+        :return: the number of evicted frames
+        """
+        count = len(timestamps)
+        if count == 0:
+            return 0
+        skipped = max(0, count - self._capacity)
+        if skipped:
+            timestamps, arbitration_ids, flags, dlcs, data = (
+                column[skipped:] for column in (timestamps, arbitration_ids, flags, dlcs, data)
+            )
+            self._total += skipped
+        length = count - skipped
+        previous = self._previous_sequences(arbitration_ids, flags)
+        start = self._total % self._capacity
+        first = min(length, self._capacity - start)
+        for column, values in (
+            (self.timestamp, timestamps),
+            (self.arbitration_id, arbitration_ids),
+            (self.flags, flags),
+            (self.dlc, dlcs),
+            (self.data, data),
+        ):
+            column[start : start + first] = values[:first]
+            column[: length - first] = values[first:]
+        self._total += length
+        evicted = max(0, self._total - self._capacity - self._head)
+        self._head += evicted
+        self._update_changed(start, previous)
+        return evicted
+
+    def _previous_sequences(self, arbitration_ids: np.ndarray, flags: np.ndarray) -> np.ndarray:
+        """Returns the sequence number of the previous frame with the same ID for every new frame, -1 if none"""
+        length = len(arbitration_ids)
+        keys = arbitration_ids.astype(np.int64) | (flags & CanFrameFlag.EXTENDED_ID).astype(np.int64) << 32
+        sequences = np.arange(self._total, self._total + length, dtype=np.int64)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        same = sorted_keys[1:] == sorted_keys[:-1]
+        previous = np.full(length, -1, dtype=np.int64)
+        previous[order[1:][same]] = sequences[order[:-1][same]]
+        last_sequence = self._last_sequence
+        for position in order[np.concatenate(([True], ~same))]:
+            previous[position] = last_sequence.get(int(keys[position]), -1)
+        for position in order[np.concatenate((~same, [True]))]:
+            last_sequence[int(keys[position])] = int(sequences[position])
+        return previous
+
+    def _update_changed(self, start: int, previous: np.ndarray) -> None:
+        indices = (start + np.arange(len(previous))) % self._capacity
+        valid = previous >= self._head
+        changed = np.zeros(len(previous), dtype=np.uint64)
+        if valid.any():
+            current = self.data[indices[valid]]
+            before = self.data[previous[valid] % self._capacity]
+            bits = np.packbits(current != before, axis=1, bitorder='little')
+            changed[valid] = bits.view('<u8').ravel()
+        self.changed[indices] = changed
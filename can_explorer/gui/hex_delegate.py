@@ -0,0 +1,87 @@
+import logging
+from typing import Optional, Tuple
+
+from PyQt6 import QtCore, QtGui, QtWidgets
+from PyQt6.QtCore import Qt, QModelIndex, QPointF, QRectF
+
+logger = logging.getLogger(__name__)
+
+PAYLOAD_ROLE = Qt.ItemDataRole.UserRole + 1
+CHANGED_MASK_ROLE = Qt.ItemDataRole.UserRole + 2
+
+HEX_BYTES = tuple(f'{value:02X}' for value in range(256))
+
+
+def format_hex(payload) -> str:
+    return ' '.join([HEX_BYTES[value] for value in payload])
+
+
+class HexPayloadDelegate(QtWidgets.QStyledItemDelegate):
+    """
+    Paints the payload bytes given by PAYLOAD_ROLE directly from prerendered glyphs, one per possible byte
+    value, highlighting the bytes flagged by CHANGED_MASK_ROLE. No display string is built while painting.
+    """
+
+    MARGIN = 3
+
+    def __init__(self, parent: Optional[QtCore.QObject] = None):
+        super().__init__(parent)
+        self._font: Optional[QtGui.QFont] = None
+        self._glyphs: Tuple[QtGui.QStaticText, ...] = ()
+        self._cell_width = 0
+        self._glyph_height = 0
+        self._highlight = QtGui.QColor(255, 230, 150)
+
+    def _prepare(self, font: QtGui.QFont) -> None:
+        if self._font is not None and font == self._font:
+            return
+        metrics = QtGui.QFontMetrics(font)
+        self._cell_width = metrics.horizontalAdvance('00 ')
+        self._glyph_height = metrics.height()
+        glyphs = []
+        for text in HEX_BYTES:
+            glyph = QtGui.QStaticText(text)
+            glyph.setTextFormat(Qt.TextFormat.PlainText)
+            glyph.prepare(QtGui.QTransform(), font)
+            glyphs.append(glyph)
+        self._glyphs = tuple(glyphs)
+        self._font = QtGui.QFont(font)
+
+    def paint(self, painter: QtGui.QPainter, option: QtWidgets.QStyleOptionViewItem, index: QModelIndex) -> None:
+        payload = index.data(PAYLOAD_ROLE)
+        if payload is None:
+            return super().paint(painter, option, index)
+        mask = index.data(CHANGED_MASK_ROLE) or 0
+        widget = option.widget
+        style = widget.style() if widget is not None else QtWidgets.QApplication.style()
+        style.drawPrimitive(QtWidgets.QStyle.PrimitiveElement.PE_PanelItemViewItem, option, painter, widget)
+        self._prepare(option.font)
+        rect = option.rect
+        is_selected = bool(option.state & QtWidgets.QStyle.StateFlag.State_Selected)
+        is_enabled = bool(option.state & QtWidgets.QStyle.StateFlag.State_Enabled)
+        text_role = QtGui.QPalette.ColorRole.HighlightedText if is_selected else QtGui.QPalette.ColorRole.Text
+        color_group = QtGui.QPalette.ColorGroup.Normal if is_enabled else QtGui.QPalette.ColorGroup.Disabled
+        cell_width = self._cell_width
+        glyphs = self._glyphs
+        top = rect.top() + (rect.height() - self._glyph_height) / 2
+        x = rect.left() + self.MARGIN
+        right = rect.right()
+        painter.save()
+        painter.setClipRect(rect)
+        painter.setFont(self._font)
+        painter.setPen(option.palette.color(color_group, text_role))
+        for position, value in enumerate(payload):
+            if x > right:
+                break
+            if mask >> position & 1:
+                painter.fillRect(QRectF(x, rect.top(), cell_width, rect.height()), self._highlight)
+            painter.drawStaticText(QPointF(x, top), glyphs[value])
+            x += cell_width
+        painter.restore()
+
+    def sizeHint(self, option: QtWidgets.QStyleOptionViewItem, index: QModelIndex) -> QtCore.QSize:
+        payload = index.data(PAYLOAD_ROLE)
+        if payload is None:
+            return super().sizeHint(option, index)
+        self._prepare(option.font)
+        return QtCore.QSize(len(payload) * self._cell_width + 2 * self.MARGIN, self._glyph_height + 2 * self.MARGIN)
@@ -9,6 +9,7 @@ from can_explorer.gui.about_dialog import AboutDialog
 import signal
 import logging
 from can_explorer.gui.can_raw_viewer import RawCanViewerModel, RawCanViewerView
+from can_explorer.gui.can_trace_viewer import CanTraceView
 from can_explorer.transport.can_connection import create_can_connection
 from can_explorer.util import canutils
 
@@ -54,12 +55,16 @@ class MainWindow(QMainWindow):
     def _add_new_can_connection(self, data: CanConfiguration):
         logger.info(f"Adding new connection: {data=}")
         can_raw_viewer = RawCanViewerView(data)
+        can_raw_viewer.filter_status_changed.connect(self.statusBar().showMessage)
         self.tab_widget.addTab(can_raw_viewer, data.connection_name)
+        self.tab_widget.addTab(can_raw_viewer.create_trace_view(), f"{data.connection_name} (Trace)")
 
     def _connect_to_bus(self):
         try:
             widget = self.tab_widget.currentWidget()
             logger.info(f"Connecting to selected bus: {widget}")
+            if isinstance(widget, CanTraceView):
+                widget = widget.source
             if isinstance(widget, RawCanViewerView):
                 channel = widget.configuration_data.channel
                 interface = canutils.get_interface_name(
@@ -25,12 +25,16 @@ class CanProtocol(BaseCanProtocol):
     transport; finally, connection_lost() will be called exactly once
     with either an exception object or None as an argument.
 
+    Transports receiving frames in bursts call frames_received() once
+    per burst instead of data_received() once per frame.
+
     State machine of calls:
 
-      start -> CM [-> DR*] [-> ER?] -> CL -> end
+      start -> CM [-> DR* | FR*] [-> ER?] -> CL -> end
 
     * CM: connection_made()
     * DR: data_received()
+    * FR: frames_received()
     * ER: eof_received()
     * CL: connection_lost()
     """
@@ -42,6 +46,24 @@ class CanProtocol(BaseCanProtocol):
         """
         logger.info('Data received')
 
+    def frames_received(self, frames):
+        """Called when a burst of frames is received.
+
+        The argument is a list of can.Message, oldest first. The
+        default implementation calls data_received() for every frame.
+        """
+        for frame in frames:
+            self.data_received(frame)
+
+    def error_received(self, exc):
+        """Called when a frame could not be sent.
+
+        The argument is the exception raised by the bus, or a
+        TxBufferFullError if the transmit buffer was full.  The
+        connection stays open.
+        """
+        logger.warning(f'Error received: {exc}')
+
     def eof_received(self):
         """Called when the other end calls write_eof() or equivalent.
 
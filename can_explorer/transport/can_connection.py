@@ -4,7 +4,7 @@ import urllib.parse
 from functools import partial
 import can_explorer.transport as tp
 from can_explorer.transport.isocan.isocan import *
-from can_explorer.transport.isotp.old_transport import *
+from can_explorer.transport.isotp.isotp import IsoTpTransport
 from can_explorer.transport.base_protocol import BaseCanProtocol
 from can_explorer.transport.j1939.j1939 import J1939Transport
 from can_explorer.transport.canopen.canopen import CanOpenTransport
@@ -40,6 +40,10 @@ def connection_for_can(
     *args,
     **kwargs,
 ):
+    """
+    Creates a transport of the given type on the bus. Transports created on the same bus object share a single
+    reader, dispatching every frame only to the transports interested in its arbitration id.
+    """
     original_protocol = protocol_factory()
     transport = can_type.transport()(
         loop=loop, protocol=original_protocol, bus=can_bus, *args, **kwargs
@@ -0,0 +1,341 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+import can
+
+from can_explorer.transport.can_filter import (
+    CAN_EFF_MASK,
+    CanFilter,
+    FilterPlacement,
+    apply_bus_filters,
+    matches_id_filters,
+)
+from can_explorer.transport.can_reader import DEFAULT_BURST_SIZE, CanReader
+
+logger = logging.getLogger(__name__)
+
+CAN_SFF_MASK = 0x7FF
+MAX_CACHED_ROUTES = 1 << 16
+MAX_PAUSED_FRAMES = 100_000  # Frames kept per paused subscription, the oldest being dropped beyond
+
+# Inclusive range of arbitration ids
+IdRange = Tuple[int, int]
+
+
+def _route_key(arbitration_id: int, is_extended: bool) -> int:
+    return arbitration_id | (is_extended << 31)
+
+
+def range_to_can_filters(id_range: IdRange, extended: Optional[bool] = None) -> List[CanFilter]:
+    """Smallest set of id/mask acceptance filters covering exactly the given id range"""
+    low, high = id_range
+    width = 29 if extended or high > CAN_SFF_MASK else 11
+    full_mask = (1 << width) - 1
+    can_filters = []
+    while low <= high:
+        # Largest aligned block starting at low that still fits in the range
+        size = low & -low if low else 1 << width
+        while low + size - 1 > high:
+            size >>= 1
+        can_filter: CanFilter = {'can_id': low, 'can_mask': full_mask & ~(size - 1)}
+        if extended is not None:
+            can_filter['extended'] = extended
+        can_filters.append(can_filter)
+        low += size
+    return can_filters
+
+
+class Subscription:
+    """Frames of a shared bus routed to one listener. Created by CanDispatcher.subscribe()"""
+
+    __slots__ = (
+        'callback',
+        'on_error',
+        'arbitration_ids',
+        'id_ranges',
+        'can_filters',
+        'is_extended',
+        'paused',
+        'placement',
+        'dropped',
+        '_pending',
+        '_lock',
+        '_loop',
+        '_dispatcher',
+    )
+
+    def __init__(
+        self,
+        dispatcher: 'CanDispatcher',
+        callback: Callable[[List[can.Message]], None],
+        loop: Optional[asyncio.AbstractEventLoop],
+        on_error: Optional[Callable[[Exception], None]],
+        arbitration_ids: Iterable[int],
+        id_ranges: Iterable[IdRange],
+        can_filters: Optional[List[CanFilter]],
+        is_extended: Optional[bool],
+        max_paused_frames: int = MAX_PAUSED_FRAMES,
+    ):
+        self.callback = callback
+        self.on_error = on_error
+        self.arbitration_ids = frozenset(arbitration_ids)
+        self.id_ranges = tuple(id_ranges)
+        self.can_filters = can_filters
+        self.is_extended = is_extended
+        self.paused = False
+        # Where the filters of this subscription run: hardware only if they are installed on the bus
+        self.placement = FilterPlacement.SOFTWARE
+        self.dropped = 0  # Frames lost while paused, because the pending queue was full
+        self._pending: Deque[can.Message] = deque(maxlen=max_paused_frames)
+        # Reentrant: a callback called on the reader thread may pause its subscription
+        self._lock = threading.RLock()
+        self._loop = loop
+        self._dispatcher = dispatcher
+
+    @property
+    def is_catch_all(self) -> bool:
+        return not self.arbitration_ids and not self.id_ranges and not self.can_filters
+
+    def matches(self, arbitration_id: int, is_extended: bool) -> bool:
+        if self.is_extended is not None and self.is_extended != is_extended:
+            return False
+        if self.is_catch_all or arbitration_id in self.arbitration_ids:
+            return True
+        for low, high in self.id_ranges:
+            if low <= arbitration_id <= high:
+                return True
+        if self.can_filters:
+            return matches_id_filters(arbitration_id, is_extended, self.can_filters)
+        return False
+
+    def to_can_filters(self) -> Optional[List[CanFilter]]:
+        """Acceptance filters letting through every frame of this subscription. None if it accepts every frame"""
+        if self.is_catch_all:
+            return None
+        extended = self.is_extended
+        can_filters: List[CanFilter] = []
+        for arbitration_id in sorted(self.arbitration_ids):
+            can_filter: CanFilter = {'can_id': arbitration_id, 'can_mask': CAN_EFF_MASK}
+            if extended is not None:
+                can_filter['extended'] = extended
+            can_filters.append(can_filter)
+        for id_range in self.id_ranges:
+            can_filters.extend(range_to_can_filters(id_range, extended))
+        if self.can_filters:
+            can_filters.extend(self.can_filters)
+        return can_filters
+
+    def pause(self) -> None:
+        """Frames routed to a paused subscription are kept, up to MAX_PAUSED_FRAMES, and delivered on resume()"""
+        with self._lock:
+            self.paused = True
+
+    def resume(self) -> None:
+        with self._lock:
+            self.paused = False
+            if self._pending:
+                frames = list(self._pending)
+                self._pending.clear()
+                self._deliver(self.callback, frames)
+
+    def set_filters(self, can_filters: Optional[List[CanFilter]]) -> FilterPlacement:
+        """Additional acceptance filters. Ids given at subscription still match regardless"""
+        return self._dispatcher.set_filters(self, can_filters)
+
+    def set_arbitration_ids(self, arbitration_ids: Iterable[int]) -> FilterPlacement:
+        return self._dispatcher.set_arbitration_ids(self, arbitration_ids)
+
+    def cancel(self) -> None:
+        self._dispatcher.unsubscribe(self)
+
+    def deliver(self, frames: List[can.Message]) -> None:
+        # Delivered under the lock, so that frames queued while paused are delivered before later ones
+        with self._lock:
+            if not self.paused:
+                self._deliver(self.callback, frames)
+                return
+            pending = self._pending
+            overflow = len(pending) + len(frames) - pending.maxlen
+            if overflow > 0:
+                if not self.dropped:
+                    logger.warning('Paused subscription overflowed, dropping its oldest frames')
+                self.dropped += overflow
+            pending.extend(frames)
+
+    def deliver_error(self, exc: Exception) -> None:
+        if self.on_error is not None:
+            self._deliver(self.on_error, exc)
+
+    def _deliver(self, callback: Callable, argument) -> None:
+        loop = self._loop
+        if loop is None:
+            callback(argument)
+        elif not loop.is_closed():
+            loop.call_soon_threadsafe(callback, argument)
+
+
+class CanDispatcher:
+    """
+    Single reader of a bus shared by several transports. Each received frame is classified once by arbitration id
+    through an exact id table, id ranges and catch-all subscriptions. The resulting routes are cached per id, so
+    a frame costs one dictionary lookup. A burst is split into one sub-batch per subscription.
+    The bus acceptance filters are kept at the union of all subscriptions.
+    Use dispatcher_for() to get the dispatcher of a bus.
+    """
+
+    def __init__(self, bus: can.BusABC, burst_size: int = DEFAULT_BURST_SIZE):
+        self._bus = bus
+        self._lock = threading.Lock()
+        self._subscriptions: List[Subscription] = []
+        self._exact: Dict[int, List[Subscription]] = {}
+        self._scanned: List[Subscription] = []
+        self._routes: Dict[int, Tuple[Subscription, ...]] = {}
+        self._placement = FilterPlacement.SOFTWARE
+        self._reader = CanReader(bus, self._dispatch, on_error=self._read_error, burst_size=burst_size)
+
+    @property
+    def bus(self) -> can.BusABC:
+        return self._bus
+
+    @property
+    def subscriptions(self) -> List[Subscription]:
+        return list(self._subscriptions)
+
+    @property
+    def is_active(self) -> bool:
+        return bool(self._subscriptions)
+
+    def subscribe(
+        self,
+        callback: Callable[[List[can.Message]], None],
+        arbitration_ids: Iterable[int] = (),
+        id_ranges: Iterable[IdRange] = (),
+        can_filters: Optional[List[CanFilter]] = None,
+        is_extended: Optional[bool] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+        max_paused_frames: int = MAX_PAUSED_FRAMES,
+    ) -> Subscription:
+        """
+        Routes the frames with the given ids to `callback`, in batches. Without ids, ranges or filters, every frame
+        is routed. Callbacks are called through the event loop if one is given, else on the reader thread.
+        :param is_extended: restricts the subscription to extended (True) or standard (False) frames
+        :param max_paused_frames: frames kept while the subscription is paused
+        """
+        subscription = Subscription(
+            self, callback, loop, on_error, arbitration_ids, id_ranges, can_filters, is_extended, max_paused_frames
+        )
+        with self._lock:
+            self._subscriptions.append(subscription)
+            self._rebuild()
+        self._reader.start()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """The reader stops with the last subscription. The bus is left open"""
+        with self._lock:
+            if subscription not in self._subscriptions:
+                return
+            self._subscriptions.remove(subscription)
+            self._rebuild()
+            is_active = bool(self._subscriptions)
+        if not is_active:
+            self._reader.stop()
+            _release(self)
+
+    def set_filters(self, subscription: Subscription, can_filters: Optional[List[CanFilter]]) -> FilterPlacement:
+        with self._lock:
+            subscription.can_filters = can_filters
+            self._rebuild()
+            return subscription.placement
+
+    def set_arbitration_ids(self, subscription: Subscription, arbitration_ids: Iterable[int]) -> FilterPlacement:
+        with self._lock:
+            subscription.arbitration_ids = frozenset(arbitration_ids)
+            self._rebuild()
+            return subscription.placement
+
+    def _rebuild(self) -> None:
+        """Rebuilds the dispatch tables and the bus filters. Called with the lock held"""
+        exact: Dict[int, List[Subscription]] = {}
+        scanned: List[Subscription] = []
+        for subscription in self._subscriptions:
+            for arbitration_id in subscription.arbitration_ids:
+                exact.setdefault(arbitration_id, []).append(subscription)
+            if subscription.is_catch_all or subscription.id_ranges or subscription.can_filters:
+                scanned.append(subscription)
+        self._exact = exact
+        self._scanned = scanned
+        # Replaced, not cleared: the reader thread may be routing with the old table
+        self._routes = {}
+        self._update_bus_filters()
+
+    def _update_bus_filters(self) -> None:
+        can_filters: Optional[List[CanFilter]] = []
+        for subscription in self._subscriptions:
+            subscription_filters = subscription.to_can_filters()
+            if subscription_filters is None:
+                can_filters = None
+                break
+            can_filters.extend(subscription_filters)
+        # Frames are matched again per subscription when routed: filters rejected by the backend need no fallback
+        self._placement, _ = apply_bus_filters(self._bus, can_filters)
+        logger.debug(f'Bus filters of {self._bus.channel_info} running in {self._placement}: {can_filters}')
+        # With a catch-all subscription, the bus accepts every frame and the others are filtered in software
+        bus_filtered = can_filters is not None and self._placement == FilterPlacement.HARDWARE
+        for subscription in self._subscriptions:
+            if bus_filtered and not subscription.is_catch_all:
+                subscription.placement = FilterPlacement.HARDWARE
+            else:
+                subscription.placement = FilterPlacement.SOFTWARE
+
+    def _route(self, arbitration_id: int, is_extended: bool) -> Tuple[Subscription, ...]:
+        candidates = self._exact.get(arbitration_id, [])
+        routes = [s for s in candidates if s.is_extended is None or s.is_extended == is_extended]
+        routes.extend(s for s in self._scanned if s not in routes and s.matches(arbitration_id, is_extended))
+        return tuple(routes)
+
+    def _dispatch(self, frames: List[can.Message]) -> None:
+        routes = self._routes
+        if len(routes) > MAX_CACHED_ROUTES:
+            routes = self._routes = {}
+        batches: Dict[Subscription, List[can.Message]] = {}
+        for msg in frames:
+            key = _route_key(msg.arbitration_id, msg.is_extended_id)
+            targets = routes.get(key)
+            if targets is None:
+                targets = routes[key] = self._route(msg.arbitration_id, msg.is_extended_id)
+            for subscription in targets:
+                batch = batches.get(subscription)
+                if batch is None:
+                    batches[subscription] = [msg]
+                else:
+                    batch.append(msg)
+        for subscription, batch in batches.items():
+            subscription.deliver(batch)
+
+    def _read_error(self, exc: Exception) -> None:
+        for subscription in self.subscriptions:
+            subscription.deliver_error(exc)
+
+
+_dispatchers: Dict[can.BusABC, CanDispatcher] = {}
+_dispatchers_lock = threading.Lock()
+
+
+def dispatcher_for(bus: can.BusABC) -> CanDispatcher:
+    """Returns the dispatcher reading the given bus, creating it if needed"""
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get(bus)
+        if dispatcher is None:
+            dispatcher = _dispatchers[bus] = CanDispatcher(bus)
+        return dispatcher
+
+
+def _release(dispatcher: CanDispatcher) -> None:
+    with _dispatchers_lock:
+        if _dispatchers.get(dispatcher.bus) is dispatcher and not dispatcher.is_active:
+            del _dispatchers[dispatcher.bus]
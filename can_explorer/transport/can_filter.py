@@ -0,0 +1,60 @@
+import enum
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import can
+
+logger = logging.getLogger(__name__)
+
+CAN_EFF_MASK = 0x1FFFFFFF
+
+CanFilter = Dict[str, int | bool]
+
+
+@enum.unique
+class FilterPlacement(enum.IntEnum):
+    HARDWARE = enum.auto()  # Kernel or controller acceptance filter. Rejected frames never reach python
+    SOFTWARE = enum.auto()  # Every frame is received and matched in python
+
+    def __str__(self) -> str:
+        return self.name.lower()
+
+
+def supports_hardware_filters(bus: can.BusABC) -> bool:
+    """Returns True if the bus backend forwards acceptance filters to the kernel or the hardware"""
+    return type(bus)._apply_filters is not can.BusABC._apply_filters
+
+
+def matches_filters(msg: can.Message, can_filters: Optional[List[CanFilter]]) -> bool:
+    """Software equivalent of the acceptance filters. See: can.BusABC.set_filters"""
+    return matches_id_filters(msg.arbitration_id, msg.is_extended_id, can_filters)
+
+
+def matches_id_filters(arbitration_id: int, is_extended: bool, can_filters: Optional[List[CanFilter]]) -> bool:
+    if not can_filters:
+        return True
+    for can_filter in can_filters:
+        if 'extended' in can_filter and can_filter['extended'] != is_extended:
+            continue
+        if (can_filter['can_id'] ^ arbitration_id) & can_filter['can_mask'] == 0:
+            return True
+    return False
+
+
+def apply_bus_filters(
+    bus: can.BusABC, can_filters: Optional[List[CanFilter]]
+) -> Tuple[FilterPlacement, Optional[List[CanFilter]]]:
+    """
+    Installs the given acceptance filters on the bus.
+    :return: where the filters are running and the filters the caller still has to match in software,
+    in case the backend rejected them
+    """
+    try:
+        bus.set_filters(can_filters)
+    except (can.CanError, OSError, ValueError) as e:
+        logger.warning(f'Backend rejected acceptance filters {can_filters}. Falling back to software: {e}')
+        bus.set_filters(None)
+        return FilterPlacement.SOFTWARE, can_filters
+    if supports_hardware_filters(bus):
+        return FilterPlacement.HARDWARE, None
+    return FilterPlacement.SOFTWARE, None
@@ -1,11 +1,44 @@
 import logging
 import asyncio
+import enum
 from dataclasses import dataclass
-from can_explorer.transport.isotp.addressing import AddressInfo
+from typing import Iterable, List, Sequence
 import can
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+CAN_PAYLOAD_LENGTH = 8
+MAX_PAYLOAD_LENGTH = 64
+
+
+@enum.unique
+class CanFrameFlag(enum.IntFlag):
+    """
+    Per-frame boolean attributes packed into a single byte, so that frames can be stored column-wise
+    """
+
+    RX = 0x01
+    FD = 0x02
+    EXTENDED_ID = 0x04
+    REMOTE = 0x08
+    ERROR = 0x10
+    BITRATE_SWITCH = 0x20
+    ERROR_STATE_INDICATOR = 0x40
+
+    @staticmethod
+    def from_can(msg: can.Message) -> int:
+        """Packs the boolean attributes of a python-can message into an integer of CanFrameFlag bits"""
+        return (
+            msg.is_rx
+            | msg.is_fd << 1
+            | msg.is_extended_id << 2
+            | msg.is_remote_frame << 3
+            | msg.is_error_frame << 4
+            | msg.bitrate_switch << 5
+            | msg.error_state_indicator << 6
+        )
+
 
 @dataclass(slots=True)
 class CanMessage:
@@ -18,18 +51,22 @@ class CanMessage:
 
     @classmethod
     def from_can(cls, msg: can.Message) -> 'CanMessage':
-        address_info = AddressInfo()
         return cls(
             arbitration_id=msg.arbitration_id,
             dlc=msg.dlc,
             data=msg.data,
-            is_extended_id=msg.is_fd,
+            is_extended_id=msg.is_extended_id,
             is_fd=msg.is_fd,
         )
 
-    @classmethod
-    def export(cls) -> can.Message:
-        return can.Message()
+    def export(self) -> can.Message:
+        return can.Message(
+            arbitration_id=self.arbitration_id,
+            dlc=self.dlc,
+            data=self.data,
+            is_extended_id=self.is_extended_id,
+            is_fd=self.is_fd,
+        )
 
     def decode_dlc(self, dlc: int) -> int:
         dlc_map = self.DLC_MAP
@@ -37,3 +74,123 @@ class CanMessage:
             dlc_map = dlc_map + [12, 16, 20, 24, 32, 48, 64]
         assert dlc < len(dlc_map), f'Given {dlc=} out of range: {dlc_map=}'
         return dlc_map[dlc]
+
+
+@dataclass(slots=True)
+class FrameBatch:
+    """
+    Frames stored column-wise: one array per attribute and a payload matrix padded with zeros, so that batches of
+    thousands of frames are passed, sliced and concatenated without an object per frame.
+    `dlc` is the payload length in bytes, as in can.Message. Slicing returns views on the columns.
+    """
+
+    timestamp: np.ndarray  # float64
+    arbitration_id: np.ndarray  # uint32
+    flags: np.ndarray  # uint8 of CanFrameFlag bits
+    dlc: np.ndarray  # uint8
+    data: np.ndarray  # uint8, one row of `width` bytes per frame
+
+    def __post_init__(self):
+        count = len(self.timestamp)
+        if not len(self.arbitration_id) == len(self.flags) == len(self.dlc) == len(self.data) == count:
+            raise ValueError(f'Columns of different lengths for a batch of {count} frames')
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def __getitem__(self, key) -> 'FrameBatch':
+        """:param key: index, slice, array of indices or boolean mask"""
+        if isinstance(key, (int, np.integer)):
+            key = slice(key, key + 1 if key != -1 else None)
+        return FrameBatch(self.timestamp[key], self.arbitration_id[key], self.flags[key], self.dlc[key], self.data[key])
+
+    @property
+    def width(self) -> int:
+        """Bytes of each payload row"""
+        return self.data.shape[1]
+
+    @classmethod
+    def empty(cls, count: int = 0, width: int = CAN_PAYLOAD_LENGTH) -> 'FrameBatch':
+        """:return: a batch of `count` zeroed frames, to be filled column-wise"""
+        return cls(
+            np.zeros(count, dtype=np.float64),
+            np.zeros(count, dtype=np.uint32),
+            np.zeros(count, dtype=np.uint8),
+            np.zeros(count, dtype=np.uint8),
+            np.zeros((count, width), dtype=np.uint8),
+        )
+
+    @classmethod
+    def from_messages(cls, messages: Sequence[can.Message], width: int | None = None) -> 'FrameBatch':
+        """
+        :param width: bytes of each payload row, longer payloads are truncated. By default 8, or 64 if a payload
+        does not fit in 8 bytes
+        """
+        count = len(messages)
+        if width is None:
+            width = CAN_PAYLOAD_LENGTH
+            if any(len(msg.data) > CAN_PAYLOAD_LENGTH for msg in messages):
+                width = MAX_PAYLOAD_LENGTH
+        timestamps = np.fromiter((msg.timestamp for msg in messages), dtype=np.float64, count=count)
+        arbitration_ids = np.fromiter((msg.arbitration_id for msg in messages), dtype=np.uint32, count=count)
+        flags = np.fromiter((CanFrameFlag.from_can(msg) for msg in messages), dtype=np.uint8, count=count)
+        dlcs = np.fromiter((msg.dlc for msg in messages), dtype=np.uint8, count=count)
+        payload = b''.join(bytes(msg.data[:width]).ljust(width, b'\x00') for msg in messages)
+        data = np.frombuffer(payload, dtype=np.uint8).reshape(count, width)
+        return cls(timestamps, arbitration_ids, flags, dlcs, data)
+
+    @classmethod
+    def concatenate(cls, batches: Iterable['FrameBatch']) -> 'FrameBatch':
+        """:return: the frames of the batches in one batch, padded to the widest payload rows"""
+        batches = list(batches)
+        if not batches:
+            return cls.empty()
+        width = max(batch.width for batch in batches)
+        data = np.zeros((sum(len(batch) for batch in batches), width), dtype=np.uint8)
+        start = 0
+        for batch in batches:
+            data[start : start + len(batch), : batch.width] = batch.data
+            start += len(batch)
+        return cls(
+            np.concatenate([batch.timestamp for batch in batches]),
+            np.concatenate([batch.arbitration_id for batch in batches]),
+            np.concatenate([batch.flags for batch in batches]),
+            np.concatenate([batch.dlc for batch in batches]),
+            data,
+        )
+
+    def payload(self, index: int) -> memoryview:
+        """:return: a view on the payload of a frame"""
+        if self.flags[index] & CanFrameFlag.REMOTE:
+            return self.data[index, :0].data
+        return self.data[index, : min(int(self.dlc[index]), self.width)].data
+
+    def to_messages(self) -> List[can.Message]:
+        width = self.width
+        payload = self.data.tobytes()
+        # Plain ints: operations on IntFlag members build new members
+        remote_flag, extended_flag = int(CanFrameFlag.REMOTE), int(CanFrameFlag.EXTENDED_ID)
+        error_flag, fd_flag, rx_flag = int(CanFrameFlag.ERROR), int(CanFrameFlag.FD), int(CanFrameFlag.RX)
+        brs_flag, esi_flag = int(CanFrameFlag.BITRATE_SWITCH), int(CanFrameFlag.ERROR_STATE_INDICATOR)
+        messages = []
+        append = messages.append
+        rows = zip(self.timestamp.tolist(), self.arbitration_id.tolist(), self.flags.tolist(), self.dlc.tolist())
+        for row, (timestamp, arbitration_id, flags, dlc) in enumerate(rows):
+            remote = flags & remote_flag
+            start = row * width
+            append(
+                can.Message(
+                    timestamp=timestamp,
+                    arbitration_id=arbitration_id,
+                    is_extended_id=flags & extended_flag != 0,
+                    is_remote_frame=remote != 0,
+                    is_error_frame=flags & error_flag != 0,
+                    dlc=dlc,
+                    data=None if remote else payload[start : start + min(dlc, width)],
+                    is_fd=flags & fd_flag != 0,
+                    is_rx=flags & rx_flag != 0,
+                    bitrate_switch=flags & brs_flag != 0,
+                    error_state_indicator=flags & esi_flag != 0,
+                )
+            )
+        return messages
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import threading
+from typing import Callable, List, Optional
+
+import can
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BURST_SIZE = 1024
+DEFAULT_POLL_TIMEOUT = 0.1
+
+
+class CanReader:
+    """
+    Drains a bus from a dedicated thread. Every blocking receive is followed by non-blocking ones until
+    the bus is empty or `burst_size` frames were read, and the whole burst is handed over at once.
+    Batches are delivered through the event loop if one is given, else directly on the reader thread.
+    Pausing and stopping take effect within `poll_timeout` seconds.
+    """
+
+    def __init__(
+        self,
+        bus: can.BusABC,
+        on_frames: Callable[[List[can.Message]], None],
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+        burst_size: int = DEFAULT_BURST_SIZE,
+        poll_timeout: float = DEFAULT_POLL_TIMEOUT,
+    ):
+        if burst_size <= 0:
+            raise ValueError(f'Burst size must be positive. Got: {burst_size=}')
+        self._bus = bus
+        self._on_frames = on_frames
+        self._on_error = on_error
+        self._loop = loop
+        self._burst_size = burst_size
+        self._poll_timeout = poll_timeout
+        self._reading = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_reading(self) -> bool:
+        return self._reading.is_set() and not self._stopping.is_set()
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.is_running:
+            return
+        self._stopping.clear()
+        self._reading.set()
+        self._thread = threading.Thread(target=self._run, name=f'CanReader-{self._bus.channel_info}', daemon=True)
+        self._thread.start()
+
+    def pause(self) -> None:
+        self._reading.clear()
+
+    def resume(self) -> None:
+        self._reading.set()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stopping.set()
+        self._reading.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout if timeout is not None else 2 * self._poll_timeout + 1.0)
+        self._thread = None
+
+    def _deliver(self, callback: Callable, argument) -> None:
+        if self._loop is None:
+            callback(argument)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(callback, argument)
+
+    def _run(self) -> None:
+        bus = self._bus
+        burst_size = self._burst_size
+        poll_timeout = self._poll_timeout
+        logger.info(f'Reading frames from: {bus.channel_info}')
+        while not self._stopping.is_set():
+            if not self._reading.wait(poll_timeout):
+                continue
+            try:
+                msg = bus.recv(timeout=poll_timeout)
+                if msg is None:
+                    continue
+                batch = [msg]
+                while len(batch) < burst_size:
+                    msg = bus.recv(timeout=0)
+                    if msg is None:
+                        break
+                    batch.append(msg)
+            except Exception as e:
+                logger.error(f'Stopped reading from {bus.channel_info}: {e}')
+                if self._on_error is not None:
+                    self._deliver(self._on_error, e)
+                break
+            if self._stopping.is_set():
+                break
+            self._deliver(self._on_frames, batch)
+        logger.info(f'Stopped reading frames from: {bus.channel_info}')
@@ -0,0 +1,386 @@
+import asyncio
+import collections
+import errno
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import can
+
+from can_explorer.util.timing import SLEEP_ACCURACY, now, sleep_until
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HIGH_WATER = 16 * 1024
+DEFAULT_MAX_SIZE = 256 * 1024
+DEFAULT_SEND_TIMEOUT = 0.1
+DEFAULT_SEND_RETRIES = 5
+RETRY_DELAY = 0.001
+
+
+class TxBufferFullError(BufferError):
+    pass
+
+
+class SendTimeoutError(can.CanOperationError):
+    """A frame could not be sent before its deadline"""
+
+
+def frame_size(msg: can.Message) -> int:
+    """Size accounted in the write buffer for a frame: its payload length, at least one byte"""
+    return max(1, len(msg.data))
+
+
+class PacedTrain:
+    """
+    Frames sent in order, each at least `separation` seconds after the previous one was sent, e.g. the
+    ConsecutiveFrames of an ISO-TP block and their STmin. Created by CanWriteBuffer.write_paced()
+    """
+
+    __slots__ = ('frames', 'separation', 'on_done', 'send_timeout', 'position', 'cancelled')
+
+    def __init__(
+        self,
+        frames: Sequence[can.Message],
+        separation: float,
+        on_done: Callable[[Optional[Exception], float], None],
+        send_timeout: Optional[float] = None,
+    ):
+        self.frames = frames
+        self.separation = separation
+        self.on_done = on_done
+        self.send_timeout = send_timeout  # Time each frame may take to be sent, None for the buffer's retries
+        self.position = 0  # Index of the next frame to send
+        self.cancelled = False
+
+    def remaining_size(self) -> int:
+        return sum(frame_size(msg) for msg in self.frames[self.position :])
+
+
+def send_with_retry(
+    bus: can.BusABC, msg: can.Message, timeout: float = DEFAULT_SEND_TIMEOUT, retries: int = DEFAULT_SEND_RETRIES
+) -> None:
+    """Sends a frame, retrying while the controller's transmit buffer is full. Raises the last error"""
+    for attempt in range(retries + 1):
+        try:
+            bus.send(msg, timeout=timeout)
+            return
+        except can.CanOperationError:
+            if attempt == retries:
+                raise
+            time.sleep(RETRY_DELAY)
+
+
+def _is_buffer_full(error: can.CanOperationError) -> bool:
+    """True for the transient errors of a full transmit buffer, as opposed to e.g. a controller in bus-off"""
+    return error.error_code in (None, errno.ENOBUFS, errno.EAGAIN)
+
+
+def send_before(bus: can.BusABC, msg: can.Message, deadline: float, timeout: float = DEFAULT_SEND_TIMEOUT) -> None:
+    """
+    Sends a frame, retrying while the controller's transmit buffer is full, until the now() deadline.
+    Raises SendTimeoutError once the deadline passed, other errors of the bus as they are
+    """
+    while True:
+        remaining = deadline - now()
+        if remaining <= 0:
+            raise SendTimeoutError(f'Frame not sent in time: {msg}')
+        try:
+            bus.send(msg, timeout=min(timeout, remaining))
+        except can.CanOperationError as e:
+            if not _is_buffer_full(e):
+                raise
+            if now() + RETRY_DELAY >= deadline:
+                raise SendTimeoutError(f'Frame not sent in time: {msg}') from e
+            time.sleep(RETRY_DELAY)
+            continue
+        if now() > deadline:
+            # Sent, but by a backend ignoring the timeout: the deadline was missed all the same
+            raise SendTimeoutError(f'Frame sent after its deadline: {msg}')
+        return
+
+
+class CanWriteBuffer:
+    """
+    Transmit queue drained to the bus by a dedicated thread, so that writers never block on bus.send().
+
+    Implements the write flow control of asyncio transports: `on_pause` is called synchronously by write()
+    once the buffered size goes strictly over the high-water mark, and `on_resume` once it drains to the
+    low-water mark. Frames the controller keeps rejecting (TX buffer full) and frames written while the queue
+    holds more than `max_size` bytes are dropped and reported through `on_error`.
+    Callbacks invoked from the writer thread are delivered through the event loop if one is given.
+    Pause and resume are decided under the queue lock and notified in order, so that they always alternate.
+
+    Paced trains (see write_paced()) are sent by the same thread, interleaved with the queued frames: many paced
+    transfers share the bus without a thread each, and a train waiting for its separation time holds back nothing.
+    """
+
+    def __init__(
+        self,
+        bus: can.BusABC,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        on_pause: Optional[Callable[[], None]] = None,
+        on_resume: Optional[Callable[[], None]] = None,
+        on_error: Optional[Callable[[Exception], None]] = None,
+        high: Optional[int] = None,
+        low: Optional[int] = None,
+        max_size: int = DEFAULT_MAX_SIZE,
+        send_timeout: float = DEFAULT_SEND_TIMEOUT,
+        send_retries: int = DEFAULT_SEND_RETRIES,
+    ):
+        self._bus = bus
+        self._loop = loop
+        self._on_pause = on_pause
+        self._on_resume = on_resume
+        self._on_error = on_error
+        self._max_size = max_size
+        self._send_timeout = send_timeout
+        self._send_retries = send_retries
+        self._queue = collections.deque()
+        # Paced trains by time of their next frame: (due, sequence, train)
+        self._trains: List[Tuple[float, int, PacedTrain]] = []
+        self._train_sequence = itertools.count()
+        self._sending: Optional[PacedTrain] = None  # Train taken off the heap while its frame is sent
+        self._size = 0
+        self._condition = threading.Condition()
+        self._paused = False
+        self._resume_scheduled = False
+        # Held while a flow control change is decided and notified. Reentrant: on_pause may write
+        self._flow_lock = threading.RLock()
+        self._closing = False
+        self._on_closed: Optional[Callable[[], None]] = None
+        self._thread: Optional[threading.Thread] = None
+        self._high = self._low = 0
+        self.set_limits(high, low)
+
+    @property
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def get_size(self) -> int:
+        return self._size
+
+    def get_limits(self) -> Tuple[int, int]:
+        return self._low, self._high
+
+    def set_limits(self, high: Optional[int] = None, low: Optional[int] = None) -> None:
+        if high is None:
+            high = DEFAULT_HIGH_WATER if low is None else 4 * low
+        if low is None:
+            low = high // 4
+        if not high >= low >= 0:
+            raise ValueError(f'high ({high!r}) must be >= low ({low!r}) must be >= 0')
+        self._high = high
+        self._low = low
+        self._update_flow()
+
+    def write(self, msg: can.Message) -> bool:
+        """Queues a frame for transmission. Returns False if the frame was dropped"""
+        if self._closing:
+            logger.warning(f'Dropping frame written to closing transport: {msg}')
+            return False
+        size = frame_size(msg)
+        with self._condition:
+            if self._size + size > self._max_size:
+                error = TxBufferFullError(f'TX buffer full ({self._size} bytes). Dropping: {msg}')
+            else:
+                error = None
+                self._queue.append(msg)
+                self._size += size
+                self._condition.notify()
+        if error is not None:
+            self._report_error(error, deliver=False)
+            return False
+        self._start()
+        self._update_flow()
+        return True
+
+    def write_paced(
+        self,
+        frames: Sequence[can.Message],
+        separation: float,
+        on_done: Callable[[Optional[Exception], float], None],
+        not_before: float = 0.0,
+        send_timeout: Optional[float] = None,
+    ) -> bool:
+        """
+        Queues frames sent in order, each at least `separation` seconds after the previous one, timed from the
+        actual transmission of the previous frame. Separations below SLEEP_ACCURACY are met by spinning.
+        :param on_done: called with the error aborting the train, None if all frames were sent, and the now() time
+        the last frame was sent. Delivered through the event loop if one is given
+        :param not_before: now() time before which the first frame is not sent
+        :param send_timeout: time each frame may take to be sent once due. Its expiry aborts the train with a
+        SendTimeoutError. None to retry like queued frames
+        :return: False if the frames were dropped because the buffer is closing or full. on_done is not called then
+        """
+        if self._closing:
+            logger.warning(f'Dropping {len(frames)} frames written to closing transport')
+            return False
+        size = sum(frame_size(msg) for msg in frames)
+        with self._condition:
+            if self._size + size > self._max_size:
+                error = TxBufferFullError(f'TX buffer full ({self._size} bytes). Dropping {len(frames)} frames')
+            else:
+                error = None
+                train = PacedTrain(frames, separation, on_done, send_timeout)
+                heapq.heappush(self._trains, (not_before, next(self._train_sequence), train))
+                self._size += size
+                self._condition.notify()
+        if error is not None:
+            self._report_error(error, deliver=False)
+            return False
+        self._start()
+        self._update_flow()
+        return True
+
+    def close(self, on_closed: Optional[Callable[[], None]] = None) -> None:
+        """Stops accepting frames. `on_closed` is called once the queued frames are sent"""
+        with self._condition:
+            self._closing = True
+            self._on_closed = on_closed
+            self._condition.notify()
+            running = self._thread is not None
+        if not running:
+            self._closed()
+
+    def abort(self, on_closed: Optional[Callable[[], None]] = None) -> None:
+        """Drops the queued frames and stops"""
+        with self._condition:
+            self._queue.clear()
+            trains = [train for _, _, train in self._trains]
+            if self._sending is not None:
+                trains.append(self._sending)
+            self._trains.clear()
+            self._size = 0
+            # Under the lock: the writer thread checks it once the frame in flight is sent
+            for train in trains:
+                train.cancelled = True
+        for train in trains:
+            self._deliver(train.on_done, can.CanOperationError('Transport aborted'), now())
+        self.close(on_closed)
+
+    def _start(self) -> None:
+        if self._thread is not None:
+            return
+        with self._condition:
+            if self._thread is not None or self._closing:
+                return
+            self._thread = threading.Thread(target=self._run, name=f'CanWriter-{self._bus.channel_info}', daemon=True)
+        self._thread.start()
+
+    def _deliver(self, callback: Callable, *args) -> None:
+        if self._loop is None:
+            callback(*args)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(callback, *args)
+
+    def _report_error(self, error: Exception, deliver: bool = True) -> None:
+        logger.warning(error)
+        if self._on_error is None:
+            return
+        if deliver:
+            self._deliver(self._on_error, error)
+        else:
+            self._on_error(error)
+
+    def _update_flow(self) -> None:
+        """
+        Pauses or resumes the writers according to the buffered size. Called by writers, and by the writer thread
+        through the event loop if one is given, so that a resume is never notified after a later pause
+        """
+        with self._flow_lock:
+            with self._condition:
+                self._resume_scheduled = False
+                if not self._paused and self._size > self._high:
+                    self._paused = True
+                    callback = self._on_pause
+                elif self._paused and self._size <= self._low:
+                    self._paused = False
+                    callback = self._on_resume
+                else:
+                    return
+            if callback is not None:
+                callback()
+
+    def _closed(self) -> None:
+        on_closed, self._on_closed = self._on_closed, None
+        if on_closed is not None:
+            self._deliver(on_closed)
+
+    def _send(self, msg: can.Message) -> None:
+        try:
+            send_with_retry(self._bus, msg, self._send_timeout, self._send_retries)
+        except can.CanError as e:
+            self._report_error(e)
+
+    def _run(self) -> None:
+        queue = self._queue
+        trains = self._trains
+        condition = self._condition
+        while True:
+            with condition:
+                while True:
+                    train = msg = None
+                    if trains:
+                        due = trains[0][0]
+                        remaining = due - now()
+                        # A frame due sooner than the OS can sleep is waited for by sleep_until(), spinning
+                        if remaining <= 0 or (not queue and remaining < SLEEP_ACCURACY):
+                            train = self._sending = heapq.heappop(trains)[2]
+                            break
+                    if queue:
+                        msg = queue[0]
+                        break
+                    if not trains:
+                        if self._closing:
+                            break
+                        condition.wait()
+                    else:
+                        condition.wait(remaining - SLEEP_ACCURACY)
+                if train is None and msg is None:
+                    break
+            if train is not None:
+                sleep_until(due)
+                self._send_train_frame(train)
+            else:
+                self._send(msg)
+                with condition:
+                    if queue and queue[0] is msg:
+                        queue.popleft()
+                        self._size -= frame_size(msg)
+            with condition:
+                resume = self._paused and self._size <= self._low and not self._resume_scheduled
+                if resume:
+                    self._resume_scheduled = True
+            if resume:
+                self._deliver(self._update_flow)
+        self._closed()
+
+    def _send_train_frame(self, train: PacedTrain) -> None:
+        """Sends the next frame of a train, then queues the train again for the following one"""
+        msg = train.frames[train.position]
+        try:
+            if train.send_timeout is not None:
+                send_before(self._bus, msg, now() + train.send_timeout, self._send_timeout)
+            else:
+                send_with_retry(self._bus, msg, self._send_timeout, self._send_retries)
+            error = None
+        except can.CanError as e:
+            error = e
+        sent = now()
+        with self._condition:
+            self._sending = None
+            if train.cancelled:
+                return
+            if error is not None:
+                self._size -= train.remaining_size()
+            else:
+                self._size -= frame_size(msg)
+                train.position += 1
+                if train.position < len(train.frames):
+                    heapq.heappush(self._trains, (sent + train.separation, next(self._train_sequence), train))
+                    return
+        self._deliver(train.on_done, error, sent)
@@ -1,8 +1,170 @@
 import logging
 import asyncio
+from typing import Dict, List, Optional, Tuple
+
+import can
+
+from can_explorer.transport.can_dispatcher import dispatcher_for
+from can_explorer.transport.can_writer import CanWriteBuffer
+from can_explorer.transport.canopen.nmt import FUNCTION_EMERGENCY, FUNCTION_ERROR_CONTROL, NmtSupervisor
+from can_explorer.transport.canopen.pdo import ObjectDictionary, PdoDecoder, PdoMapping, upload_mappings
+from can_explorer.transport.canopen.sdo import SDO_TIMEOUT, SDO_TX_BASE, SdoClient
+from can_explorer.transport.timer import TimerWheel
 
 logger = logging.getLogger(__name__)
 
 
 class CanOpenTransport(asyncio.Transport):
-    pass
+    """
+    CANopen endpoint. The protocol receives every frame of the network, while the responses of the SDO servers are
+    routed to the SDO client of their node, created by sdo(), and the heartbeats and emergencies to the NMT supervisor.
+    The PDOs of the mappings added to the PDO decoder are decoded in batches, passed to the pdos_received() of the
+    protocol if it has one
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        protocol: asyncio.Protocol,
+        bus: can.BusABC,
+        sdo_timeout: float = SDO_TIMEOUT,
+    ):
+        self._protocol = protocol
+        self._loop = loop
+        self._bus = bus
+        self._sdo_timeout = sdo_timeout
+        self._closing = False
+        self._writer = CanWriteBuffer(
+            bus,
+            loop=loop,
+            on_pause=lambda: self._protocol.pause_writing(),
+            on_resume=lambda: self._protocol.resume_writing(),
+            on_error=self._write_error,
+        )
+        self._timers = TimerWheel(loop)
+        self._sdo_clients: Dict[int, SdoClient] = {}  # COB-ID of the server responses -> client
+        self._pdo_decoder = PdoDecoder()
+        self._nmt = NmtSupervisor(loop, self._writer.write, timers=self._timers)
+        super().__init__(extra={"bus": bus})
+        # CANopen only uses 11 bit identifiers
+        self._dispatcher = dispatcher_for(bus)
+        self._subscription = self._dispatcher.subscribe(self._frames_received, is_extended=False, loop=loop)
+        loop.call_soon(self._protocol.connection_made, self)
+
+    def sdo(self, node_id: int) -> SdoClient:
+        """:return: the client of the default SDO of a node"""
+        client = self._sdo_clients.get(SDO_TX_BASE + node_id)
+        if client is None:
+            client = SdoClient(self._loop, node_id, self._writer.write, timeout=self._sdo_timeout, timers=self._timers)
+            self._sdo_clients[client.response_id] = client
+        return client
+
+    @property
+    def nmt(self) -> NmtSupervisor:
+        return self._nmt
+
+    @property
+    def pdo_decoder(self) -> PdoDecoder:
+        return self._pdo_decoder
+
+    async def read_pdo_mappings(self, node_id: int, dictionary: Optional[ObjectDictionary] = None) -> List[PdoMapping]:
+        """Reads the TPDO and RPDO mappings of a node over SDO and decodes its PDOs"""
+        sdo = self.sdo(node_id)
+        mappings = await upload_mappings(sdo, dictionary, transmit=True)
+        mappings += await upload_mappings(sdo, dictionary, transmit=False)
+        for mapping in mappings:
+            self._pdo_decoder.add(mapping)
+        return mappings
+
+    def _frames_received(self, frames: List[can.Message]) -> None:
+        if self._closing:
+            return
+        sdo_clients = self._sdo_clients
+        nmt = self._nmt
+        for msg in frames:
+            arbitration_id = msg.arbitration_id
+            function = arbitration_id >> 7
+            if function == FUNCTION_ERROR_CONTROL or function == FUNCTION_EMERGENCY:
+                nmt.frame_received(msg)
+                continue
+            client = sdo_clients.get(arbitration_id)
+            if client is not None:
+                client.frame_received(msg)
+        frames_received = getattr(self._protocol, "frames_received", None)
+        if frames_received is not None:
+            frames_received(frames)
+        else:
+            for msg in frames:
+                self._protocol.data_received(msg)
+        pdos_received = getattr(self._protocol, "pdos_received", None)
+        if pdos_received is not None and self._pdo_decoder.layouts:
+            pdos = self._pdo_decoder.decode_frames(frames)
+            if pdos:
+                pdos_received(pdos)
+
+    def is_reading(self) -> bool:
+        return not self._subscription.paused
+
+    def pause_reading(self) -> None:
+        self._subscription.pause()
+
+    def resume_reading(self) -> None:
+        self._subscription.resume()
+
+    def set_write_buffer_limits(self, high: Optional[int] = None, low: Optional[int] = None) -> None:
+        self._writer.set_limits(high, low)
+
+    def get_write_buffer_size(self) -> int:
+        return self._writer.get_size()
+
+    def get_write_buffer_limits(self) -> Tuple[int, int]:
+        return self._writer.get_limits()
+
+    def write(self, data: bytearray, arbitration_id: int, **kwargs) -> None:
+        """Queues a frame built from the given payload. Extra arguments are passed to can.Message"""
+        self.send(can.Message(data=data, arbitration_id=arbitration_id, is_extended_id=False, **kwargs))
+
+    def send(self, message: can.Message) -> bool:
+        """Queues a frame. Returns False if it was dropped because the transmit buffer is full"""
+        return self._writer.write(message)
+
+    def _write_error(self, exc: Exception) -> None:
+        error_received = getattr(self._protocol, "error_received", None)
+        if error_received is not None:
+            error_received(exc)
+        else:
+            logger.warning(f"Could not send frame: {exc}")
+
+    def _stop(self) -> None:
+        self._closing = True
+        self._subscription.cancel()
+        for client in self._sdo_clients.values():
+            client.close()
+        self._nmt.close()
+        self._timers.close()
+
+    def _connection_lost(self) -> None:
+        # Other transports may still use the bus
+        if not self._dispatcher.is_active:
+            self._bus.shutdown()
+        self._protocol.connection_lost(None)
+
+    def is_closing(self) -> bool:
+        return self._closing
+
+    def close(self) -> None:
+        """Stops reading. Pending SDO transfers are cancelled, the buffered frames are still sent"""
+        if not self._closing:
+            self._stop()
+            self._writer.close(self._connection_lost)
+
+    def abort(self) -> None:
+        if not self._closing:
+            self._stop()
+            self._writer.abort(self._connection_lost)
+
+    def set_protocol(self, protocol: asyncio.BaseProtocol) -> None:
+        self._protocol = protocol
+
+    def get_protocol(self) -> asyncio.BaseProtocol:
+        return self._protocol
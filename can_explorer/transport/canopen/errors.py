@@ -0,0 +1,59 @@
+import enum
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+@enum.unique
+class SdoAbortCode(enum.IntEnum):
+    """SDO abort codes. See CiA 301 7.2.4.3.17"""
+
+    TOGGLE_BIT_NOT_ALTERNATED = 0x05030000
+    TIMEOUT = 0x05040000
+    INVALID_COMMAND_SPECIFIER = 0x05040001
+    INVALID_BLOCK_SIZE = 0x05040002
+    INVALID_SEQUENCE_NUMBER = 0x05040003
+    CRC_ERROR = 0x05040004
+    OUT_OF_MEMORY = 0x05040005
+    UNSUPPORTED_ACCESS = 0x06010000
+    WRITE_ONLY = 0x06010001
+    READ_ONLY = 0x06010002
+    OBJECT_DOES_NOT_EXIST = 0x06020000
+    CANNOT_BE_MAPPED = 0x06040041
+    PDO_LENGTH_EXCEEDED = 0x06040042
+    PARAMETER_INCOMPATIBILITY = 0x06040043
+    INTERNAL_INCOMPATIBILITY = 0x06040047
+    HARDWARE_ERROR = 0x06060000
+    LENGTH_MISMATCH = 0x06070010
+    LENGTH_TOO_HIGH = 0x06070012
+    LENGTH_TOO_LOW = 0x06070013
+    SUBINDEX_DOES_NOT_EXIST = 0x06090011
+    INVALID_VALUE = 0x06090030
+    VALUE_TOO_HIGH = 0x06090031
+    VALUE_TOO_LOW = 0x06090032
+    MAX_LESS_THAN_MIN = 0x06090036
+    RESOURCE_NOT_AVAILABLE = 0x060A0023
+    GENERAL_ERROR = 0x08000000
+    CANNOT_TRANSFER = 0x08000020
+    LOCAL_CONTROL = 0x08000021
+    DEVICE_STATE = 0x08000022
+    NO_OBJECT_DICTIONARY = 0x08000023
+    NO_DATA = 0x08000024
+
+
+class SdoError(Exception):
+    def __init__(self, code: int, msg: Optional[str]):
+        try:
+            code = SdoAbortCode(code)
+            name = code.name
+        except ValueError:
+            # Manufacturer specific
+            name = f"{code:#010x}"
+        super().__init__(f"{name}: {msg}")
+        self._code = code
+        self._msg = msg
+
+    @property
+    def code(self) -> SdoAbortCode | int:
+        return self._code
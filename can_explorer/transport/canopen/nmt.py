@@ -0,0 +1,277 @@
+import asyncio
+import enum
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, List, Optional
+
+import can
+
+from can_explorer.transport.timer import Timer, TimerWheel
+
+logger = logging.getLogger(__name__)
+
+# Function codes of the predefined connection set, in the upper 4 bits of the COB-ID. See CiA 301 7.3.3
+FUNCTION_NMT = 0x0
+FUNCTION_EMERGENCY = 0x1  # Node id 0 is the SYNC object
+FUNCTION_ERROR_CONTROL = 0xE  # Heartbeat and node guarding
+NMT_ID = 0x000
+EMERGENCY_BASE = 0x080
+ERROR_CONTROL_BASE = 0x700
+BROADCAST = 0  # Node id of NMT commands addressed to all nodes
+MAX_NODE_ID = 127
+# Heartbeat consumer time, relative to the producer period: a lost node is detected less than a period after the
+# heartbeat it missed
+HEARTBEAT_TOLERANCE = 1.5
+TOGGLE = 0x80  # Toggle bit of node guarding responses
+
+
+@enum.unique
+class NmtState(enum.IntEnum):
+    """States in heartbeat and node guarding messages. See CiA 301 7.2.8.3.2"""
+
+    BOOTUP = 0x00
+    STOPPED = 0x04
+    OPERATIONAL = 0x05
+    PRE_OPERATIONAL = 0x7F
+
+
+@enum.unique
+class NmtCommand(enum.IntEnum):
+    START = 0x01
+    STOP = 0x02
+    ENTER_PRE_OPERATIONAL = 0x80
+    RESET_NODE = 0x81
+    RESET_COMMUNICATION = 0x82
+
+
+@dataclass(slots=True)
+class IntervalStatistics:
+    """Running mean and variance of the intervals between messages, by Welford's algorithm"""
+
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0
+    minimum: float = math.inf
+    maximum: float = 0.0
+
+    def add(self, interval: float) -> None:
+        self.count += 1
+        delta = interval - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (interval - self.mean)
+        if interval < self.minimum:
+            self.minimum = interval
+        if interval > self.maximum:
+            self.maximum = interval
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def jitter(self) -> float:
+        """Standard deviation of the intervals"""
+        return math.sqrt(self.variance)
+
+
+@dataclass(slots=True)
+class Emergency:
+    node_id: int
+    error_code: int
+    error_register: int
+    data: bytes
+    timestamp: float
+
+    @classmethod
+    def from_frame(cls, msg: can.Message) -> "Emergency":
+        data = bytes(msg.data) + bytes(max(0, 8 - len(msg.data)))
+        return cls(
+            msg.arbitration_id - EMERGENCY_BASE,
+            int.from_bytes(data[0:2], "little"),
+            data[2],
+            data[3:8],
+            msg.timestamp,
+        )
+
+
+@dataclass(slots=True)
+class NodeStatus:
+    node_id: int
+    state: Optional[NmtState] = None
+    alive: bool = False
+    lost: bool = False  # Reported lost, until heard again
+    period: Optional[float] = None  # Expected heartbeat or guard period, None if not supervised
+    guarding: bool = False
+    life_time_factor: int = 0
+    missed: int = 0  # Heartbeat consumer times elapsed and guard requests left unanswered
+    last_timestamp: Optional[float] = None
+    intervals: IntervalStatistics = field(default_factory=IntervalStatistics)
+    last_emergency: Optional[Emergency] = None
+    timer: Optional[Timer] = None
+    _toggle: Optional[int] = None  # Expected toggle bit of the next guard response, None for any
+    _pending_guards: int = 0
+
+
+class NmtSupervisor:
+    """
+    NMT master side of a network: NMT commands, heartbeat consumption and node guarding, and emergencies, for up to
+    the 127 nodes of a network. Every node has a single timer of one shared timer wheel, reset by each heartbeat
+    without allocation, so that supervising many nodes costs one loop callback per wheel tick while timers are armed.
+    A node missing its heartbeat is reported by on_node_lost as soon as its consumer time elapsed. The intervals
+    between heartbeats are kept per node, with their jitter.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        send: Callable[[can.Message], bool],
+        timers: Optional[TimerWheel] = None,
+        on_state_changed: Optional[Callable[[int, NmtState], None]] = None,
+        on_node_lost: Optional[Callable[[int], None]] = None,
+        on_emergency: Optional[Callable[[Emergency], None]] = None,
+    ):
+        """
+        :param send: queues a frame for transmission, e.g. CanWriteBuffer.write
+        :param on_state_changed: called with the node id and its new state, reported by a heartbeat or guard response
+        :param on_node_lost: called with the node id once it missed its heartbeat or its guarding life time elapsed
+        :param on_emergency: called with every emergency message
+        """
+        self._loop = loop
+        self._send = send
+        self._timers = timers if timers is not None else TimerWheel(loop)
+        self.on_state_changed = on_state_changed
+        self.on_node_lost = on_node_lost
+        self.on_emergency = on_emergency
+        self._nodes: List[NodeStatus] = [NodeStatus(node_id) for node_id in range(MAX_NODE_ID + 1)]
+
+    def node(self, node_id: int) -> NodeStatus:
+        return self._nodes[node_id]
+
+    def nodes(self) -> List[NodeStatus]:
+        """:return: the status of the nodes seen or supervised"""
+        return [node for node in self._nodes[1:] if node.state is not None or node.period is not None]
+
+    def send_command(self, command: NmtCommand, node_id: int = BROADCAST) -> None:
+        self._send(can.Message(arbitration_id=NMT_ID, data=bytes((command, node_id)), is_extended_id=False))
+
+    def monitor(self, node_id: int, period: float, timeout: Optional[float] = None) -> None:
+        """
+        Supervises the heartbeat of a node.
+        :param period: heartbeat producer time of the node
+        :param timeout: heartbeat consumer time, by default HEARTBEAT_TOLERANCE periods
+        """
+        node = self._supervised(node_id, period, timeout if timeout is not None else period * HEARTBEAT_TOLERANCE)
+        node.guarding = False
+        node.timer.reset()
+
+    def guard(self, node_id: int, guard_time: float, life_time_factor: int) -> None:
+        """Supervises a node by node guarding: remote requests every guard_time, lost after life_time_factor misses"""
+        if life_time_factor < 1:
+            raise ValueError(f"Invalid life time factor: {life_time_factor}")
+        node = self._supervised(node_id, guard_time, guard_time)
+        node.guarding = True
+        node.life_time_factor = life_time_factor
+        node._pending_guards = 0
+        node._toggle = None
+        self._request_guard(node)
+
+    def stop_supervision(self, node_id: int) -> None:
+        node = self._nodes[node_id]
+        node.period = None
+        node.guarding = False
+        if node.timer is not None:
+            node.timer.stop()
+
+    def close(self) -> None:
+        for node in self._nodes:
+            if node.timer is not None:
+                node.timer.stop()
+
+    def frames_received(self, frames: Iterable[can.Message]) -> None:
+        for msg in frames:
+            self.frame_received(msg)
+
+    def frame_received(self, msg: can.Message) -> None:
+        arbitration_id = msg.arbitration_id
+        function = arbitration_id >> 7
+        if function == FUNCTION_ERROR_CONTROL:
+            if not msg.is_remote_frame and msg.data:
+                self._error_control_received(self._nodes[arbitration_id - ERROR_CONTROL_BASE], msg)
+        elif function == FUNCTION_EMERGENCY and arbitration_id != EMERGENCY_BASE:
+            emergency = Emergency.from_frame(msg)
+            self._nodes[emergency.node_id].last_emergency = emergency
+            logger.warning(f"Emergency of node {emergency.node_id}: {emergency.error_code:#06x}")
+            if self.on_emergency is not None:
+                self.on_emergency(emergency)
+
+    def _supervised(self, node_id: int, period: float, timeout: float) -> NodeStatus:
+        if not 1 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f"Invalid node id: {node_id}")
+        node = self._nodes[node_id]
+        node.period = period
+        if node.timer is None:
+            node.timer = self._timers.create_timer(timeout, lambda: self._timed_out(node))
+        else:
+            node.timer.timeout = timeout
+        return node
+
+    def _error_control_received(self, node: NodeStatus, msg: can.Message) -> None:
+        value = msg.data[0]
+        if node.guarding:
+            toggle = value & TOGGLE
+            if node._toggle is not None and toggle != node._toggle:
+                logger.warning(f"Node {node.node_id} repeated its guard response")
+                return
+            node._toggle = toggle ^ TOGGLE
+            node._pending_guards = 0
+            value &= ~TOGGLE
+        try:
+            state = NmtState(value)
+        except ValueError:
+            logger.warning(f"Node {node.node_id} reported an unknown state: {value:#x}")
+            return
+        timestamp = msg.timestamp
+        if state == NmtState.BOOTUP:
+            # Intervals and the guarding toggle restart with the node
+            node.last_timestamp = None
+            node._toggle = None
+        elif node.last_timestamp is not None:
+            node.intervals.add(timestamp - node.last_timestamp)
+        node.last_timestamp = timestamp
+        if node.period is not None and not node.guarding:
+            node.timer.reset()
+        changed = state != node.state or not node.alive
+        node.state = state
+        node.alive = True
+        node.lost = False
+        if changed and self.on_state_changed is not None:
+            self.on_state_changed(node.node_id, state)
+
+    def _timed_out(self, node: NodeStatus) -> None:
+        if node.guarding:
+            life_time_elapsed = node._pending_guards >= node.life_time_factor
+            # Guarding goes on, to notice when the node is back
+            self._request_guard(node)
+            if not life_time_elapsed:
+                return
+        else:
+            node.missed += 1
+        node.alive = False
+        if node.lost:
+            return
+        node.lost = True
+        logger.warning(f"Node {node.node_id} lost")
+        if self.on_node_lost is not None:
+            self.on_node_lost(node.node_id)
+
+    def _request_guard(self, node: NodeStatus) -> None:
+        if node._pending_guards:
+            node.missed += 1
+        node._pending_guards += 1
+        self._send(
+            can.Message(
+                arbitration_id=ERROR_CONTROL_BASE + node.node_id, is_remote_frame=True, dlc=1, is_extended_id=False
+            )
+        )
+        node.timer.reset()
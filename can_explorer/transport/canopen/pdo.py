@@ -0,0 +1,373 @@
+import configparser
+import enum
+import logging
+import os
+import re
+import struct
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import can
+
+from can_explorer.transport.canopen.errors import SdoAbortCode, SdoError
+from can_explorer.transport.canopen.sdo import SdoClient
+
+logger = logging.getLogger(__name__)
+
+# Communication and mapping parameters of the PDOs. See CiA 301 7.5.2.35 to 7.5.2.38
+RPDO_COMMUNICATION = 0x1400
+RPDO_MAPPING = 0x1600
+TPDO_COMMUNICATION = 0x1800
+TPDO_MAPPING = 0x1A00
+MAX_PDOS = 512
+COB_ID_INVALID = 0x80000000
+COB_ID_MASK = 0x1FFFFFFF
+DUMMY_INDEX_END = 0x1000  # Mapped indices below are dummy entries: the index is the data type of the gap
+
+
+@enum.unique
+class DataType(enum.IntEnum):
+    """Static data types of the object dictionary. See CiA 301 7.4.7.1"""
+
+    BOOLEAN = 0x01
+    INTEGER8 = 0x02
+    INTEGER16 = 0x03
+    INTEGER32 = 0x04
+    UNSIGNED8 = 0x05
+    UNSIGNED16 = 0x06
+    UNSIGNED32 = 0x07
+    REAL32 = 0x08
+    VISIBLE_STRING = 0x09
+    OCTET_STRING = 0x0A
+    UNICODE_STRING = 0x0B
+    TIME_OF_DAY = 0x0C
+    TIME_DIFFERENCE = 0x0D
+    DOMAIN = 0x0F
+    INTEGER24 = 0x10
+    REAL64 = 0x11
+    INTEGER40 = 0x12
+    INTEGER48 = 0x13
+    INTEGER56 = 0x14
+    INTEGER64 = 0x15
+    UNSIGNED24 = 0x16
+    UNSIGNED40 = 0x18
+    UNSIGNED48 = 0x19
+    UNSIGNED56 = 0x1A
+    UNSIGNED64 = 0x1B
+
+
+_STRUCT_FORMATS = {
+    DataType.BOOLEAN: "?",
+    DataType.INTEGER8: "b",
+    DataType.INTEGER16: "h",
+    DataType.INTEGER32: "i",
+    DataType.INTEGER64: "q",
+    DataType.UNSIGNED8: "B",
+    DataType.UNSIGNED16: "H",
+    DataType.UNSIGNED32: "I",
+    DataType.UNSIGNED64: "Q",
+    DataType.REAL32: "f",
+    DataType.REAL64: "d",
+}
+_SIGNED_TYPES = frozenset(
+    (
+        DataType.INTEGER8,
+        DataType.INTEGER16,
+        DataType.INTEGER24,
+        DataType.INTEGER32,
+        DataType.INTEGER40,
+        DataType.INTEGER48,
+        DataType.INTEGER56,
+        DataType.INTEGER64,
+    )
+)
+_UNSIGNED_TYPES = {8: DataType.UNSIGNED8, 16: DataType.UNSIGNED16, 32: DataType.UNSIGNED32, 64: DataType.UNSIGNED64}
+_REAL_STRUCTS = {DataType.REAL32: struct.Struct("<f"), DataType.REAL64: struct.Struct("<d")}
+_SECTION = re.compile(r"^([0-9A-Fa-f]{4})(?:sub([0-9A-Fa-f]{1,2}))?$")
+
+
+@dataclass(frozen=True, slots=True)
+class ObjectEntry:
+    index: int
+    subindex: int
+    name: str
+    data_type: Optional[int] = None
+    value: Optional[str] = None  # Value of a DCF, else the default value, as written in the file
+
+
+ObjectDictionary = Dict[Tuple[int, int], ObjectEntry]
+
+
+@dataclass(frozen=True, slots=True)
+class MappedVariable:
+    index: int
+    subindex: int
+    bit_length: int
+    data_type: int
+    name: str
+
+    @property
+    def is_dummy(self) -> bool:
+        return self.index < DUMMY_INDEX_END
+
+    @classmethod
+    def from_entry(cls, entry: int, dictionary: Optional[ObjectDictionary] = None) -> "MappedVariable":
+        """:param entry: mapping entry: index, subindex and length in bits of the object"""
+        index, subindex, bit_length = entry >> 16, (entry >> 8) & 0xFF, entry & 0xFF
+        if index < DUMMY_INDEX_END:
+            return cls(index, subindex, bit_length, index, f"dummy{bit_length}")
+        obj = dictionary.get((index, subindex)) if dictionary is not None else None
+        if obj is not None and obj.data_type is not None:
+            return cls(index, subindex, bit_length, obj.data_type, obj.name)
+        name = obj.name if obj is not None else f"{index:04X}sub{subindex:X}"
+        # Unknown type: read as an unsigned integer of the mapped length
+        return cls(index, subindex, bit_length, _UNSIGNED_TYPES.get(bit_length, DataType.UNSIGNED32), name)
+
+
+@dataclass(frozen=True, slots=True)
+class PdoMapping:
+    cob_id: int
+    variables: Tuple[MappedVariable, ...]
+    transmit: bool = True  # TPDO of the node, else RPDO
+
+
+@dataclass(frozen=True, slots=True)
+class PdoLayout:
+    """Mapping of a PDO compiled into a single unpack call. See compile_mapping()"""
+
+    mapping: PdoMapping
+    names: Tuple[str, ...]
+    size: int
+    unpack: Callable[[bytes | bytearray], tuple]
+
+    @property
+    def cob_id(self) -> int:
+        return self.mapping.cob_id
+
+
+@dataclass(slots=True)
+class PdoValues:
+    layout: PdoLayout
+    timestamp: float
+    values: tuple
+
+    def as_dict(self) -> Dict[str, object]:
+        return dict(zip(self.layout.names, self.values))
+
+
+def parse_value(value: str, node_id: Optional[int] = None) -> int:
+    """
+    Parses an integer of an EDS/DCF file: decimal, hexadecimal (0x) or octal (leading 0), possibly a sum with the
+    node id, e.g. $NODEID+0x180. See CiA 306 4.6.3
+    """
+    total = 0
+    for term in value.replace(" ", "").split("+"):
+        if term.upper() == "$NODEID":
+            if node_id is None:
+                raise ValueError(f"Node id needed to parse {value!r}")
+            total += node_id
+        elif term.lower().startswith("0x"):
+            total += int(term, 16)
+        elif len(term) > 1 and term.startswith("0"):
+            total += int(term, 8)
+        else:
+            total += int(term)
+    return total
+
+
+def load_eds(path: str | os.PathLike) -> ObjectDictionary:
+    """:return: the objects of an EDS or DCF file"""
+    parser = configparser.ConfigParser(strict=False, interpolation=None)
+    with open(path, encoding="utf-8", errors="replace") as file:
+        parser.read_file(file)
+    return parse_eds(parser)
+
+
+def parse_eds(parser: configparser.ConfigParser) -> ObjectDictionary:
+    dictionary: ObjectDictionary = {}
+    for section in parser.sections():
+        match = _SECTION.match(section)
+        if match is None:
+            continue
+        options = parser[section]
+        if "subnumber" in options or "compactsubobj" in options:
+            # Record or array: the entries are in the sub sections
+            continue
+        index = int(match.group(1), 16)
+        subindex = int(match.group(2), 16) if match.group(2) is not None else 0
+        data_type = options.get("datatype")
+        value = options.get("parametervalue", options.get("defaultvalue"))
+        dictionary[(index, subindex)] = ObjectEntry(
+            index,
+            subindex,
+            options.get("parametername", section),
+            parse_value(data_type) if data_type else None,
+            value.strip() if value else None,
+        )
+    return dictionary
+
+
+def mappings_from_dictionary(dictionary: ObjectDictionary, node_id: Optional[int] = None) -> List[PdoMapping]:
+    """:return: the valid PDOs of the communication and mapping parameters of an object dictionary"""
+    mappings = []
+    for communication, mapping, transmit in (
+        (RPDO_COMMUNICATION, RPDO_MAPPING, False),
+        (TPDO_COMMUNICATION, TPDO_MAPPING, True),
+    ):
+        for number in range(MAX_PDOS):
+            cob_id = _value_of(dictionary, communication + number, 1, node_id)
+            count = _value_of(dictionary, mapping + number, 0, node_id)
+            if cob_id is None or not count or cob_id & COB_ID_INVALID:
+                continue
+            entries = [_value_of(dictionary, mapping + number, sub, node_id) or 0 for sub in range(1, count + 1)]
+            variables = tuple(MappedVariable.from_entry(entry, dictionary) for entry in entries)
+            mappings.append(PdoMapping(cob_id & COB_ID_MASK, variables, transmit))
+    return mappings
+
+
+def _value_of(dictionary: ObjectDictionary, index: int, subindex: int, node_id: Optional[int]) -> Optional[int]:
+    entry = dictionary.get((index, subindex))
+    if entry is None or not entry.value:
+        return None
+    return parse_value(entry.value, node_id)
+
+
+async def upload_mappings(
+    sdo: SdoClient, dictionary: Optional[ObjectDictionary] = None, transmit: bool = True
+) -> List[PdoMapping]:
+    """
+    Reads the PDO mappings of a node, up to its first missing PDO.
+    :param dictionary: object dictionary of the node, for the data types and names of the mapped objects
+    :param transmit: True for the TPDOs of the node, False for its RPDOs
+    """
+    communication, mapping = (TPDO_COMMUNICATION, TPDO_MAPPING) if transmit else (RPDO_COMMUNICATION, RPDO_MAPPING)
+    mappings = []
+    for number in range(MAX_PDOS):
+        try:
+            cob_id = int.from_bytes(await sdo.upload(communication + number, 1), "little")
+            count = (await sdo.upload(mapping + number, 0))[0]
+            entries = [int.from_bytes(await sdo.upload(mapping + number, sub), "little") for sub in range(1, count + 1)]
+        except SdoError as e:
+            if e.code in (SdoAbortCode.OBJECT_DOES_NOT_EXIST, SdoAbortCode.SUBINDEX_DOES_NOT_EXIST):
+                break
+            raise
+        if count and not cob_id & COB_ID_INVALID:
+            variables = tuple(MappedVariable.from_entry(entry, dictionary) for entry in entries)
+            mappings.append(PdoMapping(cob_id & COB_ID_MASK, variables, transmit))
+    return mappings
+
+
+def compile_mapping(mapping: PdoMapping) -> PdoLayout:
+    """
+    Compiles a mapping into a fixed layout. Byte aligned mappings of standard types are unpacked by a single
+    struct.Struct, the others by extracting the bit fields out of the PDO read as one integer
+    """
+    names = tuple(variable.name for variable in mapping.variables if not variable.is_dummy)
+    bit_length = sum(variable.bit_length for variable in mapping.variables)
+    size = (bit_length + 7) // 8
+    layout = _struct_format(mapping.variables)
+    if layout is not None:
+        unpack = struct.Struct(layout).unpack_from
+    else:
+        unpack = _bit_field_unpacker(mapping.variables, size)
+    return PdoLayout(mapping, names, size, unpack)
+
+
+def _struct_format(variables: Iterable[MappedVariable]) -> Optional[str]:
+    layout = ["<"]
+    for variable in variables:
+        if variable.bit_length % 8:
+            return None
+        if variable.is_dummy:
+            layout.append(f"{variable.bit_length // 8}x")
+            continue
+        code = _STRUCT_FORMATS.get(variable.data_type)
+        if code is None or struct.calcsize(code) * 8 != variable.bit_length:
+            return None
+        layout.append(code)
+    return "".join(layout)
+
+
+def _bit_field_unpacker(variables: Iterable[MappedVariable], size: int) -> Callable[[bytes | bytearray], tuple]:
+    fields = []
+    shift = 0
+    for variable in variables:
+        bit_length = variable.bit_length
+        if not variable.is_dummy:
+            sign = 1 << (bit_length - 1) if variable.data_type in _SIGNED_TYPES else 0
+            real = _REAL_STRUCTS.get(variable.data_type)
+            if real is not None:
+                convert = lambda value, real=real: real.unpack(value.to_bytes(real.size, "little"))[0]
+            elif variable.data_type == DataType.BOOLEAN:
+                convert = bool
+            else:
+                convert = None
+            fields.append((shift, (1 << bit_length) - 1, sign, convert))
+        shift += bit_length
+    fields = tuple(fields)
+
+    def unpack(data: bytes | bytearray) -> tuple:
+        raw = int.from_bytes(data[:size], "little")
+        values = []
+        for shift, mask, sign, convert in fields:
+            value = raw >> shift & mask
+            if sign and value & sign:
+                value -= sign << 1
+            elif convert is not None:
+                value = convert(value)
+            values.append(value)
+        return tuple(values)
+
+    return unpack
+
+
+class PdoDecoder:
+    """
+    Decodes the PDOs of a network. Each mapping is compiled once into a layout, so that decoding a PDO is a lookup of
+    its COB-ID and one unpack call. PDOs are decoded in batches, as read by the dispatcher of the bus
+    """
+
+    def __init__(self, mappings: Iterable[PdoMapping] = ()):
+        self._layouts: Dict[int, PdoLayout] = {}
+        self.short_frames = 0  # PDOs shorter than their mapping, dropped
+        for mapping in mappings:
+            self.add(mapping)
+
+    @property
+    def layouts(self) -> Dict[int, PdoLayout]:
+        return self._layouts
+
+    def add(self, mapping: PdoMapping) -> PdoLayout:
+        """Decodes the PDOs of the mapping, replacing the previous mapping of its COB-ID"""
+        layout = compile_mapping(mapping)
+        self._layouts[mapping.cob_id] = layout
+        return layout
+
+    def remove(self, cob_id: int) -> None:
+        self._layouts.pop(cob_id, None)
+
+    def decode(self, msg: can.Message) -> Optional[PdoValues]:
+        """:return: the values of the PDO, None if the frame is not a known PDO"""
+        layout = self._layouts.get(msg.arbitration_id)
+        if layout is None:
+            return None
+        if len(msg.data) < layout.size:
+            self.short_frames += 1
+            return None
+        return PdoValues(layout, msg.timestamp, layout.unpack(msg.data))
+
+    def decode_frames(self, frames: Iterable[can.Message]) -> List[PdoValues]:
+        """:return: the values of the known PDOs among the frames"""
+        layouts = self._layouts
+        decoded = []
+        append = decoded.append
+        for msg in frames:
+            layout = layouts.get(msg.arbitration_id)
+            if layout is None:
+                continue
+            data = msg.data
+            if len(data) < layout.size:
+                self.short_frames += 1
+                continue
+            append(PdoValues(layout, msg.timestamp, layout.unpack(data)))
+        return decoded
@@ -0,0 +1,370 @@
+import asyncio
+import binascii
+import enum
+import logging
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import can
+
+from can_explorer.transport.canopen.errors import SdoAbortCode, SdoError
+from can_explorer.transport.timer import TimerWheel
+
+logger = logging.getLogger(__name__)
+
+# COB-IDs of the default SDO of a node: base + node id. See CiA 301 7.3.5
+SDO_TX_BASE = 0x580  # Server to client
+SDO_RX_BASE = 0x600  # Client to server
+SDO_TIMEOUT = 1.0
+MAX_NODE_ID = 127
+MAX_BLOCK_SIZE = 127
+SEGMENT_SIZE = 7
+EXPEDITED_SIZE = 4
+ABORT = 0x80  # Command byte of abort transfer, in both directions
+
+
+@enum.unique
+class ClientCommand(enum.IntEnum):
+    """Client command specifiers, in the upper 3 bits of the command byte. See CiA 301 7.2.4.3"""
+
+    DOWNLOAD_SEGMENT = 0
+    INITIATE_DOWNLOAD = 1
+    INITIATE_UPLOAD = 2
+    UPLOAD_SEGMENT = 3
+    ABORT = 4
+    BLOCK_UPLOAD = 5
+    BLOCK_DOWNLOAD = 6
+
+
+@enum.unique
+class ServerCommand(enum.IntEnum):
+    UPLOAD_SEGMENT = 0
+    DOWNLOAD_SEGMENT = 1
+    INITIATE_UPLOAD = 2
+    INITIATE_DOWNLOAD = 3
+    ABORT = 4
+    BLOCK_DOWNLOAD = 5
+    BLOCK_UPLOAD = 6
+
+
+# Sub commands of block transfers, in the lower bits of the command byte
+BLOCK_INITIATE = 0
+BLOCK_END = 1
+BLOCK_RESPONSE = 2
+BLOCK_START = 3
+BLOCK_CRC_SUPPORTED = 0x04
+BLOCK_SIZE_INDICATED = 0x02
+LAST_SEGMENT = 0x80
+
+
+def crc16(data: bytes | bytearray | memoryview) -> int:
+    """CRC of block transfers: CRC-16-CCITT, polynomial 0x1021, initial value 0. See CiA 301 7.2.4.3.16"""
+    return binascii.crc_hqx(data, 0)
+
+
+@dataclass(slots=True)
+class _BlockUpload:
+    block_size: int
+    buffer: bytearray = field(default_factory=bytearray)
+    expected_sequence: int = 1
+    receiving: bool = True
+
+
+class SdoClient:
+    """
+    Client of the default SDO of a node. See CiA 301 7.2.4.
+    Values of up to 4 bytes are sent expedited, larger ones in segments of 7 bytes, each confirmed by the server.
+    Block transfers stream up to 127 segments per confirmation, protected by a CRC: concurrent block transfers with
+    several nodes keep the bus busy instead of waiting for a response every 7 bytes.
+    A node serves one transfer at a time, so the transfers of a client are queued. Transfers with different nodes
+    run concurrently, e.g. with asyncio.gather().
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        node_id: int,
+        send: Callable[[can.Message], bool],
+        timeout: float = SDO_TIMEOUT,
+        block_size: int = MAX_BLOCK_SIZE,
+        timers: Optional[TimerWheel] = None,
+    ):
+        """
+        :param send: queues a frame for transmission, e.g. CanWriteBuffer.write
+        :param timeout: time to wait for each response of the server
+        :param block_size: number of segments per block proposed to servers for block uploads
+        """
+        if not 1 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f"Invalid node id: {node_id}")
+        if not 1 <= block_size <= MAX_BLOCK_SIZE:
+            raise ValueError(f"Invalid block size: {block_size}")
+        self._loop = loop
+        self._node_id = node_id
+        self._send = send
+        self._block_size = block_size
+        self._request_id = SDO_RX_BASE + node_id
+        self._timers = timers if timers is not None else TimerWheel(loop)
+        self._timer = self._timers.create_timer(timeout, self._timed_out)
+        self._lock = asyncio.Lock()
+        self._waiter: Optional[asyncio.Future] = None
+        self._upload: Optional[_BlockUpload] = None
+        self._multiplexer = bytes(3)
+
+    @property
+    def node_id(self) -> int:
+        return self._node_id
+
+    @property
+    def response_id(self) -> int:
+        """COB-ID of the frames of the server, to be passed to frame_received()"""
+        return SDO_TX_BASE + self._node_id
+
+    async def upload(self, index: int, subindex: int, block: bool = False) -> bytearray:
+        """Reads an object of the node. Raises SdoError if the transfer is aborted"""
+        async with self._lock:
+            self._start(index, subindex)
+            try:
+                if block:
+                    return await self._block_upload()
+                return await self._segmented_upload()
+            except asyncio.CancelledError:
+                self._abort(SdoAbortCode.GENERAL_ERROR, "Transfer cancelled")
+                raise
+            finally:
+                self._finished()
+
+    async def download(
+        self, index: int, subindex: int, data: bytes | bytearray | memoryview, block: bool = False
+    ) -> None:
+        """Writes an object of the node. Raises SdoError if the transfer is aborted"""
+        async with self._lock:
+            self._start(index, subindex)
+            try:
+                if block:
+                    await self._block_download(data)
+                elif 0 < len(data) <= EXPEDITED_SIZE:
+                    await self._expedited_download(data)
+                else:
+                    await self._segmented_download(data)
+            except asyncio.CancelledError:
+                self._abort(SdoAbortCode.GENERAL_ERROR, "Transfer cancelled")
+                raise
+            finally:
+                self._finished()
+
+    def close(self) -> None:
+        self._timer.stop()
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.cancel()
+        self._waiter = None
+
+    def frame_received(self, msg: can.Message) -> None:
+        data = msg.data
+        if len(data) < 8:
+            logger.debug(f"Ignoring short SDO frame of node {self._node_id}: {msg}")
+            return
+        upload = self._upload
+        if upload is not None and upload.receiving and data[0] != ABORT:
+            self._segment_received(upload, data)
+            return
+        waiter = self._waiter
+        if waiter is None or waiter.done():
+            logger.debug(f"Unexpected SDO frame of node {self._node_id}: {msg}")
+            return
+        self._waiter = None
+        if data[0] == ABORT:
+            code = int.from_bytes(data[4:8], "little")
+            waiter.set_exception(SdoError(code, f"Transfer aborted by node {self._node_id}"))
+        else:
+            waiter.set_result(data)
+
+    def _segment_received(self, upload: _BlockUpload, data: bytearray) -> None:
+        sequence = data[0] & 0x7F
+        if sequence == upload.expected_sequence:
+            upload.buffer += data[1:8]
+            upload.expected_sequence += 1
+            if data[0] & LAST_SEGMENT:
+                upload.receiving = False
+                self._block_received(upload)
+                return
+        # Segments after a lost one are dropped, the server repeats them after the confirmation
+        if sequence >= upload.block_size or data[0] & LAST_SEGMENT:
+            self._block_received(upload)
+
+    def _block_received(self, upload: _BlockUpload) -> None:
+        acknowledged = upload.expected_sequence - 1
+        upload.expected_sequence = 1
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            self._waiter = None
+            waiter.set_result(acknowledged)
+
+    def _start(self, index: int, subindex: int) -> None:
+        self._multiplexer = index.to_bytes(2, "little") + bytes((subindex,))
+
+    def _finished(self) -> None:
+        self._timer.stop()
+        self._waiter = None
+        self._upload = None
+
+    def _frame(self, data: bytes) -> can.Message:
+        return can.Message(arbitration_id=self._request_id, data=data, is_extended_id=False)
+
+    def _expect(self) -> asyncio.Future:
+        """Arms the timeout for the next response. Called before sending, as responses may arrive right away"""
+        self._waiter = self._loop.create_future()
+        self._timer.reset()
+        return self._waiter
+
+    async def _request(self, data: bytes) -> bytearray:
+        waiter = self._expect()
+        self._send(self._frame(data))
+        return await waiter
+
+    def _timed_out(self) -> None:
+        waiter = self._waiter
+        if waiter is not None and not waiter.done():
+            self._waiter = None
+            waiter.set_exception(self._abort(SdoAbortCode.TIMEOUT, f"No response from node {self._node_id}"))
+
+    def _abort(self, code: SdoAbortCode, msg: str) -> SdoError:
+        """Aborts the transfer on the server. :return: the error to raise"""
+        self._send(self._frame(bytes((ABORT,)) + self._multiplexer + code.to_bytes(4, "little")))
+        return SdoError(code, msg)
+
+    def _check(self, response: bytearray, expected: int, mask: int = 0xE0) -> None:
+        if response[0] & mask != expected:
+            raise self._abort(SdoAbortCode.INVALID_COMMAND_SPECIFIER, f"Unexpected response {response.hex()}")
+
+    async def _expedited_download(self, data: bytes | bytearray | memoryview) -> None:
+        size = len(data)
+        # e=1, s=1, n: number of bytes without data
+        command = ClientCommand.INITIATE_DOWNLOAD << 5 | (EXPEDITED_SIZE - size) << 2 | 0x03
+        response = await self._request(
+            bytes((command,)) + self._multiplexer + bytes(data) + bytes(EXPEDITED_SIZE - size)
+        )
+        self._check(response, ServerCommand.INITIATE_DOWNLOAD << 5)
+
+    async def _segmented_download(self, data: bytes | bytearray | memoryview) -> None:
+        size = len(data)
+        command = ClientCommand.INITIATE_DOWNLOAD << 5 | 0x01
+        response = await self._request(bytes((command,)) + self._multiplexer + size.to_bytes(4, "little"))
+        self._check(response, ServerCommand.INITIATE_DOWNLOAD << 5)
+        view = memoryview(data)
+        toggle = 0
+        # Empty values are sent as one empty segment
+        for offset in range(0, max(size, 1), SEGMENT_SIZE):
+            chunk = view[offset : offset + SEGMENT_SIZE]
+            unused = SEGMENT_SIZE - len(chunk)
+            last = offset + SEGMENT_SIZE >= size
+            command = ClientCommand.DOWNLOAD_SEGMENT << 5 | toggle | unused << 1 | last
+            response = await self._request(bytes((command,)) + chunk + bytes(unused))
+            self._check(response, ServerCommand.DOWNLOAD_SEGMENT << 5)
+            if response[0] & 0x10 != toggle:
+                raise self._abort(SdoAbortCode.TOGGLE_BIT_NOT_ALTERNATED, f"Segment at {offset} not confirmed")
+            toggle ^= 0x10
+
+    async def _segmented_upload(self) -> bytearray:
+        response = await self._request(bytes((ClientCommand.INITIATE_UPLOAD << 5,)) + self._multiplexer + bytes(4))
+        self._check(response, ServerCommand.INITIATE_UPLOAD << 5)
+        command = response[0]
+        if command & 0x02:
+            # Expedited
+            size = EXPEDITED_SIZE - (command >> 2 & 0x03) if command & 0x01 else EXPEDITED_SIZE
+            return response[4 : 4 + size]
+        size = int.from_bytes(response[4:8], "little") if command & 0x01 else None
+        buffer = bytearray()
+        toggle = 0
+        while True:
+            response = await self._request(bytes((ClientCommand.UPLOAD_SEGMENT << 5 | toggle,)) + bytes(7))
+            self._check(response, ServerCommand.UPLOAD_SEGMENT << 5)
+            command = response[0]
+            if command & 0x10 != toggle:
+                raise self._abort(SdoAbortCode.TOGGLE_BIT_NOT_ALTERNATED, f"Segment at {len(buffer)} repeated")
+            buffer += response[1 : 8 - (command >> 1 & 0x07)]
+            if command & 0x01:
+                break
+            toggle ^= 0x10
+        if size is not None and size != len(buffer):
+            logger.warning(f"Node {self._node_id} announced {size} bytes, sent {len(buffer)}")
+        return buffer
+
+    async def _block_download(self, data: bytes | bytearray | memoryview) -> None:
+        size = len(data)
+        command = ClientCommand.BLOCK_DOWNLOAD << 5 | BLOCK_CRC_SUPPORTED | BLOCK_SIZE_INDICATED | BLOCK_INITIATE
+        response = await self._request(bytes((command,)) + self._multiplexer + size.to_bytes(4, "little"))
+        self._check(response, ServerCommand.BLOCK_DOWNLOAD << 5 | BLOCK_INITIATE, mask=0xE3)
+        crc_supported = response[0] & BLOCK_CRC_SUPPORTED
+        block_size = self._checked_block_size(response[4])
+        view = memoryview(data)
+        padding = bytes(SEGMENT_SIZE)
+        request_id = self._request_id
+        offset = 0
+        while True:
+            start = offset
+            # Armed before the block is queued: the confirmation may arrive before the last segment is written
+            waiter = self._expect()
+            sequence = 0
+            last = False
+            while sequence < block_size and not last:
+                sequence += 1
+                chunk = view[offset : offset + SEGMENT_SIZE]
+                offset += SEGMENT_SIZE
+                last = offset >= size
+                frame = bytes((LAST_SEGMENT | sequence if last else sequence,)) + chunk
+                if last:
+                    frame += padding[: SEGMENT_SIZE - len(chunk)]
+                self._send(can.Message(arbitration_id=request_id, data=frame, is_extended_id=False))
+            response = await waiter
+            self._check(response, ServerCommand.BLOCK_DOWNLOAD << 5 | BLOCK_RESPONSE, mask=0xE3)
+            acknowledged = response[1]
+            if acknowledged > sequence:
+                raise self._abort(SdoAbortCode.INVALID_SEQUENCE_NUMBER, f"Segment {acknowledged} not sent")
+            block_size = self._checked_block_size(response[2])
+            if last and acknowledged == sequence:
+                break
+            # Segments after the last confirmed one are repeated in the next block
+            offset = start + acknowledged * SEGMENT_SIZE
+        unused = (-size) % SEGMENT_SIZE if size else SEGMENT_SIZE
+        crc = crc16(data) if crc_supported else 0
+        command = ClientCommand.BLOCK_DOWNLOAD << 5 | unused << 2 | BLOCK_END
+        response = await self._request(bytes((command,)) + crc.to_bytes(2, "little") + bytes(5))
+        self._check(response, ServerCommand.BLOCK_DOWNLOAD << 5 | BLOCK_END, mask=0xE3)
+
+    async def _block_upload(self) -> bytearray:
+        # Protocol switch threshold 0: always a block transfer
+        command = ClientCommand.BLOCK_UPLOAD << 5 | BLOCK_CRC_SUPPORTED | BLOCK_INITIATE
+        response = await self._request(bytes((command,)) + self._multiplexer + bytes((self._block_size, 0)) + bytes(2))
+        self._check(response, ServerCommand.BLOCK_UPLOAD << 5 | BLOCK_INITIATE, mask=0xE1)
+        crc_supported = response[0] & BLOCK_CRC_SUPPORTED
+        size = int.from_bytes(response[4:8], "little") if response[0] & BLOCK_SIZE_INDICATED else None
+        upload = self._upload = _BlockUpload(self._block_size)
+        acknowledge = ClientCommand.BLOCK_UPLOAD << 5 | BLOCK_RESPONSE
+        waiter = self._expect()
+        self._send(self._frame(bytes((ClientCommand.BLOCK_UPLOAD << 5 | BLOCK_START,)) + bytes(7)))
+        while True:
+            acknowledged = await waiter
+            # Armed before the confirmation: the server answers with the next block or the end of the transfer
+            waiter = self._expect()
+            self._send(self._frame(bytes((acknowledge, acknowledged, self._block_size)) + bytes(5)))
+            if not upload.receiving:
+                break
+        response = await waiter
+        self._check(response, ServerCommand.BLOCK_UPLOAD << 5 | BLOCK_END, mask=0xE3)
+        buffer = upload.buffer
+        unused = response[0] >> 2 & 0x07
+        if unused:
+            del buffer[-unused:]
+        if crc_supported:
+            crc = int.from_bytes(response[1:3], "little")
+            if crc != crc16(buffer):
+                raise self._abort(SdoAbortCode.CRC_ERROR, f"CRC mismatch on {len(buffer)} bytes")
+        self._send(self._frame(bytes((ClientCommand.BLOCK_UPLOAD << 5 | BLOCK_END,)) + bytes(7)))
+        if size is not None and size != len(buffer):
+            logger.warning(f"Node {self._node_id} announced {size} bytes, sent {len(buffer)}")
+        return buffer
+
+    def _checked_block_size(self, block_size: int) -> int:
+        if not 1 <= block_size <= MAX_BLOCK_SIZE:
+            raise self._abort(SdoAbortCode.INVALID_BLOCK_SIZE, f"Block size {block_size}")
+        return block_size
@@ -1,94 +1,172 @@
-from PyQt6.QtCore import pyqtSignal
-
 import can
 import logging
 import asyncio
-from PyQt6.QtCore import pyqtSignal
-from PyQt6.QtWidgets import QWidget
+from PyQt6.QtCore import QObject, pyqtSignal
+from typing import List, Optional, Tuple
+from can_explorer.transport.can_dispatcher import dispatcher_for
+from can_explorer.transport.can_filter import CanFilter, FilterPlacement
+from can_explorer.transport.can_writer import CanWriteBuffer
 
 logger = logging.getLogger(__name__)
 
 
-class IsoCanProtocol(asyncio.Protocol, QWidget):
+class IsoCanProtocol(asyncio.Protocol, QObject):
     __slot__ = (
         "_transport",
         "_on_con_lost",
-        "_data_received_queue",
-        "_error_queue",
         "on_data_received",
+        "on_frames_received",
     )
     on_data_received = pyqtSignal(can.Message)
+    on_frames_received = pyqtSignal(list)
 
-    def __init__(self, on_con_lost) -> None:
+    def __init__(self, on_con_lost: Optional[asyncio.Future] = None) -> None:
         super().__init__()
         self._transport = None
         self._on_con_lost = on_con_lost
-        self._data_received_queue = asyncio.Queue()
-        self._error_queue = asyncio.Queue()
-        self.on_data_received.emit(can.Message())
 
     def connection_made(self, transport: asyncio.BaseTransport) -> None:
         logger.debug(f"Connection made")
-        return super().connection_made(transport)
+        self._transport = transport
 
-    def data_received(self, data: bytes) -> None:
-        logger.info(f"Received: {data}")
-        self._data_received_queue.put_nowait(data)
+    def data_received(self, data: can.Message) -> None:
         self.on_data_received.emit(data)
 
+    def frames_received(self, frames: List[can.Message]) -> None:
+        self.on_frames_received.emit(frames)
+
     def connection_lost(self, exc: Exception | None) -> None:
-        self._on_con_lost.set_result(True)
-        return super().connection_lost(exc)
+        if self._on_con_lost is not None and not self._on_con_lost.done():
+            self._on_con_lost.set_result(True)
 
 
 class IsoCanTransport(asyncio.Transport):
-    __slot__ = ("_bus", "_protocol", "_loop", "_parsing_task")
-
-    def __init__(self, bus: can.BusABC) -> None:
-        self._bus: can = bus
-        self._protocol = IsoCanProtocol(lambda x: logger.info(x))
-        # self._loop = asyncio.get_running_loop()
-        self._loop = None
-        # self._start_message_polling()
-        super().__init__()
+    """
+    Raw CAN transport. Frames are read in bursts by the dispatcher of the bus, shared with the other transports
+    of the same bus, and handed to the protocol in batches through frames_received(), or one by one through
+    data_received() if the protocol has no batch callback.
+    Without an event loop, the protocol is called on the reader thread.
+    Written frames are queued and sent by a writer thread, with the usual write flow control.
+    """
+
+    __slot__ = ("_bus", "_protocol", "_loop", "_dispatcher", "_subscription", "_writer", "_closing")
+
+    def __init__(
+        self,
+        loop: Optional[asyncio.AbstractEventLoop],
+        protocol: asyncio.Protocol,
+        bus: can.BusABC,
+    ) -> None:
+        super().__init__(extra={"bus": bus})
+        self._bus: can.BusABC = bus
+        self._protocol = protocol
+        self._loop = loop
+        self._closing = False
+        self._dispatcher = dispatcher_for(bus)
+        self._subscription = None
+        self._writer = CanWriteBuffer(
+            bus,
+            loop=loop,
+            on_pause=lambda: self._protocol.pause_writing(),
+            on_resume=lambda: self._protocol.resume_writing(),
+            on_error=self._write_error,
+        )
+        self._start_message_polling()
 
     def is_reading(self) -> bool:
-        return self._bus.state == can.BusState.ACTIVE
+        return self._subscription is not None and not self._subscription.paused
 
     def pause_reading(self) -> None:
-        if self._parsing_task is not None:
-            self._parsing_task.cancel()
-            self._parsing_task = None
-        else:
-            logger.warning(f"Parsing task not present!")
+        self._subscription.pause()
 
     def resume_reading(self) -> None:
-        self._start_message_polling()
+        self._subscription.resume()
+
+    def set_protocol(self, protocol: asyncio.BaseProtocol) -> None:
+        self._protocol = protocol
 
     def get_protocol(self) -> asyncio.BaseProtocol:
         return self._protocol
 
-    def close(self) -> None:
-        self._bus.shutdown()
+    def is_closing(self) -> bool:
+        return self._closing
 
-    def write(self, data: bytearray, arbitration_id: int) -> None:
-        message = can.Message(data=data, arbitration_id=arbitration_id)
-        self._bus.send(message)
-
-    def _parse_can_frames(self) -> None:
-        try:
-
-            logger.info("Waiting for CAN messages")
-            while True:
-                message = self._bus.recv()
-                self._protocol.data_received(message)
-        except Exception as e:
-            logger.error(e)
+    def close(self) -> None:
+        """Stops reading. The bus is shut down once the buffered frames are sent"""
+        if self._closing:
+            return
+        self._closing = True
+        self._subscription.cancel()
+        self._writer.close(self._connection_lost)
+
+    def abort(self) -> None:
+        if self._closing:
+            return
+        self._closing = True
+        self._subscription.cancel()
+        self._writer.abort(self._connection_lost)
+
+    def set_write_buffer_limits(self, high: Optional[int] = None, low: Optional[int] = None) -> None:
+        self._writer.set_limits(high, low)
+
+    def get_write_buffer_limits(self) -> Tuple[int, int]:
+        return self._writer.get_limits()
+
+    def get_write_buffer_size(self) -> int:
+        return self._writer.get_size()
+
+    def set_filters(self, can_filters: Optional[List[CanFilter]]) -> FilterPlacement:
+        """Restricts the received frames to the given acceptance filters. None accepts every frame"""
+        placement = self._subscription.set_filters(can_filters)
+        logger.info(f"Acceptance filters {can_filters} running in {placement}")
+        return placement
+
+    def write(self, data: bytearray, arbitration_id: int, **kwargs) -> None:
+        """Queues a frame built from the given payload. Extra arguments are passed to can.Message"""
+        self.send(can.Message(data=data, arbitration_id=arbitration_id, **kwargs))
+
+    def send(self, message: can.Message) -> bool:
+        """Queues a frame. Returns False if it was dropped because the transmit buffer is full"""
+        return self._writer.write(message)
+
+    def _call_protocol(self, callback, *args) -> None:
+        if self._loop is None:
+            callback(*args)
+        else:
+            self._loop.call_soon(callback, *args)
+
+    def _frames_received(self, frames: List[can.Message]) -> None:
+        if self._closing:
+            return
+        frames_received = getattr(self._protocol, "frames_received", None)
+        if frames_received is not None:
+            frames_received(frames)
+        else:
+            for msg in frames:
+                self._protocol.data_received(msg)
+
+    def _write_error(self, exc: Exception) -> None:
+        error_received = getattr(self._protocol, "error_received", None)
+        if error_received is not None:
+            error_received(exc)
+
+    def _connection_lost(self, exc: Optional[Exception] = None) -> None:
+        # Other transports may still use the bus
+        if not self._dispatcher.is_active:
+            self._bus.shutdown()
+        self._protocol.connection_lost(exc)
+
+    def _fatal_error(self, exc: Exception) -> None:
+        logger.error(f"Fatal error on transport: {exc}")
+        if not self._closing:
+            self._closing = True
+            self._subscription.cancel()
+            self._writer.abort()
+            self._connection_lost(exc)
 
     def _start_message_polling(self):
         logger.info("Starting message polling")
-
-        async def a_parse_can_frames():
-            self._parse_can_frames()
-
-        self._parsing_task = asyncio.create_task(a_parse_can_frames())
+        self._call_protocol(self._protocol.connection_made, self)
+        self._subscription = self._dispatcher.subscribe(
+            self._frames_received, loop=self._loop, on_error=self._fatal_error
+        )
@@ -1,6 +1,7 @@
 import logging
 import asyncio
 import enum
+from typing import Tuple
 
 from can_explorer.util.validator import is_byte
 
@@ -88,6 +89,21 @@ class AddressInfo:
     def is_normal_addressing(self) -> bool:
         return self.addressing_type == AddressingType.NORMAL
 
+    @property
+    def pci_offset(self) -> int:
+        """Position of the N_PCI in the frame. Mixed addressing puts the address extension first"""
+        return 0 if self.is_normal_addressing else 1
+
+    @property
+    def session_key(self) -> Tuple[int, int, int, TargetAddressingType]:
+        """Identifies the ISO-TP session of this address pair on a bus"""
+        return self.source_address, self.target_address, self.address_extension, self.target_address_type
+
     @property
     def arbitration_id(self) -> int:
         return self.target_address << 4 | self.source_address
+
+    @property
+    def rx_arbitration_id(self) -> int:
+        """Arbitration id of the frames sent by the peer, with source and target swapped"""
+        return self.source_address << 4 | self.target_address
@@ -21,9 +21,14 @@ class NResult(enum.IntEnum):
 
 class IsoTpError(Exception):
     def __init__(self, result: NResult, msg: Optional[str]):
+        super().__init__(f'{result.name}: {msg}')
         self._result = result
         self._msg = msg
 
+    @property
+    def result(self) -> NResult:
+        return self._result
+
 
 @enum.unique
 class IsoTpWarning(enum.IntEnum):
@@ -1,13 +1,16 @@
 import asyncio
-from dataclasses import dataclass
 import can
 import logging
-import enum
-from typing import Tuple, Optional
+from typing import List, Tuple, Optional
 from can_explorer.transport.isotp.addressing import AddressInfo, TargetAddressingType
-from can_explorer.transport.can_message import CanMessage
-from can_explorer.transport.isotp.errors import NResult
-from can_explorer.transport.isotp.pdu import PDU, FlowStatus, PCIType
+from can_explorer.transport.can_dispatcher import Subscription, dispatcher_for
+from can_explorer.transport.can_writer import CanWriteBuffer
+from can_explorer.transport.isotp.session import (
+    DEFAULT_MAX_RX_LENGTH,
+    IsoTpSession,
+    TransmitConfig,
+    TransportState,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -21,69 +24,51 @@ logger = logging.getLogger(__name__)
 #    CLOSED = enum.auto()
 
 
-@enum.unique
-class TransportState(enum.IntEnum):
-    IDLE = 0x00
-    SEGMENTED_TX = 0x01
-    SEGMENTED_RX = 0x02
-    CLOSING = 0x03
-    COMPLETE = 0x04
-
-
-class TransmitData:
-    def __init__(self, data):
-        self._data = data
-
-
-class WatchdogTimer:
-    def reset(self):
-        raise NotImplementedError()
-
-    def stop(self):
-        raise NotImplementedError()
-
-
-@dataclass(slots=True)
-class TransmitConfig:
-    block_size: Optional[int] = None
-    flow_status: Optional[FlowStatus] = None
-    min_separation_time_us: Optional[int] = None
-    first_frame_length: Optional[int] = None
-    transmit_state_rx: TransportState = TransportState.IDLE
-    transmit_timer: WatchdogTimer = WatchdogTimer()
-    last_sequence_number: int = 0
-    block_count: int = 0
-
-    @staticmethod
-    def parse_st_min(st_min: int) -> int:
-        if 0 <= st_min <= 0x7F:
-            return st_min * 1_000
-        elif 0xF1 <= st_min <= 0xF9:
-            return (st_min - 0xF0) * 100
-        raise ValueError(f'Invalid {st_min=}')
-
-
 class IsoTpTransport(asyncio.Transport):
+    """
+    ISO-TP endpoint for a single address pair. See IsoTpSessionManager to run many address pairs on one bus
+    """
 
     def __init__(
-        self, loop: asyncio.AbstractEventLoop, protocol: asyncio.Protocol, bus: can.BusABC, addressing: AddressInfo
+        self,
+        loop: asyncio.AbstractEventLoop,
+        protocol: asyncio.Protocol,
+        bus: can.BusABC,
+        addressing: AddressInfo,
+        block_size: int = 0,
+        st_min_us: int = 0,
+        max_rx_length: int = DEFAULT_MAX_RX_LENGTH,
     ):
+        """
+        :param block_size: BS sent to the peer in our FlowControls. 0 for no further FlowControl
+        :param st_min_us: STmin sent to the peer in our FlowControls
+        :param max_rx_length: longest message accepted, at most the 4GB of the escaped FF_DL
+        """
         self._protocol = protocol
         self._loop = loop
         self._bus = bus
-        self._poll_task: Optional[asyncio.Task] = None
-        self._notifier = None
+        self._subscription: Optional[Subscription] = None
+        self._writer = CanWriteBuffer(
+            bus,
+            loop=loop,
+            on_pause=lambda: self._protocol.pause_writing(),
+            on_resume=lambda: self._protocol.resume_writing(),
+            on_error=self._write_error,
+        )
         self._addressing = addressing
-        self._tx_queue = asyncio.Queue()
-        self._rx_queue = asyncio.Queue()
-        self._rx_reader = can.AsyncBufferedReader()
-        self._txrx_queue = can.AsyncBufferedReader()
         self._state = TransportState.IDLE
-        self._rx_timeout = 1.0
         self._should_read = True
-        self._keep_polling_for_data = True
-        self._transmit_config = TransmitConfig()
-        super().__init__()
+        self._session = IsoTpSession(
+            loop,
+            self._writer,
+            addressing,
+            on_message=lambda data: self._protocol.data_received(data),
+            on_error=self._write_error,
+            block_size=block_size,
+            st_min_us=st_min_us,
+            max_rx_length=max_rx_length,
+        )
+        super().__init__(extra={'bus': bus})
 
     def run(self):
         pass
@@ -111,7 +96,7 @@ class IsoTpTransport(asyncio.Transport):
 
     def is_reading(self):
         """Return True if the transport is receiving."""
-        raise NotImplementedError
+        return self._subscription is not None and self._should_read
 
     def pause_reading(self):
         """Pause the receiving end.
@@ -148,17 +133,24 @@ class IsoTpTransport(asyncio.Transport):
         reduces opportunities for doing I/O and computation
         concurrently.
         """
-        raise NotImplementedError
+        self._writer.set_limits(high, low)
 
     def get_write_buffer_size(self):
         """Return the current size of the write buffer."""
-        raise NotImplementedError
+        return self._writer.get_size()
 
     def get_write_buffer_limits(self):
         """Get the high and low watermarks for write flow control.
         Return a tuple (low, high) where low and high are
         positive number of bytes."""
-        raise NotImplementedError
+        return self._writer.get_limits()
+
+    def _write_error(self, exc: Exception) -> None:
+        error_received = getattr(self._protocol, 'error_received', None)
+        if error_received is not None:
+            error_received(exc)
+        else:
+            logger.warning(f'Could not send frame: {exc}')
 
     def write(self, data):
         """Write some data bytes to the transport.
@@ -167,8 +159,7 @@ class IsoTpTransport(asyncio.Transport):
         to be sent out asynchronously.
         """
         logger.info(f'Request to send: {data}')
-        transmit_pdu = TransmitData(data)
-        self._txrx_queue.buffer.put_nowait(transmit_pdu)
+        self._session.write(data)
 
     def writelines(self, list_of_data):
         """Write a list (or any iterable) of data bytes to the transport.
@@ -201,111 +192,32 @@ class IsoTpTransport(asyncio.Transport):
         """
         raise NotImplementedError
 
-    def _process_tx_data(self, data: TransmitData) -> None:
-        logger.info(f'Processing Tx Data: {data}')
-
-    def _reset_segmented_rx(self, msg: Optional[can.Message], error_code: NResult = NResult.N_OK):
-        raise NotImplementedError('Reset segmented Rx not yet implemented')
-
-    def _transmit_flow_control(self, msg: can.Message, flow_status: FlowStatus):
-        raise NotImplementedError()
+    def _frames_received(self, frames: List[can.Message]) -> None:
+        for msg in frames:
+            self._process_rx_data(msg)
 
     def _process_rx_data(self, msg: can.Message):
-        logger.info(f'Processing Rx data: {msg}')
         if not self._should_read:
             logger.debug(f'Skipping data')
             return
-        try:
-            pdu = PDU.from_can(msg, self._addressing)
-        except AssertionError as e:
-            logger.warning(f'Skipping invalid IsoTp frame: {msg}. Cause: {e=}')
-            return
-        except Exception as e:
-            logger.error(f'An error occurred while parsing can frame: {msg}. Cause: {e=}. Aborting transfer!')
-            self._should_read = False
-            return
-        assert self._protocol is not None, f'Invalid protocol value: {self._protocol=}'
-        config = self._transmit_config
-        try:
-            match (config.transmit_state_rx, pdu.msg_type):
-                case (TransportState.IDLE, PCIType.SINGLE_FRAME):
-                    data = pdu.export(self._addressing)
-                    self._protocol.data_received(data)
-                case (TransportState.IDLE, PCIType.FIRST_FRAME):
-                    config.first_frame_length = pdu.can_dl
-                    data = pdu.export(self._addressing)
-                    self._protocol.data_received(data)
-                    flow_control_pdu = PDU.build_flow_control_frame(
-                        flow_status=FlowStatus.CONTINUE_TO_SEND,
-                        st_min_us=127_000,
-                        block_size=0xFF,
-                        addressing=self._addressing,
-                    )
-                    flow_control_frame = flow_control_pdu.export(self._addressing)
-                    self._txrx_queue.buffer.put_nowait(flow_control_frame)
-                case (TransportState.SEGMENTED_RX, PCIType.SINGLE_FRAME):
-                    self._reset_segmented_rx(msg)
-                    data = pdu.export(self._addressing)
-                    self._protocol.data_received(data)
-                case (TransportState.SEGMENTED_RX, PCIType.FIRST_FRAME):
-                    self._reset_segmented_rx(msg)
-                    config.first_frame_length = pdu.can_dl
-                    data = pdu.export(self._addressing)
-                    self._protocol.data_received(data)
-                    flow_control_pdu = PDU.build_flow_control_frame(
-                        flow_status=FlowStatus.CONTINUE_TO_SEND,
-                        st_min_us=127_000,
-                        block_size=0xFF,
-                        addressing=self._addressing,
-                    )
-                    flow_control_frame = flow_control_pdu.export(self._addressing)
-                    self._txrx_queue.buffer.put_nowait(flow_control_frame)
-                case (TransportState.SEGMENTED_RX, PCIType.CONSECUTIVE_FRAME):
-                    rx_config = self._transmit_config
-                    expected_sn = (self._transmit_config.last_sequence_number + 1) & 0xF
-                    if pdu.sequence_number != expected_sn:
-                        self._reset_segmented_rx(msg, NResult.N_WRONG_SN)
-                    elif pdu.can_dl != self._transmit_config.first_frame_length:
-                        self._reset_segmented_rx(msg, NResult.N_UNEXP_PDU)
-                    else:
-                        data = pdu.export(self._addressing)
-                        self._protocol.data_received(data)
-                        if len(pdu.data) <= rx_config.first_frame_length:
-                            rx_config.transmit_state_rx = TransportState.COMPLETE
-                        else:
-                            rx_config.block_count += 1
-                            if rx_config.block_size > 0 and rx_config.block_count % rx_config.block_size == 0:
-                                self._transmit_flow_control(msg, FlowStatus.CONTINUE_TO_SEND)
-                                rx_config.transmit_timer.stop()
-                        rx_config.transmit_timer.reset()
-                        rx_config.last_sequence_number = expected_sn
-                case _:
-                    logger.warning(f'Ignoring frame: {msg=}, {pdu=}')
-                    self._reset_segmented_rx(None)
-        except Exception as e:
-            logger.error(e)
-        logger.info('Reached end')
-
-    async def _poll_for_data(self):
-        logger.info('Polling for data')
-        async for data in self._txrx_queue:
-            if isinstance(data, can.Message):
-                self._process_rx_data(data)
-            elif isinstance(data, TransmitData):
-                self._process_tx_data(data)
-            else:
-                raise ValueError(f'Could not process data: {data}')
+        self._session.frame_received(msg)
 
     def setup(self) -> None:
-        self._notifier = can.Notifier(
-            self._bus, listeners=[self._txrx_queue], timeout=self._rx_timeout, loop=self._loop
+        # Frames of other endpoints on the same bus are sorted out by the dispatcher
+        self._subscription = dispatcher_for(self._bus).subscribe(
+            self._frames_received,
+            arbitration_ids=[self._addressing.rx_arbitration_id],
+            is_extended=self._addressing.is_extended,
+            loop=self._loop,
         )
-        self._poll_task = asyncio.create_task(self._poll_for_data())
-        self._poll_task.set_name(f'IsoTpTransport-{id(self)} polling task')
+        self._session.start()
         self._loop.call_soon(self._protocol.connection_made, self)
 
     def shutdown(self):
-        self._notifier.stop()
+        if self._subscription is not None:
+            self._subscription.cancel()
+            self._subscription = None
+        self._session.stop()
 
 
 def create_isotp_endpoint(
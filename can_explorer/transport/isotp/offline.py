@@ -0,0 +1,328 @@
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import can
+import numpy as np
+
+from can_explorer.transport.isotp.addressing import AddressInfo
+from can_explorer.transport.isotp.errors import NResult
+from can_explorer.transport.isotp.pdu import PCIType, parse_pci
+from can_explorer.transport.isotp.session import DEFAULT_MAX_RX_LENGTH, N_CR_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1 << 16
+MAX_PAYLOAD_LENGTH = 64
+
+
+@dataclass(slots=True)
+class ReassembledMessage:
+    """
+    ISO-TP message found in a recording. Aborted receptions are reported with their error and the payload received
+    until then
+    """
+
+    arbitration_id: int
+    address_extension: Optional[int]
+    data: bytes | bytearray
+    start_timestamp: float
+    end_timestamp: float
+    result: NResult = NResult.N_OK
+
+
+@dataclass(slots=True)
+class _Reception:
+    buffer: bytearray
+    view: memoryview
+    offset: int
+    next_sequence_number: int
+    start_timestamp: float
+    last_timestamp: float
+
+
+class OfflineReassembler:
+    """
+    Reassembles the ISO-TP messages of recorded frames, without event loop or bus. Frames are fed in batches of
+    columns, as stored by the FrameStorage: the frames of the configured address pairs are selected and classified by
+    PCI type in vectorized operations. Runs of ConsecutiveFrames are checked and copied as a whole, so that only the
+    SingleFrames and FirstFrames are handled one by one.
+    Both directions of every address pair are reassembled. Like IsoTpSession, frames outside of a reception and
+    FlowControls are skipped. Timeouts are detected from the timestamps of the recording.
+    """
+
+    def __init__(
+        self,
+        addressing: AddressInfo | Iterable[AddressInfo],
+        max_rx_length: int = DEFAULT_MAX_RX_LENGTH,
+        timeout: Optional[float] = N_CR_TIMEOUT,
+    ):
+        """
+        :param max_rx_length: longer messages are reported as N_BUFFER_OVFLW
+        :param timeout: N_Cr. Longer pauses within a reception abort it with N_TIMEOUT_Cr. None to disable
+        """
+        if isinstance(addressing, AddressInfo):
+            addressing = (addressing,)
+        pci_offsets: Dict[int, int] = {}
+        extended: Dict[int, bool] = {}
+        for address_info in addressing:
+            for arbitration_id in (address_info.arbitration_id, address_info.rx_arbitration_id):
+                pci_offsets[arbitration_id] = address_info.pci_offset
+                extended[arbitration_id] = address_info.is_extended
+        if not pci_offsets:
+            raise ValueError('No address pair given')
+        ids = sorted(pci_offsets)
+        self._ids = np.array(ids, dtype=np.uint32)
+        self._pci_offsets = np.array([pci_offsets[i] for i in ids], dtype=np.int64)
+        self._extended = np.array([extended[i] for i in ids], dtype=bool)
+        self._max_rx_length = max_rx_length
+        self._timeout = timeout
+        # Stream key: arbitration id, with the address extension + 1 above bit 32 in mixed addressing
+        self._receptions: Dict[int, _Reception] = {}
+
+    @property
+    def arbitration_ids(self) -> frozenset:
+        return frozenset(self._ids.tolist())
+
+    def feed(
+        self,
+        timestamp: np.ndarray,
+        arbitration_id: np.ndarray,
+        length: np.ndarray,
+        data: np.ndarray,
+        is_extended: Optional[np.ndarray] = None,
+    ) -> List[ReassembledMessage]:
+        """
+        Processes the next frames of the recording. Receptions continue across calls.
+        :param length: CAN_DL of every frame
+        :param data: payloads, one row per frame
+        :param is_extended: identifier type of every frame. Not checked if None
+        :return: the messages completed or aborted by the frames, in order of their end
+        """
+        arbitration_id = np.asarray(arbitration_id)
+        position = np.searchsorted(self._ids, arbitration_id)
+        position[position == len(self._ids)] = 0
+        selected = self._ids[position] == arbitration_id
+        if is_extended is not None:
+            selected &= self._extended[position] == np.asarray(is_extended)
+        rows = np.flatnonzero(selected)
+        offsets = self._pci_offsets[position[rows]]
+        lengths = np.asarray(length)[rows].astype(np.int64)
+        non_empty = lengths > offsets
+        rows, offsets, lengths = rows[non_empty], offsets[non_empty], lengths[non_empty]
+        if not len(rows):
+            return []
+        frames = np.asarray(data)[rows]
+        timestamps = np.asarray(timestamp, dtype=np.float64)[rows]
+        pci_types = frames[np.arange(len(rows)), offsets] >> 4
+        keys = arbitration_id[rows].astype(np.int64)
+        mixed = offsets == 1
+        keys[mixed] |= (frames[mixed, 0].astype(np.int64) + 1) << 32
+        # Frames of one stream, in recording order
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        bounds = np.flatnonzero(sorted_keys[1:] != sorted_keys[:-1]) + 1
+        messages: List[ReassembledMessage] = []
+        for stream in np.split(order, bounds):
+            self._feed_stream(
+                int(keys[stream[0]]),
+                int(offsets[stream[0]]),
+                timestamps[stream],
+                lengths[stream],
+                frames[stream],
+                pci_types[stream],
+                messages,
+            )
+        messages.sort(key=lambda message: message.end_timestamp)
+        return messages
+
+    def finish(self) -> List[ReassembledMessage]:
+        """Ends the recording: receptions still running are reported as timed out"""
+        messages = [
+            self._abort(key, reception, NResult.N_TIMEOUT_Cr, reception.last_timestamp)
+            for key, reception in self._receptions.items()
+        ]
+        self._receptions.clear()
+        messages.sort(key=lambda message: message.end_timestamp)
+        return messages
+
+    def _feed_stream(
+        self,
+        key: int,
+        pci_offset: int,
+        timestamps: np.ndarray,
+        lengths: np.ndarray,
+        frames: np.ndarray,
+        pci_types: np.ndarray,
+        messages: List[ReassembledMessage],
+    ) -> None:
+        count = len(pci_types)
+        begin = 0
+        for event in np.flatnonzero(pci_types != PCIType.CONSECUTIVE_FRAME).tolist() + [count]:
+            if event > begin and key in self._receptions:
+                self._consecutive_frames_received(
+                    key, pci_offset, timestamps[begin:event], lengths[begin:event], frames[begin:event], messages
+                )
+            if event < count:
+                frame = frames[event, : lengths[event]].tobytes()
+                self._frame_received(key, pci_offset, float(timestamps[event]), frame, messages)
+            begin = event + 1
+
+    def _frame_received(
+        self, key: int, pci_offset: int, timestamp: float, frame: bytes, messages: List[ReassembledMessage]
+    ) -> None:
+        result, pci_type, value, position, _ = parse_pci(frame, pci_offset)
+        if result != NResult.N_OK or pci_type == PCIType.FLOW_CONTROL_FRAME:
+            return
+        reception = self._receptions.pop(key, None)
+        if reception is not None:
+            timed_out = self._timeout is not None and timestamp - reception.last_timestamp > self._timeout
+            error_code = NResult.N_TIMEOUT_Cr if timed_out else NResult.N_UNEXP_PDU
+            messages.append(self._abort(key, reception, error_code, timestamp))
+        if pci_type == PCIType.SINGLE_FRAME:
+            messages.append(self._message(key, frame[position : position + value], timestamp, timestamp))
+            return
+        if value > self._max_rx_length:
+            messages.append(self._message(key, b'', timestamp, timestamp, NResult.N_BUFFER_OVFLW))
+            return
+        buffer = bytearray(value)
+        count = min(len(frame) - position, value)
+        buffer[:count] = frame[position : position + count]
+        self._receptions[key] = _Reception(buffer, memoryview(buffer), count, 1, timestamp, timestamp)
+
+    def _consecutive_frames_received(
+        self,
+        key: int,
+        pci_offset: int,
+        timestamps: np.ndarray,
+        lengths: np.ndarray,
+        frames: np.ndarray,
+        messages: List[ReassembledMessage],
+    ) -> None:
+        reception = self._receptions[key]
+        count = len(timestamps)
+        capacities = lengths - pci_offset - 1
+        # Frames up to the end of the message. Later ones are outside of the reception
+        needed = int(np.searchsorted(np.cumsum(capacities), len(reception.buffer) - reception.offset)) + 1
+        end = min(needed, count)
+        expected = (reception.next_sequence_number + np.arange(end)) & 0x0F
+        invalid = (frames[:end, pci_offset] & 0x0F) != expected
+        if self._timeout is not None:
+            gaps = np.diff(timestamps[:end], prepend=reception.last_timestamp) > self._timeout
+            invalid |= gaps
+        errors = np.flatnonzero(invalid)
+        if len(errors):
+            first = int(errors[0])
+            self._copy_payload(reception, frames[:first], capacities[:first], pci_offset)
+            timed_out = self._timeout is not None and gaps[first]
+            error_code = NResult.N_TIMEOUT_Cr if timed_out else NResult.N_WRONG_SN
+            del self._receptions[key]
+            messages.append(self._abort(key, reception, error_code, float(timestamps[first])))
+            return
+        self._copy_payload(reception, frames[:end], capacities[:end], pci_offset)
+        reception.next_sequence_number = (reception.next_sequence_number + end) & 0x0F
+        reception.last_timestamp = float(timestamps[end - 1])
+        if reception.offset == len(reception.buffer):
+            del self._receptions[key]
+            messages.append(self._message(key, reception.buffer, reception.start_timestamp, reception.last_timestamp))
+
+    @staticmethod
+    def _copy_payload(reception: _Reception, frames: np.ndarray, capacities: np.ndarray, pci_offset: int) -> None:
+        """Appends the payloads of ConsecutiveFrames to the reception buffer, dropping the padding of the last one"""
+        if not len(frames):
+            return
+        block = frames[:, pci_offset + 1 :]
+        if np.all(capacities >= block.shape[1]):
+            payload = block.ravel()
+        else:
+            # Shorter frames than the columns, e.g. CAN frames stored with CAN FD ones
+            payload = block[np.arange(block.shape[1]) < capacities[:, None]]
+        offset = reception.offset
+        count = min(len(payload), len(reception.buffer) - offset)
+        reception.view[offset : offset + count] = payload[:count]
+        reception.offset = offset + count
+
+    def _abort(self, key: int, reception: _Reception, error_code: NResult, timestamp: float) -> ReassembledMessage:
+        return self._message(
+            key, reception.buffer[: reception.offset], reception.start_timestamp, timestamp, error_code
+        )
+
+    @staticmethod
+    def _message(
+        key: int, data: bytes | bytearray, start: float, end: float, result: NResult = NResult.N_OK
+    ) -> ReassembledMessage:
+        extension = key >> 32
+        return ReassembledMessage(
+            arbitration_id=key & 0xFFFFFFFF,
+            address_extension=extension - 1 if extension else None,
+            data=data,
+            start_timestamp=start,
+            end_timestamp=end,
+            result=result,
+        )
+
+
+def reassemble_arrays(
+    timestamp: np.ndarray,
+    arbitration_id: np.ndarray,
+    length: np.ndarray,
+    data: np.ndarray,
+    addressing: AddressInfo | Iterable[AddressInfo],
+    is_extended: Optional[np.ndarray] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    **kwargs,
+) -> Iterator[ReassembledMessage]:
+    """
+    Reassembles the ISO-TP messages of a recording held in columns, e.g. the ones of a FrameStorage
+    :param kwargs: see OfflineReassembler
+    """
+    reassembler = OfflineReassembler(addressing, **kwargs)
+    for start in range(0, len(timestamp), batch_size):
+        batch = slice(start, start + batch_size)
+        yield from reassembler.feed(
+            timestamp[batch],
+            arbitration_id[batch],
+            length[batch],
+            data[batch],
+            None if is_extended is None else is_extended[batch],
+        )
+    yield from reassembler.finish()
+
+
+def reassemble(
+    frames: Iterable[can.Message],
+    addressing: AddressInfo | Iterable[AddressInfo],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    **kwargs,
+) -> Iterator[ReassembledMessage]:
+    """
+    Reassembles the ISO-TP messages of recorded frames, e.g. read by a can.LogReader. Frames of other arbitration ids
+    are skipped before being copied into the batches.
+    :param kwargs: see OfflineReassembler
+    """
+    reassembler = OfflineReassembler(addressing, **kwargs)
+    arbitration_ids = reassembler.arbitration_ids
+    timestamp = np.empty(batch_size, dtype=np.float64)
+    arbitration_id = np.empty(batch_size, dtype=np.uint32)
+    length = np.empty(batch_size, dtype=np.uint8)
+    is_extended = np.empty(batch_size, dtype=bool)
+    data = np.zeros((batch_size, MAX_PAYLOAD_LENGTH), dtype=np.uint8)
+    count = 0
+    for msg in frames:
+        if msg.arbitration_id not in arbitration_ids or msg.is_remote_frame or msg.is_error_frame:
+            continue
+        payload = msg.data[:MAX_PAYLOAD_LENGTH]
+        timestamp[count] = msg.timestamp
+        arbitration_id[count] = msg.arbitration_id
+        length[count] = len(payload)
+        is_extended[count] = msg.is_extended_id
+        data[count, : len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+        count += 1
+        if count == batch_size:
+            yield from reassembler.feed(timestamp, arbitration_id, length, data, is_extended)
+            count = 0
+    if count:
+        yield from reassembler.feed(
+            timestamp[:count], arbitration_id[:count], length[:count], data[:count], is_extended[:count]
+        )
+    yield from reassembler.finish()
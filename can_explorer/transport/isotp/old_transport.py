@@ -1,34 +1,10 @@
 import logging
 import asyncio
-from dataclasses import dataclass
-from typing import Optional
-import time
 import can
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass(slots=True)
-class Timer:
-    start: Optional[int] = 0
-    timeout: Optional[int] = 0
-    timeout_event = asyncio.Future()
-
-    @staticmethod
-    def now() -> int:
-        return time.perf_counter_ns()
-
-    def run(self, start: Optional[int]):
-        self.start = start or self.now()
-
-    async def process(self):
-        async with asyncio.Timeout(self.timeout / 1_000_000) as tm:
-            await asyncio.sleep(self.timeout / 1e6)
-
-    def stop(self):
-        self.start = None
-
-
 class IsoTpCanProtocol(asyncio.Protocol):
 
     __slot__ = ('_transport', '_on_con_lost', '_data_received_queue', '_error_queue')
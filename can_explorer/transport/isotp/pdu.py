@@ -1,9 +1,10 @@
+import bisect
 import logging
 import math
 
 import can
 import enum
-from typing import Optional
+from typing import Optional, Tuple
 from dataclasses import dataclass
 
 from can_explorer.transport.can_message import CanMessage
@@ -12,6 +13,9 @@ from can_explorer.transport.isotp.errors import IsoTpError, NResult
 
 logger = logging.getLogger(__name__)
 
+PADDING_BYTE = 0xCC
+MAX_FF_DL_12BIT = 2**12 - 1
+
 
 @enum.unique
 class PCIType(enum.IntEnum):
@@ -35,6 +39,103 @@ class FlowStatus(enum.IntEnum):
     OVERFLOW = 0x02
 
 
+# CAN_DL of each DLC. The first 9 DLCs are the same for CAN and CAN FD
+CAN_FD_LENGTHS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 12, 16, 20, 24, 32, 48, 64)
+CAN_LENGTHS = CAN_FD_LENGTHS[:9]
+# Smallest DLC holding each CAN_DL
+CAN_FD_DLCS = tuple(bisect.bisect_left(CAN_FD_LENGTHS, length) for length in range(CAN_FD_LENGTHS[-1] + 1))
+CAN_DLCS = CAN_FD_DLCS[:9]
+
+# (result, PCI type, SF_DL/FF_DL/SN/FS, data start/BS, STmin). See parse_pci()
+ParsedPci = Tuple[NResult, int, int, int, int]
+
+_EMPTY_FRAME = (NResult.N_ERROR, -1, 0, 0, 0)
+_INVALID_SINGLE_FRAME = (NResult.N_ERROR, PCIType.SINGLE_FRAME, 0, 0, 0)
+_INVALID_FIRST_FRAME = (NResult.N_ERROR, PCIType.FIRST_FRAME, 0, 0, 0)
+_INVALID_FLOW_CONTROL = (NResult.N_ERROR, PCIType.FLOW_CONTROL_FRAME, 0, 0, 0)
+_DEFAULT_ST_MIN = 0x7F
+
+
+def _parse_single_frame(data: bytearray, offset: int, can_dl: int) -> ParsedPci:
+    """:ref ISO-15765-2-2016 SingleFrame N_PCI parameter definition"""
+    sf_dl = data[offset] & 0x0F
+    data_start = offset + 1
+    if sf_dl == 0:
+        # Escaped SF_DL, only allowed in CAN FD frames longer than 8 bytes. Lower values are reserved
+        if can_dl <= 8:
+            return _INVALID_SINGLE_FRAME
+        sf_dl = data[offset + 1]
+        data_start = offset + 2
+        if sf_dl <= 7:
+            return _INVALID_SINGLE_FRAME
+    if can_dl - data_start < sf_dl:
+        return _INVALID_SINGLE_FRAME
+    return NResult.N_OK, PCIType.SINGLE_FRAME, sf_dl, data_start, 0
+
+
+def _parse_first_frame(data: bytearray, offset: int, can_dl: int) -> ParsedPci:
+    """:ref ISO-15765-2-2016 FirstFrame N_PCI parameter definition (Page 28)"""
+    if can_dl < 8:
+        return _INVALID_FIRST_FRAME
+    ff_dl = (data[offset] & 0x0F) << 8 | data[offset + 1]
+    data_start = offset + 2
+    if ff_dl == 0:
+        ff_dl = int.from_bytes(data[offset + 2 : offset + 6], "big")
+        data_start = offset + 6
+    # A shorter message would have fitted in a SingleFrame
+    ff_dl_min = 8 - offset if can_dl <= 8 else can_dl - 1 - offset
+    if ff_dl < ff_dl_min:
+        return _INVALID_FIRST_FRAME
+    return NResult.N_OK, PCIType.FIRST_FRAME, ff_dl, data_start, 0
+
+
+def _parse_consecutive_frame(data: bytearray, offset: int, can_dl: int) -> ParsedPci:
+    """:ref ISO-15765-2-2016 ConsecutiveFrame N_PCI parameter definition (Page 29)"""
+    return NResult.N_OK, PCIType.CONSECUTIVE_FRAME, data[offset] & 0x0F, offset + 1, 0
+
+
+def _parse_flow_control_frame(data: bytearray, offset: int, can_dl: int) -> ParsedPci:
+    """:ref ISO-15765-2-2016 FlowControl N_PCI parameter definition (Page 30)"""
+    if can_dl < offset + 3:
+        return _INVALID_FLOW_CONTROL
+    flow_status = data[offset] & 0x0F
+    if flow_status > FlowStatus.OVERFLOW:
+        return NResult.N_INVALID_FS, PCIType.FLOW_CONTROL_FRAME, flow_status, 0, 0
+    st_min = data[offset + 2]
+    if not (st_min <= 0x7F or 0xF1 <= st_min <= 0xF9):
+        logger.warning(f"Invalid separation time {st_min=}. Defaulting to {_DEFAULT_ST_MIN}")
+        st_min = _DEFAULT_ST_MIN
+    return NResult.N_OK, PCIType.FLOW_CONTROL_FRAME, flow_status, data[offset + 1], st_min
+
+
+def _parse_reserved(data: bytearray, offset: int, can_dl: int) -> ParsedPci:
+    return NResult.N_UNEXP_PDU, data[offset] >> 4, 0, 0, 0
+
+
+# Indexed by the upper nibble of the N_PCI
+_PCI_PARSERS = (
+    _parse_single_frame,
+    _parse_first_frame,
+    _parse_consecutive_frame,
+    _parse_flow_control_frame,
+) + (_parse_reserved,) * 12
+
+
+def parse_pci(data: bytearray, offset: int = 0) -> ParsedPci:
+    """
+    Parses the N_PCI of a frame without allocating a PDU. Invalid frames are reported by the result instead of an
+    exception.
+    :param offset: position of the N_PCI, 1 in mixed addressing
+    :return: (result, PCI type, value, position, STmin). The value is the SF_DL or FF_DL, the SN or the FS depending
+    on the type. The position is the start of the payload in the frame, or the BS of a FlowControl. STmin is only set
+    for FlowControls
+    """
+    can_dl = len(data)
+    if can_dl <= offset:
+        return _EMPTY_FRAME
+    return _PCI_PARSERS[data[offset] >> 4](data, offset, can_dl)
+
+
 @dataclass(frozen=True, slots=True)
 class PDU:
     msg_type: PCIType
@@ -45,24 +146,34 @@ class PDU:
     flow_status: Optional[int] = None
     block_size: Optional[int] = None
     st_min: Optional[int] = None
-    DLC_MAP = list(range(0, 9))
+    data_length: Optional[int] = None  # SF_DL or FF_DL: length of the whole message
 
     @classmethod
-    def from_can(cls, msg: can.Message, addressing: AddressInfo) -> Optional["PDU"]:
-        assert len(msg.data) >= 1, f"Empty CAN frames are not allowed: {msg}"
-        msg_type = (msg.data[0] >> 4) & 0x0F
-        pci_type = PCIType(msg_type)
-        pdu = None
+    def from_can(cls, msg: can.Message, addressing: AddressInfo) -> "PDU":
+        """Raises an IsoTpError for invalid frames. See parse_pci() for the allocation-free path"""
+        data = msg.data
+        result, pci_type, value, position, st_min = parse_pci(data, addressing.pci_offset)
+        if result != NResult.N_OK:
+            raise IsoTpError(result, f"Invalid frame: {msg}")
+        can_dl = len(data)
         match pci_type:
             case PCIType.SINGLE_FRAME:
-                pdu = cls.parse_single_frame(msg, addressing)
+                return cls(
+                    PCIType.SINGLE_FRAME, msg.is_fd, data[position : position + value], can_dl, data_length=value
+                )
             case PCIType.FIRST_FRAME:
-                pdu = cls.parse_first_frame(msg, addressing)
+                return cls(PCIType.FIRST_FRAME, msg.is_fd, data[position:], can_dl, data_length=value)
             case PCIType.CONSECUTIVE_FRAME:
-                pdu = cls.parse_consecutive_frame(msg, addressing)
-            case PCIType.FLOW_CONTROL_FRAME:
-                pdu = cls.parse_flow_control_frame(msg, addressing)
-        return pdu
+                return cls(PCIType.CONSECUTIVE_FRAME, msg.is_fd, data[position:], can_dl, sequence_number=value)
+        return cls(
+            PCIType.FLOW_CONTROL_FRAME,
+            msg.is_fd,
+            bytearray(),
+            can_dl,
+            flow_status=FlowStatus(value),
+            block_size=position,
+            st_min=st_min,
+        )
 
     @classmethod
     def build_flow_control_frame(
@@ -73,15 +184,15 @@ class PDU:
         addressing: AddressInfo,
     ):
         assert 0x00 <= block_size <= 0xFF, f"Invalid block size: {block_size=}"
-        if 900 <= st_min_us <= 127_000:
-            st_min = int(math.ceil(st_min_us / 1_000))
-        elif 100 <= st_min_us <= 900:
+        if st_min_us == 0:
+            st_min = 0
+        elif 0 < st_min_us <= 900:
             st_min = 0xF0 + int(math.ceil(st_min_us / 100))
+        elif 900 < st_min_us <= 127_000:
+            st_min = int(math.ceil(st_min_us / 1_000))
         else:
             raise ValueError(f"{st_min_us=} overflow!")
-        data = bytearray(
-            [(PCIType.FLOW_CONTROL_FRAME << 4) | flow_status, block_size, st_min]
-        )
+        data = bytearray([(PCIType.FLOW_CONTROL_FRAME << 4) | flow_status, block_size, st_min])
         return cls(
             msg_type=PCIType.FLOW_CONTROL_FRAME,
             flow_status=flow_status,
@@ -92,183 +203,100 @@ class PDU:
             data=data,
         )
 
-    def export(self, address_info: AddressInfo) -> CanMessage:
-        return CanMessage(
-            arbitration_id=address_info.arbitration_id,
-            dlc=self.encode_dlc(len(self.data), is_fd=self.is_fd),
-            data=self.data,
-            is_fd=self.is_fd,
-            is_extended_id=address_info.is_extended,
-        )
+    @staticmethod
+    def single_frame_capacity(addressing: AddressInfo) -> int:
+        """Largest payload fitting in a SingleFrame. CAN FD frames over 8 bytes use the escaped SF_DL"""
+        frame_length = addressing.maximum_payload_length - addressing.pci_offset
+        if addressing.maximum_payload_length <= 8:
+            return frame_length - 1
+        return frame_length - 2
+
+    @staticmethod
+    def first_frame_capacity(length: int, addressing: AddressInfo) -> int:
+        """Payload bytes carried by the FirstFrame of a message of the given length"""
+        frame_length = addressing.maximum_payload_length - addressing.pci_offset
+        if length <= MAX_FF_DL_12BIT:
+            return frame_length - 2
+        return frame_length - 6
+
+    @staticmethod
+    def consecutive_frame_capacity(addressing: AddressInfo) -> int:
+        return addressing.maximum_payload_length - addressing.pci_offset - 1
 
     @classmethod
-    def parse_single_frame(
-        cls, msg: can.Message, addressing: AddressInfo
-    ) -> Optional["PDU"]:
-        """
-        :param msg:
-        :param addressing
-        :ref See: ISO-15765-2-2016 SingleFrame N_PCI parameter definition
-        :return:
-        """
-        sf_dl = msg.data[0] & 0x0F
-        is_fd = msg.is_fd
-        can_msg_length = cls.decode_dlc(msg.dlc, is_fd=msg.is_fd)
-        if sf_dl == 0:
-            assert (
-                msg.is_fd
-            ), "Larger than 8 bytes long messages only allowed on bus with FD support"
-            assert msg.dlc >= 2, (
-                "More than 2 bytes required when parsing a"
-                "single frame with less than 2 bytes"
-            )
-            sf_dl = msg.data[1]
-            assert sf_dl >= 0b110, "Single Data length reserved by ISO15765"
-            data_start = 2
-            decoded_dlc = cls.decode_dlc(sf_dl, is_fd)
-            assert (
-                decoded_dlc <= can_msg_length - 3
-            ), f"Invalid SF_DL. Expecting max: CAN_DL - 3. Got: {decoded_dlc=}"
-            is_extended_or_mixed_addressing = sf_dl == 0b111
+    def build_single_frame(cls, data: bytes | memoryview, addressing: AddressInfo) -> "PDU":
+        length = len(data)
+        assert 0 < length <= cls.single_frame_capacity(addressing), f"Invalid single frame length: {length=}"
+        if length <= 7:
+            frame = bytearray([(PCIType.SINGLE_FRAME << 4) | length])
         else:
-            is_normal_addressing = sf_dl == 0b111
-            data_start = 1
-        assert sf_dl != 0, f"Invalid SF_DL with value 0 value"
-        # TODO: Handle case sf_dl = CAN_DL - 2
-        sf_msg_length = cls.decode_dlc(sf_dl, is_fd=msg.is_fd)
-        assert (
-            can_msg_length - data_start >= sf_msg_length
-        ), f"Invalid range of SF_DL. Expected max: CAN_DL - 3. Got: {sf_dl=}"
-        data = msg.data[data_start:][: max(can_msg_length - data_start, sf_msg_length)]
-        return cls(
-            msg_type=PCIType.SINGLE_FRAME, is_fd=is_fd, data=data, can_dl=can_msg_length
-        )
+            frame = bytearray([PCIType.SINGLE_FRAME << 4, length])
+        frame += data
+        return cls(msg_type=PCIType.SINGLE_FRAME, is_fd=addressing.is_fd, data=frame, can_dl=len(frame))
 
     @classmethod
-    def parse_first_frame(
-        cls, msg: can.Message, addressing: AddressInfo
-    ) -> Optional["PDU"]:
+    def build_first_frame(cls, data: bytes | memoryview, addressing: AddressInfo) -> "PDU":
         """
-        :param msg:
-        :param addressing:
+        :param data: the whole message. Only the part fitting in the FirstFrame is copied
         :ref ISO-15765-2-2016 FirstFrame N_PCI parameter definition (Page 28)
-        :return:
         """
-        is_fd = msg.is_fd
-        can_dl = cls.decode_dlc(msg.dlc, is_fd=is_fd)
-        assert can_dl >= 2, f"Expected FF with at least 2 bytes. Got {can_dl=}"
-        ff_dl = ((msg.data[0] & 0x0F) << 8) | msg.data[1]
-        data_start = 2
-        assert can_dl >= 8, f"First frame length must be at least 8 bytes long"
-        ff_dl_max = 2**12 - 1
-        if ff_dl == 0:
-            assert (
-                can_dl >= 2 + 4
-            ), f"Expect FF with at least 2 + 4 bytes. Got: {can_dl=}"
-            ff_dl = (
-                (msg.data[2] << 24)
-                | (msg.data[3] << 16)
-                | (msg.data[2] << 8)
-                | (msg.data[7])
-            )
-            data_start = 6
-            ff_dl_max = 2**32 - 1
-        if can_dl <= 8:
-            ff_dl_min = 8 if addressing.is_normal_addressing else 7
+        length = len(data)
+        assert length > cls.single_frame_capacity(addressing), f"Message fits in a single frame: {length=}"
+        if length <= MAX_FF_DL_12BIT:
+            frame = bytearray([(PCIType.FIRST_FRAME << 4) | (length >> 8), length & 0xFF])
         else:
-            ff_dl_min = can_dl - 1 if addressing.is_normal_addressing else can_dl - 2
-        assert (
-            ff_dl_min <= ff_dl <= ff_dl_max
-        ), f"Invalid FF dlc received. Expected value in range: {ff_dl_min=} and {ff_dl_max=}. Got: {ff_dl=}"
-        data = msg.data[data_start:][: max(can_dl - data_start, ff_dl)]
-        return cls(msg_type=PCIType.FIRST_FRAME, is_fd=is_fd, data=data, can_dl=can_dl)
+            frame = bytearray([PCIType.FIRST_FRAME << 4, 0x00]) + length.to_bytes(4, "big")
+        frame += data[: cls.first_frame_capacity(length, addressing)]
+        return cls(msg_type=PCIType.FIRST_FRAME, is_fd=addressing.is_fd, data=frame, can_dl=len(frame))
 
     @classmethod
-    def parse_consecutive_frame(
-        cls, msg: can.Message, addressing: AddressInfo
-    ) -> Optional["PDU"]:
-        """
-        :param msg:
-        :param addressing:
-        :ref ISO-15765-2-2016ConsecutiveFrame N_PCI parameter definition (Page 29)
-        :return:
-        """
-        can_dl = cls.decode_dlc(msg.dlc, is_fd=msg.is_fd)
-        is_fd = msg.is_fd
-        assert (
-            can_dl >= 1
-        ), f"Expected CAN message with at least on byte. Got: {can_dl=}"
-        sn = msg.data[0] & 0x0F
-        if not 0 <= sn <= 0x0F:
-            raise IsoTpError(
-                NResult.N_WRONG_SN, f"Expected values between 0 and 0xF. Got: {sn=}"
-            )
+    def build_consecutive_frame(cls, sequence_number: int, data: bytes | memoryview, addressing: AddressInfo) -> "PDU":
+        frame = bytearray([(PCIType.CONSECUTIVE_FRAME << 4) | (sequence_number & 0x0F)])
+        frame += data
         return cls(
             msg_type=PCIType.CONSECUTIVE_FRAME,
-            is_fd=is_fd,
-            data=msg.data[1:],
-            sequence_number=sn,
-            can_dl=can_dl,
+            is_fd=addressing.is_fd,
+            data=frame,
+            can_dl=len(frame),
+            sequence_number=sequence_number & 0x0F,
         )
 
-    @classmethod
-    def parse_flow_control_frame(
-        cls, msg: can.Message, addressing: AddressInfo
-    ) -> Optional["PDU"]:
-        """
-        :param msg:
-        :param addressing:
-        :ref ISO-15765-2-2016 FlowControl N_PCI parameter definition (Page 30)
-        :return:
-        """
-        is_fd = msg.is_fd
-        can_dl = cls.decode_dlc(msg.dlc, is_fd)
-        assert (
-            can_dl >= 3
-        ), f"Expected at least flow control frame with at least 3 bytes. Got: {can_dl=}"
-        flow_status = msg.data[0] & 0x0F
-        if flow_status not in FlowStatus:
-            raise IsoTpError(
-                NResult.N_INVALID_FS, f"Invalid Flow Status received: {flow_status=}"
-            )
-        block_size = msg.data[1]
-        st_min = msg.data[2]
-        if not 0 <= st_min <= 0x7F or 0xF1 <= st_min <= 0xF9:
-            default_separation_time = 0x7F
-            logger.warning(
-                f"Invalid separation time {st_min=}. Defaulting to {default_separation_time=}"
-            )
-            st_min = default_separation_time
-        return cls(
-            msg_type=PCIType.FLOW_CONTROL_FRAME,
-            data=bytearray(),
-            is_fd=is_fd,
-            flow_status=flow_status,
-            block_size=block_size,
-            st_min=st_min,
-            can_dl=can_dl,
+    def to_can(self, address_info: AddressInfo) -> can.Message:
+        """Frame of a built PDU, prefixed by the address extension in mixed addressing and padded to the next valid
+        CAN(-FD) data length"""
+        data = self.data
+        if address_info.pci_offset:
+            data = bytearray([address_info.address_extension]) + data
+        length = max(8, self.decode_dlc(self.encode_dlc(len(data), self.is_fd), self.is_fd))
+        if len(data) < length:
+            data = data + bytes([PADDING_BYTE]) * (length - len(data))
+        return can.Message(
+            arbitration_id=address_info.arbitration_id,
+            data=data,
+            is_fd=self.is_fd,
+            bitrate_switch=self.is_fd and address_info.btr,
+            is_extended_id=address_info.is_extended,
+        )
+
+    def export(self, address_info: AddressInfo) -> CanMessage:
+        return CanMessage(
+            arbitration_id=address_info.arbitration_id,
+            dlc=self.encode_dlc(len(self.data), is_fd=self.is_fd),
+            data=self.data,
+            is_fd=self.is_fd,
+            is_extended_id=address_info.is_extended,
         )
 
     @staticmethod
     def decode_dlc(dlc: int, is_fd: bool) -> int:
-        dlc_map = PDU.DLC_MAP
-        if is_fd:
-            dlc_map = dlc_map + [12, 16, 20, 24, 32, 48, 64]
-        assert dlc < len(dlc_map), f"Given {dlc=} out of range: {dlc_map=}"
-        return dlc_map[dlc]
+        lengths = CAN_FD_LENGTHS if is_fd else CAN_LENGTHS
+        if not 0 <= dlc < len(lengths):
+            raise ValueError(f"Given {dlc=} out of range for {is_fd=}")
+        return lengths[dlc]
 
     @staticmethod
     def encode_dlc(length: int, is_fd: bool) -> int:
-        assert length >= 0, "Length must be positive bro"
-        dlc_map = PDU.DLC_MAP
-        if is_fd:
-            dlc_map = dlc_map + [12, 16, 20, 24, 32, 48, 64]
-        assert (
-            length <= dlc_map[-1]
-        ), f"Value overflow for given type: {length=}, {is_fd=}"
-        for i, value in enumerate(dlc_map):
-            if length == value:
-                return i
-            if length > value:
-                return i + 1
-        return dlc_map[-1]
+        dlcs = CAN_FD_DLCS if is_fd else CAN_DLCS
+        if not 0 <= length < len(dlcs):
+            raise ValueError(f"Value overflow for given type: {length=}, {is_fd=}")
+        return dlcs[length]
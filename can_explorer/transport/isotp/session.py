@@ -0,0 +1,495 @@
+import asyncio
+import enum
+import logging
+import math
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import can
+
+from can_explorer.transport.can_dispatcher import Subscription, dispatcher_for
+from can_explorer.transport.can_writer import CanWriteBuffer, SendTimeoutError
+from can_explorer.transport.isotp.addressing import AddressInfo
+from can_explorer.transport.isotp.errors import IsoTpError, NResult
+from can_explorer.transport.isotp.pdu import PDU, FlowStatus, PCIType, parse_pci
+from can_explorer.transport.timer import Timer, TimerWheel
+
+logger = logging.getLogger(__name__)
+
+# See ISO-15765-2-2016 Table 16
+N_AS_TIMEOUT = 1.0  # Time for the transmission of a frame
+N_BS_TIMEOUT = 1.0  # Time until reception of the next FlowControl
+N_CR_TIMEOUT = 1.0  # Time until reception of the next ConsecutiveFrame
+MAX_WAIT_FRAMES = 10  # N_WFTmax: FlowControl WAIT frames accepted in a row
+DEFAULT_MAX_RX_LENGTH = 16 * 1024 * 1024  # Longer messages are rejected with an OVERFLOW FlowControl
+# ConsecutiveFrames handed at once to the write buffer. Longer blocks are sent as successive trains
+MAX_TRAIN_FRAMES = 64
+
+SessionKey = Tuple[int, int, int, int]
+
+
+@enum.unique
+class TransportState(enum.IntEnum):
+    IDLE = 0x00
+    SEGMENTED_TX = 0x01
+    SEGMENTED_RX = 0x02
+    CLOSING = 0x03
+    COMPLETE = 0x04
+
+
+@dataclass(slots=True)
+class TransmitConfig:
+    block_size: Optional[int] = None
+    flow_status: Optional[FlowStatus] = None
+    min_separation_time_us: Optional[int] = None
+    first_frame_length: Optional[int] = None
+    transmit_state_rx: TransportState = TransportState.IDLE
+    transmit_timer: Optional[Timer] = None
+    last_sequence_number: int = 0
+    block_count: int = 0
+    rx_buffer: Optional[bytearray] = None
+    rx_view: Optional[memoryview] = None
+    rx_offset: int = 0
+
+    @staticmethod
+    def parse_st_min(st_min: int) -> int:
+        """:return: the separation time in microseconds"""
+        if 0 <= st_min <= 0x7F:
+            return st_min * 1_000
+        elif 0xF1 <= st_min <= 0xF9:
+            return (st_min - 0xF0) * 100
+        raise ValueError(f'Invalid {st_min=}')
+
+
+class IsoTpSession:
+    """
+    Independent RX and TX state machines of one ISO-TP address pair. The frames addressed to the session are fed
+    through frame_received() by its owner, which also provides the write buffer of the bus.
+    Written messages are sent one after the other by a task of the session, started by start().
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        writer: CanWriteBuffer,
+        addressing: AddressInfo,
+        on_message: Callable[[bytearray], None],
+        on_error: Callable[[Exception], None],
+        block_size: int = 0,
+        st_min_us: int = 0,
+        max_rx_length: int = DEFAULT_MAX_RX_LENGTH,
+        timers: Optional[TimerWheel] = None,
+    ):
+        """
+        :param on_message: called with every complete received message
+        :param on_error: called with the IsoTpError or can.CanError aborting a transfer
+        :param block_size: BS sent to the peer in our FlowControls. 0 for no further FlowControl
+        :param st_min_us: STmin sent to the peer in our FlowControls
+        :param max_rx_length: longest message accepted, at most the 4GB of the escaped FF_DL
+        :param timers: wheel of the N_Bs and N_Cr timeouts, usually shared by all sessions of the loop
+        """
+        self._loop = loop
+        self._writer = writer
+        self._addressing = addressing
+        self.on_message = on_message
+        self.on_error = on_error
+        self._rx_block_size = block_size
+        self._rx_st_min_us = st_min_us
+        self._max_rx_length = max_rx_length
+        self._state = TransportState.IDLE
+        self._transmit_config = TransmitConfig()
+        self._tx_config = TransmitConfig()
+        self._timers = timers if timers is not None else TimerWheel(loop)
+        self._transmit_config.transmit_timer = self._timers.create_timer(N_CR_TIMEOUT, self._consecutive_frame_timeout)
+        self._tx_config.transmit_timer = self._timers.create_timer(N_BS_TIMEOUT, self._flow_control_timeout)
+        self._tx_queue: asyncio.Queue = asyncio.Queue()
+        self._tx_task: Optional[asyncio.Task] = None
+        self._flow_control_waiter: Optional[asyncio.Future] = None
+
+    @property
+    def addressing(self) -> AddressInfo:
+        return self._addressing
+
+    @property
+    def key(self) -> SessionKey:
+        return self._addressing.session_key
+
+    @property
+    def state(self) -> TransportState:
+        return self._state
+
+    @property
+    def rx_state(self) -> TransportState:
+        return self._transmit_config.transmit_state_rx
+
+    def start(self) -> None:
+        if self._tx_task is None:
+            self._tx_task = self._loop.create_task(self._transmit_queued())
+            self._tx_task.set_name(f'IsoTpSession-{self.key} transmit task')
+
+    def stop(self) -> None:
+        if self._tx_task is not None:
+            self._tx_task.cancel()
+            self._tx_task = None
+        self._tx_config.transmit_timer.stop()
+        self._reset_segmented_rx(None)
+
+    def write(self, data: bytes | bytearray) -> None:
+        """Queues a message. It is sent once the messages written before are"""
+        self._tx_queue.put_nowait(data)
+
+    def frame_received(self, msg: can.Message) -> None:
+        data = msg.data
+        result, pci_type, value, position, _ = parse_pci(data, self._addressing.pci_offset)
+        if result != NResult.N_OK:
+            logger.warning(f'Skipping invalid IsoTp frame: {msg}. Cause: {result.name}')
+            if result == NResult.N_INVALID_FS:
+                self._flow_control_received(None, IsoTpError(result, f'Invalid flow status {value} in {msg}'))
+            return
+        if pci_type == PCIType.CONSECUTIVE_FRAME:
+            # Bulk of a long transfer: copied into the reception buffer without building a PDU
+            self._consecutive_frame_received(msg, value, position)
+            return
+        if pci_type == PCIType.FLOW_CONTROL_FRAME:
+            # At most one per block: parsed once more into a PDU for the transmission task
+            self._flow_control_received(PDU.from_can(msg, self._addressing))
+            return
+        if self._transmit_config.transmit_state_rx == TransportState.SEGMENTED_RX:
+            self._reset_segmented_rx(msg, NResult.N_UNEXP_PDU)
+        if pci_type == PCIType.SINGLE_FRAME:
+            self.on_message(data[position : position + value])
+        else:
+            self._first_frame_received(msg, value, position)
+
+    async def _transmit_queued(self) -> None:
+        while True:
+            data = await self._tx_queue.get()
+            try:
+                await self._transmit(memoryview(data))
+            except (IsoTpError, can.CanError) as e:
+                logger.error(f'Transmission failed: {e}')
+                self.on_error(e)
+            finally:
+                self._state = TransportState.IDLE
+                self._flow_control_waiter = None
+
+    async def _transmit(self, payload: memoryview) -> None:
+        """
+        Sends a message as SingleFrame, or as FirstFrame followed by blocks of ConsecutiveFrames, each block
+        requested by a FlowControl of the receiver.
+        The ConsecutiveFrames of a block are paced by the requested STmin in the thread of the write buffer, so that
+        concurrent transfers of many sessions neither hold a thread each nor bypass the buffer.
+        """
+        addressing = self._addressing
+        if len(payload) <= PDU.single_frame_capacity(addressing):
+            await self._send_paced([PDU.build_single_frame(payload, addressing).to_can(addressing)])
+            return
+        self._state = TransportState.SEGMENTED_TX
+        config = self._tx_config
+        offset = PDU.first_frame_capacity(len(payload), addressing)
+        sequence_number = 1
+        last_sent = -math.inf
+        waiter = self._expect_flow_control()
+        await self._send_paced([PDU.build_first_frame(payload, addressing).to_can(addressing)])
+        wait_frames = 0
+        while offset < len(payload):
+            flow_control = await self._wait_for_flow_control(waiter)
+            config.flow_status = flow_control.flow_status
+            match flow_control.flow_status:
+                case FlowStatus.WAIT:
+                    wait_frames += 1
+                    if wait_frames > MAX_WAIT_FRAMES:
+                        raise IsoTpError(NResult.N_WFT_OVRN, f'Received more than {MAX_WAIT_FRAMES} WAIT frames')
+                    waiter = self._expect_flow_control()
+                    continue
+                case FlowStatus.OVERFLOW:
+                    raise IsoTpError(NResult.N_BUFFER_OVFLW, f'Receiver cannot take {len(payload)} bytes')
+            wait_frames = 0
+            config.block_size = flow_control.block_size
+            config.min_separation_time_us = TransmitConfig.parse_st_min(flow_control.st_min)
+            separation_time = config.min_separation_time_us / 1_000_000
+            # The next FlowControl may arrive right after the last frame of the block
+            waiter = self._expect_flow_control()
+            remaining = config.block_size or math.inf
+            while remaining and offset < len(payload):
+                frames, offset, sequence_number = self._build_consecutive_frames(
+                    payload, offset, sequence_number, min(remaining, MAX_TRAIN_FRAMES)
+                )
+                last_sent = await self._send_paced(frames, separation_time, last_sent + separation_time)
+                remaining -= len(frames)
+
+    def _build_consecutive_frames(
+        self, payload: memoryview, offset: int, sequence_number: int, count: int
+    ) -> Tuple[List[can.Message], int, int]:
+        """:return: up to `count` ConsecutiveFrames, the offset in the payload and the sequence number after them"""
+        addressing = self._addressing
+        capacity = PDU.consecutive_frame_capacity(addressing)
+        end = len(payload)
+        frames = []
+        for _ in range(count):
+            if offset >= end:
+                break
+            chunk = payload[offset : offset + capacity]
+            frames.append(PDU.build_consecutive_frame(sequence_number, chunk, addressing).to_can(addressing))
+            offset += len(chunk)
+            sequence_number = (sequence_number + 1) & 0x0F
+        return frames, offset, sequence_number
+
+    async def _send_paced(
+        self, frames: List[can.Message], separation_time: float = 0.0, not_before: float = 0.0
+    ) -> float:
+        """
+        Sends frames separated by at least `separation_time` seconds, the first one not before `not_before`.
+        Each frame must be sent within N_As once due.
+        :return: the now() time the last frame was sent
+        """
+        sent: asyncio.Future = self._loop.create_future()
+
+        def on_done(error: Optional[Exception], last_sent: float) -> None:
+            if sent.done():
+                return
+            if isinstance(error, SendTimeoutError):
+                sent.set_exception(IsoTpError(NResult.N_TIMEOUT_A, f'Frame not sent in time: {error}'))
+            elif error is not None:
+                # E.g. a controller in bus-off: not a timeout, reported as raised by the bus
+                sent.set_exception(error)
+            else:
+                sent.set_result(last_sent)
+
+        if not self._writer.write_paced(frames, separation_time, on_done, not_before, send_timeout=N_AS_TIMEOUT):
+            raise IsoTpError(NResult.N_ERROR, f'{len(frames)} frames dropped by the write buffer')
+        return await sent
+
+    def _expect_flow_control(self) -> asyncio.Future:
+        self._flow_control_waiter = self._loop.create_future()
+        return self._flow_control_waiter
+
+    async def _wait_for_flow_control(self, waiter: asyncio.Future) -> PDU:
+        timer = self._tx_config.transmit_timer
+        timer.reset()
+        try:
+            return await waiter
+        finally:
+            timer.stop()
+
+    def _flow_control_timeout(self) -> None:
+        self._flow_control_received(
+            None, IsoTpError(NResult.N_TIMEOUT_Bs, f'No flow control received within {N_BS_TIMEOUT}s')
+        )
+
+    def _flow_control_received(self, pdu: Optional[PDU], error: Optional[IsoTpError] = None) -> None:
+        waiter = self._flow_control_waiter
+        if waiter is None or waiter.done():
+            logger.warning(f'Ignoring unexpected flow control: {pdu}')
+            return
+        if error is not None:
+            waiter.set_exception(error)
+        else:
+            waiter.set_result(pdu)
+
+    def _reset_segmented_rx(self, msg: Optional[can.Message], error_code: NResult = NResult.N_OK):
+        """Ends the current reception, reporting the error code unless N_OK"""
+        config = self._transmit_config
+        config.transmit_timer.stop()
+        if error_code != NResult.N_OK and config.transmit_state_rx == TransportState.SEGMENTED_RX:
+            logger.warning(f'Aborting reception of {config.first_frame_length} bytes on {msg}: {error_code.name}')
+            self.on_error(IsoTpError(error_code, f'Reception aborted on {msg}'))
+        config.transmit_state_rx = TransportState.IDLE
+        config.rx_buffer = None
+        config.rx_view = None
+        config.rx_offset = 0
+        config.block_count = 0
+
+    def _transmit_flow_control(self, flow_status: FlowStatus):
+        flow_control = PDU.build_flow_control_frame(
+            flow_status=flow_status,
+            block_size=self._rx_block_size,
+            st_min_us=self._rx_st_min_us,
+            addressing=self._addressing,
+        )
+        self._writer.write(flow_control.to_can(self._addressing))
+
+    def _first_frame_received(self, msg: can.Message, length: int, data_start: int) -> None:
+        """Allocates the buffer of the whole message, answering with an overflow if it is too large"""
+        config = self._transmit_config
+        if length > self._max_rx_length:
+            logger.warning(f'Rejecting message of {length} bytes. Maximum: {self._max_rx_length}')
+            self._transmit_flow_control(FlowStatus.OVERFLOW)
+            return
+        config.first_frame_length = length
+        config.rx_buffer = bytearray(length)
+        config.rx_view = memoryview(config.rx_buffer)
+        config.rx_offset = self._copy_payload(msg, data_start)
+        config.last_sequence_number = 0
+        config.block_count = 0
+        config.transmit_state_rx = TransportState.SEGMENTED_RX
+        config.transmit_timer.reset()
+        self._transmit_flow_control(FlowStatus.CONTINUE_TO_SEND)
+
+    def _consecutive_frame_received(self, msg: can.Message, sequence_number: int, data_start: int) -> None:
+        config = self._transmit_config
+        if config.transmit_state_rx != TransportState.SEGMENTED_RX:
+            logger.debug(f'Ignoring consecutive frame outside of a segmented reception: {msg}')
+            return
+        expected_sn = (config.last_sequence_number + 1) & 0x0F
+        if sequence_number != expected_sn:
+            self._reset_segmented_rx(msg, NResult.N_WRONG_SN)
+            return
+        config.last_sequence_number = expected_sn
+        config.rx_offset = self._copy_payload(msg, data_start)
+        if config.rx_offset == config.first_frame_length:
+            data = config.rx_buffer
+            self._reset_segmented_rx(msg)
+            self.on_message(data)
+            return
+        config.transmit_timer.reset()
+        config.block_count += 1
+        if self._rx_block_size and config.block_count == self._rx_block_size:
+            config.block_count = 0
+            self._transmit_flow_control(FlowStatus.CONTINUE_TO_SEND)
+
+    def _consecutive_frame_timeout(self) -> None:
+        self._reset_segmented_rx(None, NResult.N_TIMEOUT_Cr)
+
+    def _copy_payload(self, msg: can.Message, data_start: int) -> int:
+        """
+        Copies the payload of a frame into the reception buffer, without intermediate copies. Padding after the end of
+        the message is ignored.
+        :return: the new offset in the reception buffer
+        """
+        config = self._transmit_config
+        offset = config.rx_offset
+        count = min(len(msg.data) - data_start, config.first_frame_length - offset)
+        config.rx_view[offset : offset + count] = memoryview(msg.data)[data_start : data_start + count]
+        return offset + count
+
+
+class IsoTpSessionManager:
+    """
+    Runs many ISO-TP sessions on one bus, e.g. the diagnostics of every ECU behind a gateway. All sessions share a
+    single dispatcher subscription and write buffer. Received frames are looked up by arbitration id, then by
+    address extension for mixed addressing, so the cost per frame does not grow with the number of sessions.
+    Every session has its own protocol, called with the complete messages of the session.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        bus: can.BusABC,
+        block_size: int = 0,
+        st_min_us: int = 0,
+        max_rx_length: int = DEFAULT_MAX_RX_LENGTH,
+    ):
+        self._loop = loop
+        self._bus = bus
+        self._session_options = dict(block_size=block_size, st_min_us=st_min_us, max_rx_length=max_rx_length)
+        self._sessions: Dict[SessionKey, IsoTpSession] = {}
+        self._protocols: Dict[SessionKey, asyncio.Protocol] = {}
+        # (arbitration id, is extended) -> address extension, None in normal addressing -> session
+        self._index: Dict[Tuple[int, bool], Dict[Optional[int], IsoTpSession]] = {}
+        self._subscription: Optional[Subscription] = None
+        self._timers = TimerWheel(loop)
+        self._writer = CanWriteBuffer(
+            bus, loop=loop, on_pause=self._pause_writing, on_resume=self._resume_writing, on_error=self._write_error
+        )
+
+    @property
+    def sessions(self) -> List[IsoTpSession]:
+        return list(self._sessions.values())
+
+    def get_session(self, key: SessionKey) -> Optional[IsoTpSession]:
+        return self._sessions.get(key)
+
+    def open_session(self, addressing: AddressInfo, protocol_factory) -> Tuple[asyncio.Protocol, IsoTpSession]:
+        """Starts a session for the given address pair. The protocol receives it as its transport"""
+        key = addressing.session_key
+        if key in self._sessions:
+            raise ValueError(f'Session already open: {key}')
+        index_key = (addressing.rx_arbitration_id, addressing.is_extended)
+        extension = None if addressing.is_normal_addressing else addressing.address_extension
+        indexed = self._index.get(index_key, {}).get(extension)
+        if indexed is not None:
+            # Frames are routed by receive id and extension only: the new session would never receive any
+            raise ValueError(f'Session {indexed.key} already receives the frames of {key}')
+        protocol = protocol_factory()
+        session = IsoTpSession(
+            self._loop,
+            self._writer,
+            addressing,
+            on_message=protocol.data_received,
+            on_error=lambda exc: self._session_error(protocol, exc),
+            timers=self._timers,
+            **self._session_options,
+        )
+        self._sessions[key] = session
+        self._protocols[key] = protocol
+        self._index.setdefault(index_key, {})[extension] = session
+        self._update_subscription()
+        session.start()
+        self._loop.call_soon(protocol.connection_made, session)
+        return protocol, session
+
+    def close_session(self, session: IsoTpSession) -> None:
+        key = session.key
+        if self._sessions.get(key) is not session:
+            return
+        addressing = session.addressing
+        index_key = (addressing.rx_arbitration_id, addressing.is_extended)
+        sessions = self._index[index_key]
+        del sessions[None if addressing.is_normal_addressing else addressing.address_extension]
+        if not sessions:
+            del self._index[index_key]
+        del self._sessions[key]
+        protocol = self._protocols.pop(key)
+        session.stop()
+        self._update_subscription()
+        self._loop.call_soon(protocol.connection_lost, None)
+
+    def close(self) -> None:
+        for session in self.sessions:
+            self.close_session(session)
+        self._timers.close()
+        self._writer.close()
+
+    def _update_subscription(self) -> None:
+        arbitration_ids = {arbitration_id for arbitration_id, _ in self._index}
+        if not arbitration_ids:
+            if self._subscription is not None:
+                self._subscription.cancel()
+                self._subscription = None
+            return
+        if self._subscription is None:
+            self._subscription = dispatcher_for(self._bus).subscribe(
+                self._frames_received, arbitration_ids=arbitration_ids, loop=self._loop
+            )
+        else:
+            self._subscription.set_arbitration_ids(arbitration_ids)
+
+    def _frames_received(self, frames: List[can.Message]) -> None:
+        index = self._index
+        for msg in frames:
+            sessions = index.get((msg.arbitration_id, msg.is_extended_id))
+            if sessions is None:
+                continue
+            session = sessions.get(None)
+            if session is None and msg.data:
+                session = sessions.get(msg.data[0])
+            if session is not None:
+                session.frame_received(msg)
+
+    def _session_error(self, protocol: asyncio.Protocol, exc: Exception) -> None:
+        error_received = getattr(protocol, 'error_received', None)
+        if error_received is not None:
+            error_received(exc)
+
+    def _write_error(self, exc: Exception) -> None:
+        for protocol in list(self._protocols.values()):
+            self._session_error(protocol, exc)
+
+    def _pause_writing(self) -> None:
+        for protocol in list(self._protocols.values()):
+            protocol.pause_writing()
+
+    def _resume_writing(self) -> None:
+        for protocol in list(self._protocols.values()):
+            protocol.resume_writing()
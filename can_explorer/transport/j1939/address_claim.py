@@ -0,0 +1,187 @@
+import asyncio
+import enum
+import logging
+from typing import Callable, Dict, List, Optional
+
+import can
+
+from can_explorer.transport.j1939.addressing import Name
+from can_explorer.transport.j1939.pdu import DEFAULT_PRIORITY, GLOBAL_ADDRESS, NULL_ADDRESS, PDU, REQUEST_PGN
+from can_explorer.transport.timer import TimerWheel
+
+logger = logging.getLogger(__name__)
+
+ADDRESS_CLAIMED_PGN = 0xEE00
+CLAIM_TIMEOUT = 0.25  # Time without contention until a claimed address may be used. See J1939-81 4.4.4.3
+# Addresses picked by arbitrary address capable ECUs. See J1939 Appendix B
+ARBITRARY_ADDRESSES = range(128, 248)
+ADDRESS_COUNT = 256
+
+
+@enum.unique
+class ClaimState(enum.IntEnum):
+    UNCLAIMED = enum.auto()
+    CLAIMING = enum.auto()
+    CLAIMED = enum.auto()
+    CANNOT_CLAIM = enum.auto()
+
+
+class AddressClaimManager:
+    """
+    Address claim procedure of J1939-81. Keeps the table of the NAME owning every source address of the network from
+    the claims on the bus, so that frames can be labeled with the NAME of their sender in O(1).
+    With a NAME, the manager also claims an address for the node: conflicts are won by the lower NAME, a node losing
+    its address picks a free one if it is arbitrary address capable and announces that it cannot claim otherwise.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        send: Callable[[can.Message], None],
+        name: Optional[Name] = None,
+        timers: Optional[TimerWheel] = None,
+        on_address_changed: Optional[Callable[[Optional[int]], None]] = None,
+    ):
+        """
+        :param send: queues a frame for transmission, e.g. CanWriteBuffer.write
+        :param name: NAME of the node. None to only follow the claims of the others
+        :param on_address_changed: called with the address of the node once usable, None once lost
+        """
+        self._loop = loop
+        self._send = send
+        self._name = name
+        self._name_value = name.value if name is not None else None
+        self.on_address_changed = on_address_changed
+        self._timers = timers if timers is not None else TimerWheel(loop)
+        self._claim_timer = self._timers.create_timer(CLAIM_TIMEOUT, self._claim_confirmed)
+        self._names: List[Optional[Name]] = [None] * ADDRESS_COUNT
+        self._addresses: Dict[int, int] = {}  # NAME value -> address
+        self._address: Optional[int] = None
+        self._state = ClaimState.UNCLAIMED
+
+    @property
+    def name(self) -> Optional[Name]:
+        return self._name
+
+    @property
+    def state(self) -> ClaimState:
+        return self._state
+
+    @property
+    def address(self) -> Optional[int]:
+        """Address of the node, None until claimed"""
+        return self._address if self._state == ClaimState.CLAIMED else None
+
+    def name_of(self, address: int) -> Optional[Name]:
+        """:return: the NAME of the ECU owning the address"""
+        return self._names[address]
+
+    def address_of(self, name: Name) -> Optional[int]:
+        return self._addresses.get(name.value)
+
+    def table(self) -> Dict[int, Name]:
+        """:return: the NAME of every claimed address"""
+        return {address: name for address, name in enumerate(self._names) if name is not None}
+
+    def claim(self, address: int) -> None:
+        """Claims an address for the node. It is usable once nobody contested it for CLAIM_TIMEOUT"""
+        if self._name is None:
+            raise ValueError("A NAME is needed to claim an address")
+        owner = self._names[address]
+        if owner is not None and owner.value < self._name_value:
+            # Lost in advance: take another address right away
+            self._claim_lost(address)
+            return
+        self._claim(address)
+
+    def request_address_claims(self, destination_address: int = GLOBAL_ADDRESS) -> None:
+        """Asks the ECUs to claim their address again, e.g. to fill the table after connecting to a running network"""
+        source_address = self._address if self._state == ClaimState.CLAIMED else NULL_ADDRESS
+        pdu = PDU.from_pgn(REQUEST_PGN, source_address, destination_address, DEFAULT_PRIORITY)
+        data = ADDRESS_CLAIMED_PGN.to_bytes(3, "little")
+        self._send(can.Message(arbitration_id=pdu.arbitration_id, data=data, is_extended_id=True))
+
+    def close(self) -> None:
+        self._claim_timer.stop()
+
+    def frame_received(self, msg: can.Message, pdu: PDU) -> None:
+        pgn = pdu.pgn
+        if pgn == ADDRESS_CLAIMED_PGN:
+            if len(msg.data) >= 8:
+                self._address_claimed(pdu.source_address, int.from_bytes(msg.data[:8], "little"))
+        elif pgn == REQUEST_PGN and msg.data[:3] == b"\x00\xee\x00":
+            if pdu.destination_address in (GLOBAL_ADDRESS, self._address) and self._name is not None:
+                self._answer_request()
+
+    def _address_claimed(self, address: int, name_value: int) -> None:
+        if name_value == self._name_value:
+            return
+        previous = self._addresses.pop(name_value, None)
+        if previous is not None:
+            self._names[previous] = None
+        if address == NULL_ADDRESS:
+            # Cannot claim
+            return
+        owner = self._names[address]
+        if owner is not None and owner.value < name_value:
+            # The owner keeps the address
+            if owner is self._name:
+                self._send_claim(address)
+            return
+        if owner is not None:
+            del self._addresses[owner.value]
+        self._names[address] = Name.from_value(name_value)
+        self._addresses[name_value] = address
+        if owner is not None and owner is self._name:
+            self._claim_lost(address)
+
+    def _answer_request(self) -> None:
+        if self._state in (ClaimState.CLAIMING, ClaimState.CLAIMED):
+            self._send_claim(self._address)
+        elif self._state == ClaimState.CANNOT_CLAIM:
+            self._send_claim(NULL_ADDRESS)
+
+    def _claim(self, address: int) -> None:
+        was_usable = self.address is not None
+        previous = self._addresses.pop(self._name_value, None)
+        if previous is not None:
+            self._names[previous] = None
+        self._names[address] = self._name
+        self._addresses[self._name_value] = address
+        self._address = address
+        self._state = ClaimState.CLAIMING
+        self._send_claim(address)
+        self._claim_timer.reset()
+        if was_usable and self.on_address_changed is not None:
+            self.on_address_changed(None)
+
+    def _claim_lost(self, address: int) -> None:
+        was_usable = self.address is not None
+        self._claim_timer.stop()
+        if self._name.arbitrary_address_capable:
+            free = next((candidate for candidate in ARBITRARY_ADDRESSES if self._names[candidate] is None), None)
+            if free is not None:
+                logger.info(f"Address {address:#x} lost. Claiming {free:#x}")
+                self._claim(free)
+                return
+        logger.warning(f"Address {address:#x} lost, no address left to claim")
+        previous = self._addresses.pop(self._name_value, None)
+        if previous is not None and self._names[previous] is self._name:
+            self._names[previous] = None
+        self._address = None
+        self._state = ClaimState.CANNOT_CLAIM
+        self._send_claim(NULL_ADDRESS)
+        if was_usable and self.on_address_changed is not None:
+            self.on_address_changed(None)
+
+    def _claim_confirmed(self) -> None:
+        if self._state != ClaimState.CLAIMING:
+            return
+        self._state = ClaimState.CLAIMED
+        logger.info(f"Address {self._address:#x} claimed")
+        if self.on_address_changed is not None:
+            self.on_address_changed(self._address)
+
+    def _send_claim(self, address: int) -> None:
+        pdu = PDU.from_pgn(ADDRESS_CLAIMED_PGN, address, GLOBAL_ADDRESS, DEFAULT_PRIORITY)
+        self._send(can.Message(arbitration_id=pdu.arbitration_id, data=self._name.to_bytes(), is_extended_id=True))
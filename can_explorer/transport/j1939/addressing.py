@@ -1,6 +1,86 @@
 import logging
 import asyncio
+from dataclasses import dataclass
+from typing import Optional
+
+from can_explorer.transport.j1939.pdu import DEFAULT_PRIORITY, GLOBAL_ADDRESS
+from can_explorer.util.validator import is_byte
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class Name:
+    """64 bit NAME identifying an ECU on the network. See J1939-81 4.1.1. Lower values win address conflicts"""
+
+    identity_number: int = 0
+    manufacturer_code: int = 0
+    ecu_instance: int = 0
+    function_instance: int = 0
+    function: int = 0
+    vehicle_system: int = 0
+    vehicle_system_instance: int = 0
+    industry_group: int = 0
+    arbitrary_address_capable: bool = False
+
+    @property
+    def value(self) -> int:
+        return (
+            int(self.arbitrary_address_capable) << 63
+            | (self.industry_group & 0x07) << 60
+            | (self.vehicle_system_instance & 0x0F) << 56
+            | (self.vehicle_system & 0x7F) << 49
+            | (self.function & 0xFF) << 40
+            | (self.function_instance & 0x1F) << 35
+            | (self.ecu_instance & 0x07) << 32
+            | (self.manufacturer_code & 0x7FF) << 21
+            | self.identity_number & 0x1FFFFF
+        )
+
+    def to_bytes(self) -> bytes:
+        return self.value.to_bytes(8, "little")
+
+    @classmethod
+    def from_value(cls, value: int) -> "Name":
+        return cls(
+            identity_number=value & 0x1FFFFF,
+            manufacturer_code=(value >> 21) & 0x7FF,
+            ecu_instance=(value >> 32) & 0x07,
+            function_instance=(value >> 35) & 0x1F,
+            function=(value >> 40) & 0xFF,
+            vehicle_system=(value >> 49) & 0x7F,
+            vehicle_system_instance=(value >> 56) & 0x0F,
+            industry_group=(value >> 60) & 0x07,
+            arbitrary_address_capable=bool(value >> 63),
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes | bytearray) -> "Name":
+        return cls.from_value(int.from_bytes(data[:8], "little"))
 
 
 class AddressInfo:
-    pass
+    def __init__(
+        self,
+        source_address: Optional[int] = None,
+        destination_address: int = GLOBAL_ADDRESS,
+        pgn: int = 0,
+        priority: int = DEFAULT_PRIORITY,
+        name: Optional[Name] = None,
+    ):
+        """
+        :param source_address: address of the transport. None to only listen, without answering connections.
+        With a NAME, the address is claimed first and may change on conflicts
+        :param destination_address: default destination of written data
+        :param pgn: default PGN of written data
+        :param priority: default priority of written data
+        :param name: NAME of the transport, used to claim its address
+        """
+        self.source_address = source_address
+        self.destination_address = destination_address
+        self.pgn = pgn
+        self.priority = priority
+        self.name = name
+        if source_address is not None:
+            is_byte.validate(source_address)
+        is_byte.validate(destination_address)
@@ -0,0 +1,32 @@
+import enum
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+@enum.unique
+class AbortReason(enum.IntEnum):
+    """Connection abort reasons of the transport protocol. See J1939-21 5.10.3.4"""
+
+    ALREADY_IN_SESSION = 1
+    RESOURCES = 2
+    TIMEOUT = 3
+    CTS_DURING_TRANSFER = 4
+    MAX_RETRANSMIT = 5
+    UNEXPECTED_DATA_TRANSFER = 6
+    BAD_SEQUENCE_NUMBER = 7
+    DUPLICATE_SEQUENCE_NUMBER = 8
+    MESSAGE_TOO_LARGE = 9
+    OTHER = 250
+
+
+class J1939Error(Exception):
+    def __init__(self, reason: AbortReason, msg: Optional[str]):
+        super().__init__(f"{reason.name}: {msg}")
+        self._reason = reason
+        self._msg = msg
+
+    @property
+    def reason(self) -> AbortReason:
+        return self._reason
@@ -3,35 +3,102 @@ from dataclasses import dataclass
 import can
 import logging
 import enum
+from can_explorer.transport.j1939.address_claim import AddressClaimManager
 from can_explorer.transport.j1939.addressing import AddressInfo
-from typing import Optional
+from can_explorer.transport.j1939.errors import J1939Error
+from can_explorer.transport.j1939.pdu import decode_arbitration_id
+from can_explorer.transport.j1939.transport_protocol import J1939Message, J1939TransportProtocol
+from can_explorer.transport.can_dispatcher import dispatcher_for
+from can_explorer.transport.can_writer import CanWriteBuffer
+from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 
 
 class J1939Transport(asyncio.Transport):
+    """
+    J1939 endpoint. The protocol receives every frame, and every message through its message_received() if it has
+    one, multi-packet messages being reassembled by the transport protocol
+    """
+
     def __init__(
         self,
         loop: asyncio.AbstractEventLoop,
         protocol: asyncio.Protocol,
         bus: can.BusABC,
-        addressing: AddressInfo,
+        addressing: Optional[AddressInfo] = None,
     ):
         self._protocol = protocol
         self._loop = loop
         self._bus = bus
         self._poll_task: Optional[asyncio.Task] = None
-        self._notifier = None
-        self._addressing = addressing
+        self._writer = CanWriteBuffer(
+            bus,
+            loop=loop,
+            on_pause=lambda: self._protocol.pause_writing(),
+            on_resume=lambda: self._protocol.resume_writing(),
+            on_error=self._write_error,
+        )
+        self._addressing = addressing if addressing is not None else AddressInfo()
+        name = self._addressing.name
+        self._address_claims = AddressClaimManager(
+            loop, send=self._writer.write, name=name, on_address_changed=self._address_changed
+        )
+        self._transport_protocol = J1939TransportProtocol(
+            loop,
+            send=self._writer.write,
+            on_message=self._message_received,
+            on_error=self._receive_error,
+            # With a NAME, the address is only used once claimed
+            address=self._addressing.source_address if name is None else None,
+        )
         self._rx_queue = asyncio.Queue()
         self._tx_queue = asyncio.Queue()
-        self._rx_reader = can.AsyncBufferedReader()
         self._tx_reader = can.AsyncBufferedReader()
-        super().__init__()
+        self._closing = False
+        super().__init__(extra={"bus": bus})
+        # J1939 only uses 29 bit identifiers. The dispatcher of the bus keeps the standard frames away
+        self._subscription = dispatcher_for(bus).subscribe(self._frames_received, is_extended=True, loop=loop)
+        if loop is not None:
+            loop.call_soon(self._protocol.connection_made, self)
+            if name is not None and self._addressing.source_address is not None:
+                loop.call_soon(self._address_claims.claim, self._addressing.source_address)
+
+    @property
+    def address_claims(self) -> AddressClaimManager:
+        """NAME of every address of the network"""
+        return self._address_claims
+
+    def _address_changed(self, address: Optional[int]) -> None:
+        self._transport_protocol.address = address
+
+    def _frames_received(self, frames: List[can.Message]) -> None:
+        frames_received = getattr(self._protocol, "frames_received", None)
+        if frames_received is not None:
+            frames_received(frames)
+        else:
+            for msg in frames:
+                self._protocol.data_received(msg)
+        message_received = getattr(self._protocol, "message_received", None)
+        transport_protocol = self._transport_protocol
+        address_claims = self._address_claims
+        for msg in frames:
+            pdu = decode_arbitration_id(msg.arbitration_id)
+            address_claims.frame_received(msg, pdu)
+            if not transport_protocol.frame_received(msg, pdu) and message_received is not None:
+                message = J1939Message.from_frame(msg, pdu)
+                message.source_name = address_claims.name_of(pdu.source_address)
+                message_received(message)
+
+    def _message_received(self, message: J1939Message) -> None:
+        message_received = getattr(self._protocol, "message_received", None)
+        if message_received is not None:
+            message.source_name = self._address_claims.name_of(message.source_address)
+            message_received(message)
 
     def is_reading(self):
         """Return True if the transport is receiving."""
-        raise NotImplementedError
+        return not self._subscription.paused
 
     def pause_reading(self):
         """Pause the receiving end.
@@ -39,7 +106,7 @@ class J1939Transport(asyncio.Transport):
         No data will be passed to the protocol's data_received()
         method until resume_reading() is called.
         """
-        raise NotImplementedError
+        self._subscription.pause()
 
     def resume_reading(self):
         """Resume the receiving end.
@@ -47,7 +114,7 @@ class J1939Transport(asyncio.Transport):
         Data received will once again be passed to the protocol's
         data_received() method.
         """
-        raise NotImplementedError
+        self._subscription.resume()
 
     def set_write_buffer_limits(self, high=None, low=None):
         """Set the high- and low-water limits for write flow control.
@@ -68,17 +135,31 @@ class J1939Transport(asyncio.Transport):
         reduces opportunities for doing I/O and computation
         concurrently.
         """
-        raise NotImplementedError
+        self._writer.set_limits(high, low)
 
     def get_write_buffer_size(self):
         """Return the current size of the write buffer."""
-        raise NotImplementedError
+        return self._writer.get_size()
 
     def get_write_buffer_limits(self):
         """Get the high and low watermarks for write flow control.
         Return a tuple (low, high) where low and high are
         positive number of bytes."""
-        raise NotImplementedError
+        return self._writer.get_limits()
+
+    def _write_error(self, exc: Exception) -> None:
+        self._report_error(exc, "Could not send frame")
+
+    def _receive_error(self, exc: Exception) -> None:
+        """Reception aborted by the transport protocol: BAM or RTS/CTS timeout, or abort of the sender"""
+        self._report_error(exc, "Reception aborted")
+
+    def _report_error(self, exc: Exception, context: str) -> None:
+        error_received = getattr(self._protocol, "error_received", None)
+        if error_received is not None:
+            error_received(exc)
+        else:
+            logger.warning(f"{context}: {exc}")
 
     def write(self, data):
         """Write some data bytes to the transport.
@@ -86,7 +167,32 @@ class J1939Transport(asyncio.Transport):
         This does not block; it buffers the data and arranges for it
         to be sent out asynchronously.
         """
-        logger.info(f"Writing: {data}")
+        addressing = self._addressing
+        self.write_pgn(addressing.pgn, data, addressing.destination_address, addressing.priority)
+
+    def write_pgn(self, pgn: int, data: bytes, destination_address: int, priority: int) -> None:
+        """Queues a message. Messages over 8 bytes are sent by the transport protocol, one after the other"""
+        self._tx_queue.put_nowait((pgn, data, destination_address, priority))
+        if self._poll_task is None:
+            self._poll_task = self._loop.create_task(self._transmit_queued())
+
+    async def _transmit_queued(self) -> None:
+        while True:
+            pgn, data, destination_address, priority = await self._tx_queue.get()
+            try:
+                await self._transport_protocol.send(pgn, data, destination_address, priority)
+            except (J1939Error, ValueError) as e:
+                logger.error(f"Transmission of PGN {pgn:#x} failed: {e}")
+                self._write_error(e)
+
+    def _stop(self) -> None:
+        self._closing = True
+        self._subscription.cancel()
+        self._transport_protocol.close()
+        self._address_claims.close()
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
 
     def writelines(self, list_of_data):
         """Write a list (or any iterable) of data bytes to the transport.
@@ -117,11 +223,13 @@ class J1939Transport(asyncio.Transport):
         The protocol's connection_lost() method will (eventually) be
         called with None as its argument.
         """
-        raise NotImplementedError
+        if not self._closing:
+            self._stop()
+            self._writer.abort(lambda: self._protocol.connection_lost(None))
 
     def is_closing(self):
         """Return True if the transport is closing or closed."""
-        raise NotImplementedError
+        return self._closing
 
     def close(self):
         """Close the transport.
@@ -131,7 +239,9 @@ class J1939Transport(asyncio.Transport):
         protocol's connection_lost() method will (eventually) be
         called with None as its argument.
         """
-        raise NotImplementedError
+        if not self._closing:
+            self._stop()
+            self._writer.close(lambda: self._protocol.connection_lost(None))
 
     def set_protocol(self, protocol):
         """Set a new protocol."""
@@ -1,13 +1,23 @@
 import logging
 import can
 import enum
-from typing import Optional
-from dataclasses import dataclass
+import numpy as np
+from typing import Dict, Optional
+from dataclasses import dataclass, field
 from can_explorer.util.validator import Bitfield
 
-
 logger = logging.getLogger(__name__)
 
+GLOBAL_ADDRESS = 0xFF
+NULL_ADDRESS = 0xFE
+PDU2_FORMAT_START = 240  # PDU formats from 240 on are broadcast, their PS field is a group extension
+DEFAULT_PRIORITY = 6
+MAX_CACHED_IDS = 1 << 16
+
+REQUEST_PGN = 0xEA00
+ACKNOWLEDGMENT_PGN = 0xE800
+GROUP_FUNCTION_PGN = 0x1ED00
+
 
 @enum.unique
 class MessageType(enum.Enum):
@@ -18,7 +28,7 @@ class MessageType(enum.Enum):
     GROUP_FUNCTION = enum.auto()
 
 
-@dataclass(slots=True)
+@dataclass(frozen=True, slots=True)
 class PDU:
     priority: int
     extended_data_page: int
@@ -26,3 +36,133 @@ class PDU:
     pdu_format: int
     pdu_specific_field: int
     source_address: int
+    # Derived from the fields above once, the decoded PDUs being shared through the cache of decode_arbitration_id()
+    pgn: int = field(init=False, compare=False)
+    destination_address: int = field(init=False, compare=False)
+    message_type: MessageType = field(init=False, compare=False)
+
+    def __post_init__(self):
+        pgn = self.extended_data_page << 17 | self.data_page << 16 | self.pdu_format << 8
+        if self.is_pdu1:
+            destination_address = self.pdu_specific_field
+        else:
+            pgn |= self.pdu_specific_field
+            destination_address = GLOBAL_ADDRESS
+        object.__setattr__(self, "pgn", pgn)
+        object.__setattr__(self, "destination_address", destination_address)
+        object.__setattr__(self, "message_type", message_type_of(pgn, destination_address))
+
+    @property
+    def is_pdu1(self) -> bool:
+        """PDU1 messages are addressed to the destination in their PS field"""
+        return self.pdu_format < PDU2_FORMAT_START
+
+    @property
+    def arbitration_id(self) -> int:
+        return (
+            self.priority << 26
+            | self.extended_data_page << 25
+            | self.data_page << 24
+            | self.pdu_format << 16
+            | self.pdu_specific_field << 8
+            | self.source_address
+        )
+
+    @classmethod
+    def from_arbitration_id(cls, arbitration_id: int) -> "PDU":
+        """Splits a 29 bit identifier into its J1939 fields. See decode_arbitration_id() for the cached variant"""
+        return cls(
+            priority=(arbitration_id >> 26) & 0x07,
+            extended_data_page=(arbitration_id >> 25) & 0x01,
+            data_page=(arbitration_id >> 24) & 0x01,
+            pdu_format=(arbitration_id >> 16) & 0xFF,
+            pdu_specific_field=(arbitration_id >> 8) & 0xFF,
+            source_address=arbitration_id & 0xFF,
+        )
+
+    @classmethod
+    def from_pgn(
+        cls, pgn: int, source_address: int, destination_address: int = GLOBAL_ADDRESS, priority: int = DEFAULT_PRIORITY
+    ) -> "PDU":
+        """PDU of a message. The destination is only used by PDU1 PGNs"""
+        pdu_format = (pgn >> 8) & 0xFF
+        return cls(
+            priority=priority,
+            extended_data_page=(pgn >> 17) & 0x01,
+            data_page=(pgn >> 16) & 0x01,
+            pdu_format=pdu_format,
+            pdu_specific_field=destination_address if pdu_format < PDU2_FORMAT_START else pgn & 0xFF,
+            source_address=source_address,
+        )
+
+
+def message_type_of(pgn: int, destination_address: int) -> MessageType:
+    if pgn == REQUEST_PGN:
+        return MessageType.REQUEST
+    if pgn == ACKNOWLEDGMENT_PGN:
+        return MessageType.ACKNOWLEDGMENT
+    if pgn == GROUP_FUNCTION_PGN:
+        return MessageType.GROUP_FUNCTION
+    if destination_address != GLOBAL_ADDRESS:
+        return MessageType.COMMAND
+    return MessageType.BROADCAST
+
+
+_pdu_cache: Dict[int, PDU] = {}
+
+
+def decode_arbitration_id(arbitration_id: int) -> PDU:
+    """
+    Cached PDU of a 29 bit identifier. Buses reuse a few hundred identifiers, so decoding mostly costs one lookup.
+    The returned PDUs are shared and immutable
+    """
+    global _pdu_cache
+    pdu = _pdu_cache.get(arbitration_id)
+    if pdu is None:
+        if len(_pdu_cache) >= MAX_CACHED_IDS:
+            _pdu_cache = {}
+        pdu = _pdu_cache[arbitration_id] = PDU.from_arbitration_id(arbitration_id)
+    return pdu
+
+
+PDU_DTYPE = np.dtype(
+    [
+        ("priority", np.uint8),
+        ("extended_data_page", np.uint8),
+        ("data_page", np.uint8),
+        ("pdu_format", np.uint8),
+        ("pdu_specific_field", np.uint8),
+        ("source_address", np.uint8),
+        ("pgn", np.uint32),
+        ("destination_address", np.uint8),
+        ("message_type", np.uint8),  # MessageType value
+    ]
+)
+
+
+def decode_arbitration_ids(arbitration_ids: np.ndarray) -> np.ndarray:
+    """Decodes an array of 29 bit identifiers at once, e.g. the ones of a recording, into an array of PDU_DTYPE"""
+    ids = np.asarray(arbitration_ids, dtype=np.uint32)
+    result = np.empty(ids.shape, dtype=PDU_DTYPE)
+    result["priority"] = (ids >> 26) & 0x07
+    result["extended_data_page"] = (ids >> 25) & 0x01
+    result["data_page"] = (ids >> 24) & 0x01
+    pdu_format = (ids >> 16) & 0xFF
+    pdu_specific_field = (ids >> 8) & 0xFF
+    result["pdu_format"] = pdu_format
+    result["pdu_specific_field"] = pdu_specific_field
+    result["source_address"] = ids & 0xFF
+    is_pdu1 = pdu_format < PDU2_FORMAT_START
+    pgn = (ids >> 8) & 0x3FFFF
+    pgn[is_pdu1] &= 0x3FF00
+    destination_address = np.where(is_pdu1, pdu_specific_field, GLOBAL_ADDRESS)
+    result["pgn"] = pgn
+    result["destination_address"] = destination_address
+    message_type = np.where(
+        destination_address != GLOBAL_ADDRESS, MessageType.COMMAND.value, MessageType.BROADCAST.value
+    )
+    message_type[pgn == REQUEST_PGN] = MessageType.REQUEST.value
+    message_type[pgn == ACKNOWLEDGMENT_PGN] = MessageType.ACKNOWLEDGMENT.value
+    message_type[pgn == GROUP_FUNCTION_PGN] = MessageType.GROUP_FUNCTION.value
+    result["message_type"] = message_type
+    return result
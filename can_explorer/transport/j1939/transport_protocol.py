@@ -0,0 +1,491 @@
+import asyncio
+import enum
+import logging
+import math
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import can
+
+from can_explorer.transport.j1939.addressing import Name
+from can_explorer.transport.j1939.errors import AbortReason, J1939Error
+from can_explorer.transport.j1939.pdu import DEFAULT_PRIORITY, GLOBAL_ADDRESS, PDU
+from can_explorer.transport.timer import Timer, TimerWheel
+
+logger = logging.getLogger(__name__)
+
+TP_CM_PGN = 0xEC00  # Connection management
+TP_DT_PGN = 0xEB00  # Data transfer
+ETP_CM_PGN = 0xC800
+ETP_DT_PGN = 0xC700
+
+PACKET_SIZE = 7
+MAX_TP_SIZE = 255 * PACKET_SIZE
+MAX_ETP_SIZE = (2**24 - 1) * PACKET_SIZE
+TP_PRIORITY = 7
+DEFAULT_MAX_RX_LENGTH = 16 * 1024 * 1024
+NO_PACKET_LIMIT = 0xFF
+
+# See J1939-21 5.10.2.4
+T1 = 0.75  # Receiver waiting for the next data transfer
+T2 = 1.25  # Receiver waiting for the data transfer requested by its CTS
+T3 = 1.25  # Sender waiting for a CTS or EndOfMsgAck
+T4 = 1.05  # Sender holding after a CTS for 0 packets
+BAM_PACKET_INTERVAL = 0.05  # Minimum time between the packets of a broadcast
+
+SourceDestination = Tuple[int, int]
+
+
+@enum.unique
+class ControlByte(enum.IntEnum):
+    RTS = 16
+    CTS = 17
+    END_OF_MSG_ACK = 19
+    BAM = 32
+    ETP_RTS = 20
+    ETP_CTS = 21
+    ETP_DPO = 22
+    ETP_END_OF_MSG_ACK = 23
+    ABORT = 255
+
+
+@dataclass(slots=True)
+class J1939Message:
+    pgn: int
+    source_address: int
+    destination_address: int
+    priority: int
+    data: bytes | bytearray
+    timestamp: float
+    source_name: Optional[Name] = None  # NAME of the sender, if it claimed its address
+
+    @classmethod
+    def from_frame(cls, msg: can.Message, pdu: PDU) -> "J1939Message":
+        return cls(pdu.pgn, pdu.source_address, pdu.destination_address, pdu.priority, msg.data, msg.timestamp)
+
+
+@dataclass(slots=True)
+class _Reception:
+    source_address: int
+    destination_address: int
+    pgn: int
+    priority: int
+    mode: ControlByte
+    size: int
+    total_packets: int
+    max_packets: int
+    buffer: bytearray
+    view: memoryview
+    timestamp: float
+    is_receiver: bool  # Answers the connection with CTS and EndOfMsgAck
+    timer: Optional[Timer] = None
+    next_packet: int = 1
+    window_end: int = 0  # Last packet requested by the current CTS
+    packet_offset: int = 0  # ETP data packet offset
+
+    @property
+    def key(self) -> Tuple[int, int, int]:
+        return self.source_address, self.destination_address, self.pgn
+
+    @property
+    def is_extended(self) -> bool:
+        return self.mode == ControlByte.ETP_RTS
+
+
+@dataclass(slots=True)
+class _Transmission:
+    destination_address: int
+    pgn: int
+    timer: Timer
+    waiter: Optional[asyncio.Future] = None
+
+
+class J1939TransportProtocol:
+    """
+    Segmentation and reassembly of the multi-packet messages of J1939-21: broadcasts (BAM), connections (RTS/CTS) and
+    the extended transport protocol of messages over 1785 bytes.
+    Receptions run concurrently, one per source and destination pair as allowed by J1939-21, reassembled into buffers
+    taken from a pool. Connections to `address` are answered with CTS and EndOfMsgAck, the ones between other nodes
+    are followed without answering. Timeouts run on a TimerWheel.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        send: Callable[[can.Message], None],
+        on_message: Callable[[J1939Message], None],
+        on_error: Callable[[Exception], None],
+        address: Optional[int] = None,
+        timers: Optional[TimerWheel] = None,
+        max_rx_length: int = DEFAULT_MAX_RX_LENGTH,
+        packets_per_cts: int = NO_PACKET_LIMIT,
+    ):
+        """
+        :param send: queues a frame for transmission, e.g. CanWriteBuffer.write
+        :param on_message: called with every reassembled message
+        :param on_error: called with the J1939Error aborting a reception
+        :param address: source address of the node. None to only listen
+        :param max_rx_length: connections announcing longer messages are refused
+        :param packets_per_cts: packets requested by each CTS, at most the limit of the RTS
+        """
+        self._loop = loop
+        self._send = send
+        self.on_message = on_message
+        self.on_error = on_error
+        self.address = address
+        self._timers = timers if timers is not None else TimerWheel(loop)
+        self._max_rx_length = max_rx_length
+        self._packets_per_cts = packets_per_cts
+        self._receptions: Dict[SourceDestination, _Reception] = {}
+        self._transmissions: Dict[int, _Transmission] = {}
+        self._buffer_pool: List[bytearray] = []
+        self._handlers = {
+            TP_CM_PGN: self._connection_management_received,
+            ETP_CM_PGN: self._connection_management_received,
+            TP_DT_PGN: self._data_transfer_received,
+            ETP_DT_PGN: self._data_transfer_received,
+        }
+
+    @property
+    def receptions(self) -> List[Tuple[int, int, int]]:
+        """(source, destination, PGN) of the running receptions"""
+        return [reception.key for reception in self._receptions.values()]
+
+    def close(self) -> None:
+        for reception in list(self._receptions.values()):
+            self._close_reception(reception)
+        for transmission in list(self._transmissions.values()):
+            self._fail_transmission(transmission, J1939Error(AbortReason.OTHER, "Transport closed"))
+
+    def frame_received(self, msg: can.Message, pdu: PDU) -> bool:
+        """:return: whether the frame belongs to the transport protocol"""
+        handler = self._handlers.get(pdu.pgn)
+        if handler is None:
+            return False
+        if len(msg.data) != 8:
+            logger.warning(f"Skipping transport protocol frame of invalid length: {msg}")
+        else:
+            handler(msg, pdu)
+        return True
+
+    async def send(
+        self,
+        pgn: int,
+        data: bytes | bytearray,
+        destination_address: int = GLOBAL_ADDRESS,
+        priority: int = DEFAULT_PRIORITY,
+    ) -> None:
+        """
+        Sends a message as single frame, broadcast or connection depending on its length and destination.
+        Raises a J1939Error if the connection is aborted
+        """
+        if self.address is None:
+            raise ValueError("A source address is needed to send")
+        size = len(data)
+        if size <= 8:
+            pdu = PDU.from_pgn(pgn, self.address, destination_address, priority)
+            self._send(can.Message(arbitration_id=pdu.arbitration_id, data=data, is_extended_id=True))
+            return
+        if size > MAX_ETP_SIZE:
+            raise ValueError(f"Message too long: {size} bytes")
+        if destination_address == GLOBAL_ADDRESS:
+            if size > MAX_TP_SIZE:
+                raise ValueError(f"Broadcasts are limited to {MAX_TP_SIZE} bytes. Got: {size}")
+            await self._broadcast(pgn, memoryview(data))
+        else:
+            await self._send_connection(pgn, memoryview(data), destination_address)
+
+    def _connection_management_received(self, msg: can.Message, pdu: PDU) -> None:
+        data = msg.data
+        source, destination = pdu.source_address, pdu.destination_address
+        pgn = int.from_bytes(data[5:8], "little")
+        match data[0]:
+            case ControlByte.BAM:
+                size = data[1] | data[2] << 8
+                self._open_reception(msg, pdu, pgn, ControlByte.BAM, size, data[3], NO_PACKET_LIMIT)
+            case ControlByte.RTS:
+                size = data[1] | data[2] << 8
+                self._open_reception(msg, pdu, pgn, ControlByte.RTS, size, data[3], data[4])
+            case ControlByte.ETP_RTS:
+                size = int.from_bytes(data[1:5], "little")
+                self._open_reception(msg, pdu, pgn, ControlByte.ETP_RTS, size, math.ceil(size / PACKET_SIZE), 0xFF)
+            case ControlByte.CTS | ControlByte.ETP_CTS:
+                if data[0] == ControlByte.CTS:
+                    next_packet = data[2]
+                else:
+                    next_packet = int.from_bytes(data[2:5], "little")
+                self._clear_to_send_received(source, destination, data[1], next_packet)
+            case ControlByte.ETP_DPO:
+                reception = self._receptions.get((source, destination))
+                if reception is not None and reception.is_extended:
+                    reception.packet_offset = int.from_bytes(data[2:5], "little")
+            case ControlByte.END_OF_MSG_ACK | ControlByte.ETP_END_OF_MSG_ACK:
+                transmission = self._transmissions.get(source)
+                if destination == self.address and transmission is not None:
+                    self._resolve(transmission, (ControlByte.END_OF_MSG_ACK, 0, 0))
+            case ControlByte.ABORT:
+                self._abort_received(source, destination, data[1])
+            case _:
+                logger.warning(f"Unknown connection management frame: {msg}")
+
+    def _open_reception(
+        self,
+        msg: can.Message,
+        pdu: PDU,
+        pgn: int,
+        mode: ControlByte,
+        size: int,
+        total_packets: int,
+        max_packets: int,
+    ) -> None:
+        source, destination = pdu.source_address, pdu.destination_address
+        is_receiver = mode != ControlByte.BAM and destination == self.address
+        previous = self._receptions.get((source, destination))
+        if previous is not None:
+            logger.warning(
+                f"New connection of {source:#x} to {destination:#x} aborts the reception of {previous.pgn:#x}"
+            )
+            self._close_reception(previous, J1939Error(AbortReason.ALREADY_IN_SESSION, f"Replaced by {msg}"))
+        if size <= 8 or total_packets != math.ceil(size / PACKET_SIZE):
+            logger.warning(f"Skipping invalid announcement of {size} bytes in {total_packets} packets: {msg}")
+            return
+        if size > self._max_rx_length:
+            logger.warning(f"Refusing message of {size} bytes. Maximum: {self._max_rx_length}")
+            if is_receiver:
+                self._send_abort(source, pgn, AbortReason.RESOURCES, mode == ControlByte.ETP_RTS)
+            return
+        if size <= MAX_TP_SIZE:
+            buffer = self._buffer_pool.pop() if self._buffer_pool else bytearray(MAX_TP_SIZE)
+        else:
+            buffer = bytearray(size)
+        reception = _Reception(
+            source_address=source,
+            destination_address=destination,
+            pgn=pgn,
+            priority=pdu.priority,
+            mode=mode,
+            size=size,
+            total_packets=total_packets,
+            max_packets=max_packets,
+            buffer=buffer,
+            view=memoryview(buffer),
+            timestamp=msg.timestamp,
+            is_receiver=is_receiver,
+        )
+        reception.timer = self._timers.create_timer(T1, lambda: self._reception_timeout(reception))
+        self._receptions[(source, destination)] = reception
+        if is_receiver:
+            self._request_packets(reception)
+        else:
+            reception.window_end = total_packets
+            reception.timer.reset(T1 if mode == ControlByte.BAM else T2)
+
+    def _data_transfer_received(self, msg: can.Message, pdu: PDU) -> None:
+        reception = self._receptions.get((pdu.source_address, pdu.destination_address))
+        if reception is None or reception.is_extended != (pdu.pgn == ETP_DT_PGN):
+            return
+        data = msg.data
+        packet = reception.packet_offset + data[0]
+        if packet != reception.next_packet:
+            if packet < reception.next_packet:
+                reason = AbortReason.DUPLICATE_SEQUENCE_NUMBER
+            else:
+                reason = AbortReason.BAD_SEQUENCE_NUMBER
+            self._abort_reception(reception, reason, f"Expected packet {reception.next_packet}. Got: {packet}")
+            return
+        start = (packet - 1) * PACKET_SIZE
+        count = min(PACKET_SIZE, reception.size - start)
+        reception.view[start : start + count] = data[1 : 1 + count]
+        reception.next_packet = packet + 1
+        if packet == reception.total_packets:
+            self._reception_complete(reception, msg.timestamp)
+        elif reception.is_receiver and packet == reception.window_end:
+            self._request_packets(reception)
+        else:
+            reception.timer.reset(T1)
+
+    def _request_packets(self, reception: _Reception) -> None:
+        """Sends the CTS for the next packets of a connection addressed to us"""
+        count = min(
+            reception.total_packets - reception.next_packet + 1,
+            reception.max_packets,
+            self._packets_per_cts,
+            NO_PACKET_LIMIT,
+        )
+        reception.window_end = reception.next_packet + count - 1
+        if reception.is_extended:
+            data = bytes([ControlByte.ETP_CTS, count]) + reception.next_packet.to_bytes(3, "little")
+        else:
+            data = bytes([ControlByte.CTS, count, reception.next_packet, 0xFF, 0xFF])
+        self._send_connection_management(
+            reception.source_address, data + reception.pgn.to_bytes(3, "little"), reception.is_extended
+        )
+        reception.timer.reset(T2)
+
+    def _reception_complete(self, reception: _Reception, timestamp: float) -> None:
+        if reception.is_receiver:
+            if reception.is_extended:
+                data = bytes([ControlByte.ETP_END_OF_MSG_ACK]) + reception.size.to_bytes(4, "little")
+            else:
+                size = reception.size
+                data = bytes([ControlByte.END_OF_MSG_ACK, size & 0xFF, size >> 8, reception.total_packets, 0xFF])
+            self._send_connection_management(
+                reception.source_address, data + reception.pgn.to_bytes(3, "little"), reception.is_extended
+            )
+        if reception.size > MAX_TP_SIZE:
+            # Allocated for this message only: handed over without copy
+            data = reception.buffer
+        else:
+            data = bytes(reception.view[: reception.size])
+        self._close_reception(reception)
+        self.on_message(
+            J1939Message(
+                reception.pgn,
+                reception.source_address,
+                reception.destination_address,
+                reception.priority,
+                data,
+                timestamp,
+            )
+        )
+
+    def _clear_to_send_received(self, source: int, destination: int, count: int, next_packet: int) -> None:
+        if destination == self.address:
+            transmission = self._transmissions.get(source)
+            if transmission is not None:
+                self._resolve(transmission, (ControlByte.CTS, count, next_packet))
+            return
+        # Connection between other nodes: the CTS of the receiver opens the next window of the sender
+        reception = self._receptions.get((destination, source))
+        if reception is not None:
+            reception.timer.reset(T2)
+
+    def _abort_received(self, source: int, destination: int, reason: int) -> None:
+        try:
+            reason = AbortReason(reason)
+        except ValueError:
+            reason = AbortReason.OTHER
+        error = J1939Error(reason, f"Connection aborted by {source:#x}")
+        transmission = self._transmissions.get(source)
+        if destination == self.address and transmission is not None:
+            self._fail_transmission(transmission, error)
+        for key in ((source, destination), (destination, source)):
+            reception = self._receptions.get(key)
+            if reception is not None:
+                self._close_reception(reception, error)
+
+    def _abort_reception(self, reception: _Reception, reason: AbortReason, msg: str) -> None:
+        if reception.is_receiver:
+            self._send_abort(reception.source_address, reception.pgn, reason, reception.is_extended)
+        self._close_reception(reception, J1939Error(reason, f"Reception of {reception.key} aborted: {msg}"))
+
+    def _reception_timeout(self, reception: _Reception) -> None:
+        self._abort_reception(reception, AbortReason.TIMEOUT, f"Packet {reception.next_packet} not received")
+
+    def _close_reception(self, reception: _Reception, error: Optional[J1939Error] = None) -> None:
+        key = (reception.source_address, reception.destination_address)
+        if self._receptions.get(key) is not reception:
+            return
+        del self._receptions[key]
+        reception.timer.stop()
+        if reception.size <= MAX_TP_SIZE:
+            self._buffer_pool.append(reception.buffer)
+        if error is not None:
+            logger.warning(f"{error}")
+            self.on_error(error)
+
+    def _send_connection_management(self, destination: int, data: bytes, extended: bool = False) -> None:
+        pdu = PDU.from_pgn(ETP_CM_PGN if extended else TP_CM_PGN, self.address, destination, TP_PRIORITY)
+        self._send(can.Message(arbitration_id=pdu.arbitration_id, data=data, is_extended_id=True))
+
+    def _send_abort(self, destination: int, pgn: int, reason: AbortReason, extended: bool) -> None:
+        data = bytes([ControlByte.ABORT, reason, 0xFF, 0xFF, 0xFF]) + pgn.to_bytes(3, "little")
+        self._send_connection_management(destination, data, extended)
+
+    def _send_data_transfer(self, destination: int, sequence_number: int, chunk: memoryview, extended: bool) -> None:
+        pdu = PDU.from_pgn(ETP_DT_PGN if extended else TP_DT_PGN, self.address, destination, TP_PRIORITY)
+        data = bytearray(8)
+        data[0] = sequence_number
+        data[1 : 1 + len(chunk)] = chunk
+        data[1 + len(chunk) :] = b"\xff" * (PACKET_SIZE - len(chunk))
+        self._send(can.Message(arbitration_id=pdu.arbitration_id, data=data, is_extended_id=True))
+
+    async def _broadcast(self, pgn: int, data: memoryview) -> None:
+        size = len(data)
+        total_packets = math.ceil(size / PACKET_SIZE)
+        announcement = bytes([ControlByte.BAM, size & 0xFF, size >> 8, total_packets, 0xFF])
+        self._send_connection_management(GLOBAL_ADDRESS, announcement + pgn.to_bytes(3, "little"))
+        for packet in range(1, total_packets + 1):
+            await asyncio.sleep(BAM_PACKET_INTERVAL)
+            start = (packet - 1) * PACKET_SIZE
+            self._send_data_transfer(GLOBAL_ADDRESS, packet, data[start : start + PACKET_SIZE], False)
+
+    async def _send_connection(self, pgn: int, data: memoryview, destination: int) -> None:
+        if destination in self._transmissions:
+            raise J1939Error(AbortReason.ALREADY_IN_SESSION, f"Connection to {destination:#x} already open")
+        size = len(data)
+        extended = size > MAX_TP_SIZE
+        total_packets = math.ceil(size / PACKET_SIZE)
+        transmission = _Transmission(destination, pgn, timer=None)
+        transmission.timer = self._timers.create_timer(T3, lambda: self._transmission_timeout(transmission))
+        self._transmissions[destination] = transmission
+        try:
+            waiter = self._expect(transmission)
+            if extended:
+                request = bytes([ControlByte.ETP_RTS]) + size.to_bytes(4, "little")
+            else:
+                request = bytes([ControlByte.RTS, size & 0xFF, size >> 8, total_packets, NO_PACKET_LIMIT])
+            self._send_connection_management(destination, request + pgn.to_bytes(3, "little"), extended)
+            timeout = T3
+            while True:
+                transmission.timer.reset(timeout)
+                control, count, next_packet = await waiter
+                waiter = self._expect(transmission)
+                if control == ControlByte.END_OF_MSG_ACK:
+                    return
+                if count == 0:
+                    # Receiver busy: hold the connection open
+                    timeout = T4
+                    continue
+                timeout = T3
+                if not 1 <= next_packet <= total_packets:
+                    raise J1939Error(AbortReason.OTHER, f"CTS for packet {next_packet} of {total_packets}")
+                offset = 0
+                if extended:
+                    offset = next_packet - 1
+                    offset_data = bytes([ControlByte.ETP_DPO, count]) + offset.to_bytes(3, "little")
+                    self._send_connection_management(destination, offset_data + pgn.to_bytes(3, "little"), True)
+                for packet in range(next_packet, min(next_packet + count, total_packets + 1)):
+                    start = (packet - 1) * PACKET_SIZE
+                    self._send_data_transfer(destination, packet - offset, data[start : start + PACKET_SIZE], extended)
+        except J1939Error as e:
+            if e.reason == AbortReason.TIMEOUT:
+                self._send_abort(destination, pgn, AbortReason.TIMEOUT, extended)
+            raise
+        finally:
+            transmission.timer.stop()
+            if self._transmissions.get(destination) is transmission:
+                del self._transmissions[destination]
+
+    def _expect(self, transmission: _Transmission) -> asyncio.Future:
+        transmission.waiter = self._loop.create_future()
+        return transmission.waiter
+
+    @staticmethod
+    def _resolve(transmission: _Transmission, answer: Tuple[ControlByte, int, int]) -> None:
+        waiter = transmission.waiter
+        if waiter is None or waiter.done():
+            logger.warning(f"Ignoring unexpected answer for {transmission.pgn:#x}: {answer}")
+            return
+        waiter.set_result(answer)
+
+    def _transmission_timeout(self, transmission: _Transmission) -> None:
+        self._fail_transmission(
+            transmission, J1939Error(AbortReason.TIMEOUT, f"No answer of {transmission.destination_address:#x}")
+        )
+
+    @staticmethod
+    def _fail_transmission(transmission: _Transmission, error: J1939Error) -> None:
+        waiter = transmission.waiter
+        if waiter is not None and not waiter.done():
+            waiter.set_exception(error)
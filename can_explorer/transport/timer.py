@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import math
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESOLUTION = 0.01  # Protocol timeouts are in the order of 100ms to seconds
+DEFAULT_SLOTS = 256
+
+
+class _Node:
+    """Link of the circular list of a wheel slot. Each slot list starts with a sentinel node"""
+
+    __slots__ = ('previous', 'next')
+
+    def __init__(self):
+        self.previous: Optional[_Node] = None
+        self.next: Optional[_Node] = None
+
+
+class Timer(_Node):
+    """
+    Timer armed in a TimerWheel. A timer is created once and re-armed with reset() as often as needed: arming and
+    stopping only relink the timer, without any allocation.
+    """
+
+    __slots__ = ('timeout', 'callback', 'expiry_tick', '_wheel')
+
+    def __init__(self, wheel: 'TimerWheel', timeout: float, callback: Callable[[], None]):
+        super().__init__()
+        self.timeout = timeout
+        self.callback = callback
+        self.expiry_tick = 0
+        self._wheel = wheel
+
+    @property
+    def is_armed(self) -> bool:
+        return self.previous is not None
+
+    def reset(self, timeout: Optional[float] = None) -> None:
+        """(Re)starts the timer. The callback is called once the timeout elapsed without another reset or stop"""
+        self._wheel._arm(self, self.timeout if timeout is None else timeout)
+
+    def stop(self) -> None:
+        self._wheel._disarm(self)
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel for large numbers of protocol timers, e.g. the N_Cr timeout of every ISO-TP session on a bus.
+    Timers are kept in the slot of their expiry tick, modulo the number of slots. A single loop callback advances the
+    wheel tick by tick while timers are armed, expiring the due timers of each slot.
+    Timers expire at most one resolution late. Timers and their callbacks belong to the thread of the loop.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        resolution: float = DEFAULT_RESOLUTION,
+        slots: int = DEFAULT_SLOTS,
+    ):
+        self._loop = loop
+        self._resolution = resolution
+        self._slots: List[_Node] = []
+        for _ in range(slots):
+            sentinel = _Node()
+            sentinel.previous = sentinel.next = sentinel
+            self._slots.append(sentinel)
+        self._current_tick = self._tick_of(loop.time())
+        self._armed = 0
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def resolution(self) -> float:
+        return self._resolution
+
+    def __len__(self) -> int:
+        """:return: the number of armed timers"""
+        return self._armed
+
+    def create_timer(self, timeout: float, callback: Callable[[], None]) -> Timer:
+        """:return: a stopped timer, armed by its reset()"""
+        return Timer(self, timeout, callback)
+
+    def call_later(self, timeout: float, callback: Callable[[], None]) -> Timer:
+        timer = Timer(self, timeout, callback)
+        timer.reset()
+        return timer
+
+    def close(self) -> None:
+        """Stops all timers"""
+        for sentinel in self._slots:
+            while sentinel.next is not sentinel:
+                self._disarm(sentinel.next)
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick_of(self, time: float) -> int:
+        return math.floor(time / self._resolution)
+
+    def _arm(self, timer: Timer, timeout: float) -> None:
+        if timer.previous is not None:
+            self._unlink(timer)
+        else:
+            if not self._armed:
+                # The wheel does not advance while idle
+                self._current_tick = max(self._current_tick, self._tick_of(self._loop.time()))
+            self._armed += 1
+        # Rounded up, so that a timer never expires early
+        tick = max(math.ceil((self._loop.time() + timeout) / self._resolution), self._current_tick + 1)
+        timer.expiry_tick = tick
+        sentinel = self._slots[tick % len(self._slots)]
+        last = sentinel.previous
+        timer.previous = last
+        timer.next = sentinel
+        last.next = timer
+        sentinel.previous = timer
+        if self._handle is None:
+            self._schedule()
+
+    def _disarm(self, timer: Timer) -> None:
+        if timer.previous is None:
+            return
+        self._unlink(timer)
+        timer.previous = timer.next = None
+        self._armed -= 1
+        if not self._armed and self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    @staticmethod
+    def _unlink(node: _Node) -> None:
+        node.previous.next = node.next
+        node.next.previous = node.previous
+
+    def _schedule(self) -> None:
+        self._handle = self._loop.call_at((self._current_tick + 1) * self._resolution, self._advance)
+
+    def _advance(self) -> None:
+        self._handle = None
+        target = self._tick_of(self._loop.time())
+        slot_count = len(self._slots)
+        while self._current_tick < target and self._armed:
+            self._current_tick += 1
+            tick = self._current_tick
+            sentinel = self._slots[tick % slot_count]
+            expired = None
+            node = sentinel.next
+            while node is not sentinel:
+                following = node.next
+                if node.expiry_tick <= tick:
+                    self._unlink(node)
+                    node.previous = node.next = None
+                    self._armed -= 1
+                    if expired is None:
+                        expired = []
+                    expired.append(node)
+                node = following
+            if expired is not None:
+                # Called once the slot is consistent: callbacks may arm or stop other timers
+                for timer in expired:
+                    try:
+                        timer.callback()
+                    except Exception:
+                        logger.exception(f'Timer callback failed: {timer.callback}')
+        if self._current_tick < target:
+            # Idle wheel: nothing to expire in the skipped ticks
+            self._current_tick = target
+        if self._armed and self._handle is None:
+            self._schedule()
@@ -55,3 +55,4 @@ class CanConfiguration:
     channel: str
     protocol: str
     fd: bool
+    max_frames: int = 500_000
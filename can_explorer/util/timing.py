@@ -0,0 +1,31 @@
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# The OS may oversleep a wait. Its last part can be spent spinning instead, which burns a core and holds the GIL
+# meanwhile: keep it well below the waits it ends
+SPIN_THRESHOLD = 0.0002
+# Typical oversleep of time.sleep() and timed waits. Deadlines tolerating less need spinning
+SLEEP_ACCURACY = 0.0005
+
+now = time.perf_counter
+
+
+def sleep_until(deadline: float, spin_threshold: float = SPIN_THRESHOLD) -> float:
+    """
+    Waits until the given perf_counter() time with sub-millisecond precision: sleeps until shortly before
+    the deadline, then spins for the remaining time.
+    :return: the time the wait ended
+    """
+    remaining = deadline - now()
+    if remaining > spin_threshold:
+        time.sleep(remaining - spin_threshold)
+    current = now()
+    while current < deadline:
+        current = now()
+    return current
+
+
+def precise_sleep(duration: float, spin_threshold: float = SPIN_THRESHOLD) -> float:
+    return sleep_until(now() + duration, spin_threshold)
@@ -0,0 +1,47 @@
+import numpy as np
+from can_explorer.database.cache import DatabaseCache
+
+DBC = '''VERSION ""
+
+BS_:
+
+BU_: ECU
+
+BO_ 256 Engine: 8 ECU
+ SG_ Speed : 0|16@1+ (0.01,0) [0|655.35] "km/h" ECU
+ SG_ Torque : 31|12@0- (0.5,0) [0|0] "Nm" ECU
+
+BO_ 512 Multiplexed: 8 ECU
+ SG_ Selector M : 0|8@1+ (1,0) [0|255] "" ECU
+ SG_ Voltage m1 : 8|16@1+ (0.001,0) [0|0] "V" ECU
+'''
+
+
+def test_cache_hits_and_invalidation(tmp_path):
+    path = tmp_path / 'test.dbc'
+    path.write_text(DBC)
+    cache = DatabaseCache(tmp_path / 'cache')
+    compiled = cache.load(path)
+    cached = cache.load(path)
+    assert (cache.hits, cache.misses) == (1, 1)
+    data = np.random.default_rng(0).integers(0, 256, (100, 8), dtype=np.uint8)
+    data[:, 0] = np.arange(100) % 2
+    for frame_id in (256, 512):
+        expected = compiled.decode_columns(frame_id, data)
+        actual = cached.decode_columns(frame_id, data)
+        assert actual.keys() == expected.keys()
+        for name in expected:
+            np.testing.assert_array_equal(actual[name], expected[name])
+    assert cached.message(0x7FF) is None
+    # Parsed on first access
+    assert cached.database.get_message_by_frame_id(512).name == 'Multiplexed'
+    # Edited file
+    path.write_text(DBC.replace('Torque : 31|12', 'Torque : 31|10'))
+    assert cache.load(path).message(256).signals[1].length == 10
+    assert cache.misses == 2
+    # Corrupted entry
+    for entry in cache.directory.iterdir():
+        entry.write_bytes(b'garbage')
+    assert cache.load(path).message(256) is not None and cache.misses == 3
+    assert cache.load(path) is not None and cache.hits == 2
+    assert cache.clear() == 2
@@ -0,0 +1,78 @@
+import can
+import numpy as np
+import pytest
+from can_explorer.database.dbc import DbcDecoder, load_dbc
+from can_explorer.transport.can_message import FrameBatch
+
+DBC = '''VERSION ""
+
+NS_ :
+
+BS_:
+
+BU_: ECU
+
+BO_ 256 Engine: 8 ECU
+ SG_ Speed : 0|16@1+ (0.01,0) [0|655.35] "km/h" ECU
+ SG_ Temperature : 16|8@1- (1,-40) [-40|215] "C" ECU
+ SG_ Torque : 31|12@0- (0.5,0) [0|0] "Nm" ECU
+ SG_ Counter : 35|4@0+ (1,0) [0|15] "" ECU
+ SG_ Position : 44|20@1+ (1,0) [0|0] "" ECU
+
+BO_ 512 Multiplexed: 8 ECU
+ SG_ Selector M : 0|8@1+ (1,0) [0|255] "" ECU
+ SG_ Voltage m1 : 8|16@1+ (0.001,0) [0|0] "V" ECU
+ SG_ Current m2 : 8|32@1- (0.1,5) [0|0] "A" ECU
+
+BO_ 768 Wide: 24 ECU
+ SG_ Energy : 0|32@1- (1,0) [0|0] "" ECU
+ SG_ Pressure : 32|32@1- (1,0) [0|0] "" ECU
+ SG_ Distance : 68|64@1+ (1,0) [0|0] "" ECU
+ SG_ Level : 143|16@0+ (1,0) [0|0] "" ECU
+
+SIG_VALTYPE_ 768 Pressure : 1;
+'''
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / 'test.dbc'
+    path.write_text(DBC)
+    return load_dbc(path)
+
+
+@pytest.mark.parametrize('frame_id', [256, 512, 768])
+def test_columns_match_cantools(database, frame_id):
+    message = database.get_message_by_frame_id(frame_id)
+    data = np.random.default_rng(frame_id).integers(0, 256, (500, message.length), dtype=np.uint8)
+    if frame_id == 512:
+        data[:, 0] = np.arange(500) % 2 + 1
+    if frame_id == 768:
+        # Finite floats
+        data[:, 7] &= 0x3F
+    decoder = DbcDecoder(database)
+    columns = decoder.decode_columns(frame_id, data)
+    for row in range(len(data)):
+        expected = message.decode(data[row].tobytes(), decode_choices=False)
+        assert decoder.decode(frame_id, data[row].tobytes()) == pytest.approx(expected)
+        actual = {name: column[row] for name, column in columns.items() if not np.isnan(column[row])}
+        assert actual == pytest.approx(expected)
+
+
+def test_batch_grouped_by_id(database):
+    messages = [
+        can.Message(arbitration_id=0x100, data=[0x10, 0x27, 0x50, 0, 0, 0, 0, 0], is_extended_id=False),
+        can.Message(arbitration_id=0x123, data=[1] * 8, is_extended_id=False),
+        can.Message(arbitration_id=0x200, data=[1, 0xE8, 0x03, 0, 0, 0, 0, 0], is_extended_id=False),
+        can.Message(arbitration_id=0x100, data=[0xE8, 0x03, 0x28, 0, 0, 0, 0, 0], is_extended_id=False),
+    ]
+    decoder = DbcDecoder(database)
+    decoded = decoder.decode_batch(FrameBatch.from_messages(messages))
+    assert sorted(decoded) == [0x100, 0x200]
+    indices, values = decoded[0x100]
+    assert list(indices) == [0, 3]
+    assert list(values['Speed']) == pytest.approx([100.0, 10.0])
+    assert list(values['Temperature']) == [40, 0]
+    indices, values = decoded[0x200]
+    assert list(values['Voltage']) == pytest.approx([1.0]) and np.isnan(values['Current'][0])
+    assert decoder.message(0x123) is None
@@ -0,0 +1,45 @@
+import can
+import numpy as np
+from can_explorer.gui.frame_filter import Direction, FilterEngine, FrameFilter, FrameKind, PayloadMask
+from can_explorer.gui.frame_storage import FrameStorage
+
+
+def store(storage: FrameStorage, engine: FilterEngine, messages) -> np.ndarray:
+    first_sequence = storage.total
+    storage.extend(messages)
+    return engine.add(first_sequence)
+
+
+def test_filter_by_ids_and_masks():
+    storage = FrameStorage(capacity=64)
+    engine = FilterEngine(storage)
+    store(storage, engine, [can.Message(arbitration_id=i % 8, data=[i]) for i in range(32)])
+    sequences = engine.apply(FrameFilter(arbitration_ids=frozenset({1}), id_masks=((0x4, 0x6),)))
+    assert [int(storage.arbitration_id[s]) for s in sequences] == [1, 4, 5] * 4
+    assert list(sequences) == sorted(sequences)
+
+
+def test_filter_residual_predicates():
+    storage = FrameStorage(capacity=64)
+    engine = FilterEngine(storage)
+    store(
+        storage,
+        engine,
+        [
+            can.Message(arbitration_id=1, data=[0x12, 0x34], is_rx=True),
+            can.Message(arbitration_id=1, data=[0x13, 0x34], is_rx=False),
+            can.Message(arbitration_id=1, data=[0x22, 0x34], is_rx=True, is_fd=True),
+        ],
+    )
+    assert list(engine.apply(FrameFilter(direction=Direction.TX))) == [1]
+    assert list(engine.apply(FrameFilter(kind=FrameKind.FD))) == [2]
+    assert list(engine.apply(FrameFilter(payload=PayloadMask(mask=b'\x0f\xff', value=b'\x02\x34')))) == [0, 2]
+
+
+def test_filter_matches_new_frames_and_skips_evicted_ones():
+    storage = FrameStorage(capacity=4)
+    engine = FilterEngine(storage)
+    engine.apply(FrameFilter(arbitration_ids=frozenset({2})))
+    assert list(store(storage, engine, [can.Message(arbitration_id=i % 3) for i in range(6)])) == [2, 5]
+    store(storage, engine, [can.Message(arbitration_id=0) for _ in range(2)])
+    assert list(engine.apply(FrameFilter(arbitration_ids=frozenset({2})))) == [5]
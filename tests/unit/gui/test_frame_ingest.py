@@ -0,0 +1,16 @@
+import can
+from can_explorer.gui.frame_ingest import FrameIngest
+
+
+def test_pending_frames_are_bounded():
+    ingest = FrameIngest(max_pending=3)
+    batches = []
+    ingest.batch_ready.connect(batches.append)
+    ingest.push_many([can.Message(arbitration_id=arbitration_id) for arbitration_id in range(4)])
+    ingest.push(can.Message(arbitration_id=4))
+    assert (ingest.pending_count, ingest.dropped_count) == (3, 2)
+    ingest.flush()
+    assert [msg.arbitration_id for msg in batches[0]] == [2, 3, 4]
+    assert ingest.pending_count == 0
+    ingest.flush()
+    assert len(batches) == 1
@@ -0,0 +1,57 @@
+import can
+import pytest
+from can_explorer.gui.frame_storage import FrameStorage
+
+
+def make_frames(count: int, start: int = 0):
+    return [can.Message(timestamp=float(i), arbitration_id=i, data=[i & 0xFF] * 8) for i in range(start, start + count)]
+
+
+def test_storage_keeps_frames_oldest_first():
+    storage = FrameStorage(capacity=8)
+    assert storage.extend(make_frames(5)) == 0
+    assert len(storage) == 5
+    assert [int(storage.arbitration_id[storage.index(row)]) for row in range(5)] == [0, 1, 2, 3, 4]
+    assert bytes(storage.payload(storage.index(4))) == bytes([4] * 8)
+
+
+def test_storage_evicts_oldest_frames_when_full():
+    storage = FrameStorage(capacity=8)
+    storage.extend(make_frames(6))
+    assert storage.extend(make_frames(5, start=6)) == 3
+    assert len(storage) == 8
+    assert storage.head == 3
+    assert [int(storage.arbitration_id[storage.index(row)]) for row in range(8)] == list(range(3, 11))
+
+
+def test_storage_batch_larger_than_capacity():
+    storage = FrameStorage(capacity=4)
+    storage.extend(make_frames(2))
+    storage.extend(make_frames(10, start=2))
+    assert len(storage) == 4
+    assert storage.total == 12
+    assert [float(storage.timestamp[storage.index(row)]) for row in range(4)] == [8.0, 9.0, 10.0, 11.0]
+
+
+def test_storage_remote_frame_has_no_payload():
+    storage = FrameStorage(capacity=2)
+    storage.append(can.Message(arbitration_id=0x10, is_remote_frame=True, dlc=4))
+    assert len(storage.payload(storage.index(0))) == 0
+
+
+def test_storage_rejects_invalid_capacity():
+    with pytest.raises(ValueError):
+        FrameStorage(capacity=0)
+
+
+def test_storage_tracks_changed_bytes_per_id():
+    storage = FrameStorage(capacity=8)
+    storage.extend(
+        [
+            can.Message(arbitration_id=0x100, data=[1, 2, 3]),
+            can.Message(arbitration_id=0x200, data=[1, 2, 3]),
+            can.Message(arbitration_id=0x100, data=[1, 9, 3]),
+        ]
+    )
+    storage.append(can.Message(arbitration_id=0x200, data=[0, 2, 4]))
+    assert [int(storage.changed[storage.index(row)]) for row in range(4)] == [0, 0, 0b010, 0b101]
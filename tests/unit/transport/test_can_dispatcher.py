@@ -0,0 +1,102 @@
+import threading
+import time
+import can
+from can.interfaces.virtual import VirtualBus
+from can_explorer.transport.can_dispatcher import dispatcher_for, range_to_can_filters
+from can_explorer.transport.can_filter import FilterPlacement, matches_id_filters
+
+
+def test_range_to_can_filters():
+    can_filters = range_to_can_filters((0x7DF, 0x7EF))
+    matching = [
+        arbitration_id for arbitration_id in range(0x800) if matches_id_filters(arbitration_id, False, can_filters)
+    ]
+    assert matching == list(range(0x7DF, 0x7F0))
+    assert len(can_filters) == 2
+
+
+def test_frames_are_routed_once_per_subscription():
+    receiving_bus = can.Bus(interface='virtual', channel='test_dispatcher')
+    sending_bus = can.Bus(interface='virtual', channel='test_dispatcher')
+    dispatcher = dispatcher_for(receiving_bus)
+    assert dispatcher_for(receiving_bus) is dispatcher
+    received = {'exact': [], 'range': [], 'extended': [], 'all': []}
+    done = threading.Event()
+
+    def collector(name):
+        def on_frames(frames):
+            received[name].extend(msg.arbitration_id for msg in frames)
+            if len(received['all']) == 6:
+                done.set()
+
+        return on_frames
+
+    dispatcher.subscribe(collector('exact'), arbitration_ids=[0x7E8])
+    dispatcher.subscribe(collector('range'), id_ranges=[(0x7E0, 0x7EF)], is_extended=False)
+    dispatcher.subscribe(collector('extended'), is_extended=True)
+    catch_all = dispatcher.subscribe(collector('all'))
+    for arbitration_id in (0x100, 0x7E0, 0x7E8):
+        sending_bus.send(can.Message(arbitration_id=arbitration_id, is_extended_id=False))
+    for arbitration_id in (0x7E8, 0x18FEF100, 0x18FEF200):
+        sending_bus.send(can.Message(arbitration_id=arbitration_id, is_extended_id=True))
+    assert done.wait(2.0)
+    assert received['exact'] == [0x7E8, 0x7E8]
+    assert received['range'] == [0x7E0, 0x7E8]
+    assert received['extended'] == [0x7E8, 0x18FEF100, 0x18FEF200]
+    assert len(received['all']) == 6
+    for subscription in dispatcher.subscriptions:
+        subscription.cancel()
+    assert not dispatcher.is_active
+    assert dispatcher_for(receiving_bus) is not dispatcher
+    receiving_bus.shutdown()
+    sending_bus.shutdown()
+
+
+def test_paused_subscription_keeps_its_frames():
+    receiving_bus = can.Bus(interface='virtual', channel='test_dispatcher_pause')
+    sending_bus = can.Bus(interface='virtual', channel='test_dispatcher_pause')
+    dispatcher = dispatcher_for(receiving_bus)
+    received, bounded_received = [], []
+    subscription = dispatcher.subscribe(lambda frames: received.extend(msg.arbitration_id for msg in frames))
+    bounded = dispatcher.subscribe(
+        lambda frames: bounded_received.extend(msg.arbitration_id for msg in frames), max_paused_frames=10
+    )
+    subscription.pause()
+    bounded.pause()
+    for arbitration_id in range(100):
+        sending_bus.send(can.Message(arbitration_id=arbitration_id, is_extended_id=False))
+    deadline = time.monotonic() + 2.0
+    while bounded.dropped < 90 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert received == [] and bounded_received == []
+    subscription.resume()
+    bounded.resume()
+    sending_bus.send(can.Message(arbitration_id=100, is_extended_id=False))
+    while len(received) < 101 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert received == list(range(101)) and subscription.dropped == 0
+    assert bounded_received == list(range(90, 101)) and bounded.dropped == 90
+    subscription.cancel()
+    bounded.cancel()
+    receiving_bus.shutdown()
+    sending_bus.shutdown()
+
+
+class FilteringBus(VirtualBus):
+    def _apply_filters(self, filters):
+        pass
+
+
+def test_placement_is_reported_per_subscription():
+    bus = FilteringBus(channel='test_dispatcher_placement')
+    dispatcher = dispatcher_for(bus)
+    filtered = dispatcher.subscribe(lambda frames: None, arbitration_ids=[0x100])
+    assert filtered.placement == FilterPlacement.HARDWARE
+    # The bus accepts every frame for the catch-all subscription
+    catch_all = dispatcher.subscribe(lambda frames: None)
+    assert filtered.placement == FilterPlacement.SOFTWARE
+    assert filtered.set_filters([{'can_id': 0x200, 'can_mask': 0x7FF}]) == FilterPlacement.SOFTWARE
+    catch_all.cancel()
+    assert filtered.placement == FilterPlacement.HARDWARE
+    filtered.cancel()
+    bus.shutdown()
@@ -0,0 +1,17 @@
+import can
+from can_explorer.transport.can_filter import FilterPlacement, apply_bus_filters, matches_filters
+
+
+def test_matches_filters():
+    can_filters = [{'can_id': 0x100, 'can_mask': 0x7F0}, {'can_id': 0x42, 'can_mask': 0x1FFFFFFF, 'extended': False}]
+    assert matches_filters(can.Message(arbitration_id=0x10A, is_extended_id=False), can_filters)
+    assert matches_filters(can.Message(arbitration_id=0x42, is_extended_id=False), can_filters)
+    assert not matches_filters(can.Message(arbitration_id=0x42, is_extended_id=True), can_filters)
+    assert matches_filters(can.Message(arbitration_id=0x7FF), None)
+
+
+def test_virtual_bus_filters_run_in_software():
+    with can.Bus(interface='virtual', channel='test_can_filter') as bus:
+        placement, software_filters = apply_bus_filters(bus, [{'can_id': 0x100, 'can_mask': 0x7FF}])
+        assert placement == FilterPlacement.SOFTWARE
+        assert software_filters is None
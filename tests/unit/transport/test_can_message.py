@@ -0,0 +1,32 @@
+import can
+import numpy as np
+from can_explorer.transport.can_message import CanMessage, FrameBatch
+
+
+def test_can_message_round_trip():
+    msg = can.Message(arbitration_id=0x18FEF100, data=[1, 2, 3], is_extended_id=True)
+    message = CanMessage.from_can(msg)
+    assert message.is_extended_id and not message.is_fd
+    assert message.export().equals(msg, timestamp_delta=None)
+
+
+def test_frame_batch_conversion_slicing_and_concatenation():
+    messages = [
+        can.Message(timestamp=1.0, arbitration_id=0x123, data=[1, 2, 3], is_extended_id=False),
+        can.Message(timestamp=2.0, arbitration_id=0x1ABCDE, dlc=2, is_remote_frame=True, is_rx=False),
+        can.Message(timestamp=3.0, arbitration_id=0x7FF, data=[7] * 8, is_extended_id=False),
+    ]
+    batch = FrameBatch.from_messages(messages)
+    assert len(batch) == 3 and batch.width == 8
+    assert all(a.equals(b) for a, b in zip(batch.to_messages(), messages))
+    assert bytes(batch.payload(0)) == b'\x01\x02\x03' and bytes(batch.payload(1)) == b''
+    # Views on the columns
+    tail = batch[1:]
+    assert tail.data.base is not None and list(tail.arbitration_id) == [0x1ABCDE, 0x7FF]
+    assert list(batch[batch.arbitration_id < 0x200].timestamp) == [1.0]
+    fd = FrameBatch.from_messages([can.Message(arbitration_id=0x10, data=range(64), is_fd=True)])
+    assert fd.width == 64
+    combined = FrameBatch.concatenate([batch[-1], fd])
+    assert combined.width == 64 and list(combined.dlc) == [8, 64]
+    assert np.array_equal(combined.data[0], [7] * 8 + [0] * 56)
+    assert [bytes(msg.data) for msg in combined.to_messages()] == [bytes([7] * 8), bytes(range(64))]
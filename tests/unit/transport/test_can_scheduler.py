@@ -0,0 +1,77 @@
+import asyncio
+import time
+import can
+import pytest
+from can_explorer.transport.base_protocol import CanProtocol
+from can_explorer.transport.can_scheduler import CyclicScheduler, chain, rolling_counter, xor_checksum
+from can_explorer.transport.isotp.addressing import TargetAddressingType
+from can_explorer.transport.isotp.isotp import create_isotp_endpoint
+
+
+def test_update_callbacks():
+    update = chain(rolling_counter(0, bit_offset=4), xor_checksum(3))
+    payload = bytearray([0x05, 0x12, 0x34, 0x00])
+    update(payload, 0x13)
+    assert payload[0] == 0x35
+    assert payload[3] == 0x35 ^ 0x12 ^ 0x34
+
+
+def test_cyclic_transmission():
+    sender = can.Bus(interface='virtual', channel='scheduler')
+    receiver = can.Bus(interface='virtual', channel='scheduler')
+    scheduler = CyclicScheduler(sender)
+    fast = scheduler.add(can.Message(arbitration_id=0x100, data=bytes(2)), 0.005, on_update=rolling_counter(0))
+    slow = scheduler.add(can.Message(arbitration_id=0x200, data=bytes(1)), 0.02)
+    time.sleep(0.2)
+    scheduler.stop()
+    received = []
+    while (msg := receiver.recv(timeout=0)) is not None:
+        received.append(msg)
+    fast_frames = [msg for msg in received if msg.arbitration_id == 0x100]
+    assert 30 <= fast.statistics.count <= 41
+    assert 5 <= slow.statistics.count <= 11
+    assert [msg.data[0] for msg in fast_frames[:4]] == [0, 1, 2, 3]
+    assert abs(fast.statistics.achieved_period - 0.005) < 0.001
+    sender.shutdown()
+    receiver.shutdown()
+
+
+def test_spinning_is_limited_to_tight_jitter_budgets():
+    sender = can.Bus(interface='virtual', channel='scheduler_spin')
+    with pytest.raises(ValueError):
+        CyclicScheduler(sender, spin=0.001)
+    scheduler = CyclicScheduler(sender)
+    task = scheduler.add(can.Message(arbitration_id=0x100, data=bytes(1)), 0.001, on_update=rolling_counter(0))
+    assert not scheduler._needs_spin(task.tick)
+    start, cpu_start = time.perf_counter(), time.process_time()
+    time.sleep(0.3)
+    # A scheduler spinning through every tick would keep a core busy
+    assert time.process_time() - cpu_start < 0.5 * (time.perf_counter() - start)
+    precise = scheduler.add(
+        can.Message(arbitration_id=0x200, data=bytes(1)), 0.01, on_update=rolling_counter(0), jitter=0.0001
+    )
+    assert scheduler._needs_spin(precise.tick)
+    scheduler.stop()
+    assert task.statistics.count > 200
+    sender.shutdown()
+
+
+async def test_scheduler_for_transport():
+    bus = can.Bus(interface='virtual', channel='scheduler_transport')
+    _, transport = create_isotp_endpoint(
+        asyncio.get_running_loop(),
+        CanProtocol,
+        bus,
+        source_address=0x01,
+        target_address=0x02,
+        address_extension=0x00,
+        target_address_type=TargetAddressingType.PHYSICAL,
+        is_fd=False,
+    )
+    scheduler = CyclicScheduler.for_transport(transport)
+    assert scheduler._bus is bus
+    scheduler.stop()
+    transport.shutdown()
+    with pytest.raises(ValueError):
+        CyclicScheduler.for_transport(asyncio.Transport())
+    bus.shutdown()
@@ -0,0 +1,147 @@
+import sys
+import threading
+import can
+import pytest
+from can_explorer.transport.can_writer import CanWriteBuffer, TxBufferFullError
+from can_explorer.util.timing import now
+
+
+class GatedBus(can.BusABC):
+    """Bus whose send() blocks until released, raising a transmit buffer error on the first attempt"""
+
+    def __init__(self):
+        super().__init__(channel='gated')
+        self.sent = []
+        self.gate = threading.Event()
+        self.failures = 1
+
+    def send(self, msg, timeout=None):
+        self.gate.wait()
+        if self.failures:
+            self.failures -= 1
+            raise can.CanOperationError('Transmit buffer full')
+        self.sent.append(msg)
+
+    def _recv_internal(self, timeout):
+        return None, False
+
+
+def test_write_flow_control_and_flush():
+    bus = GatedBus()
+    events = []
+    closed = threading.Event()
+    writer = CanWriteBuffer(
+        bus, on_pause=lambda: events.append('pause'), on_resume=lambda: events.append('resume'), high=16, low=8
+    )
+    for arbitration_id in range(4):
+        assert writer.write(can.Message(arbitration_id=arbitration_id, data=bytes(8)))
+    assert events == ['pause']
+    assert writer.get_size() == 32
+    bus.gate.set()
+    writer.close(closed.set)
+    assert closed.wait(2.0)
+    assert [msg.arbitration_id for msg in bus.sent] == [0, 1, 2, 3]
+    assert events == ['pause', 'resume']
+    assert writer.get_size() == 0
+    bus.shutdown()
+
+
+def test_write_reports_full_buffer():
+    bus = GatedBus()
+    errors = []
+    writer = CanWriteBuffer(bus, on_error=errors.append, max_size=8)
+    assert writer.write(can.Message(data=bytes(8)))
+    assert not writer.write(can.Message(data=bytes(1)))
+    assert isinstance(errors[0], TxBufferFullError)
+    writer.abort()
+    bus.gate.set()
+    bus.shutdown()
+
+
+@pytest.mark.parametrize('trial', range(5))
+def test_pause_and_resume_alternate_under_contention(trial):
+    class CountingBus(can.BusABC):
+        def __init__(self):
+            super().__init__(channel='counting')
+            self.sent = 0
+
+        def send(self, msg, timeout=None):
+            self.sent += 1
+
+        def _recv_internal(self, timeout):
+            return None, False
+
+    bus = CountingBus()
+    events, stalled = [], []
+    writable = threading.Event()
+    writable.set()
+    closed = threading.Event()
+
+    def on_pause():
+        events.append('pause')
+        writable.clear()
+
+    def on_resume():
+        events.append('resume')
+        writable.set()
+
+    writer = CanWriteBuffer(bus, on_pause=on_pause, on_resume=on_resume, high=16, low=8)
+
+    def write_frames():
+        for _ in range(2000):
+            # A lost resume leaves the writers paused forever
+            if not writable.wait(1.0):
+                stalled.append(threading.current_thread())
+                return
+            writer.write(can.Message(data=bytes(8)))
+
+    threads = [threading.Thread(target=write_frames) for _ in range(4)]
+    # Frequent thread switches, to interleave the writers and the writer thread between every statement
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    writer.close(closed.set)
+    assert closed.wait(5.0)
+    assert not stalled and bus.sent == 8000
+    assert events[-1] == 'resume'
+    assert all(event == ('pause', 'resume')[index % 2] for index, event in enumerate(events))
+    bus.shutdown()
+
+
+def test_paced_trains_share_the_writer_thread():
+    class RecordingBus(can.BusABC):
+        def __init__(self):
+            super().__init__(channel='recording')
+            self.sent = []
+
+        def send(self, msg, timeout=None):
+            self.sent.append((now(), msg.arbitration_id))
+
+        def _recv_internal(self, timeout):
+            return None, False
+
+    bus = RecordingBus()
+    done = []
+    closed = threading.Event()
+    writer = CanWriteBuffer(bus)
+    for arbitration_id in (0x100, 0x200):
+        frames = [can.Message(arbitration_id=arbitration_id, data=bytes(8)) for _ in range(5)]
+        assert writer.write_paced(frames, 0.005, lambda error, last_sent: done.append(error))
+    assert writer.write(can.Message(arbitration_id=0x300))
+    writer.close(closed.set)
+    assert closed.wait(2.0)
+    assert done == [None, None]
+    # Sent while the trains wait for their separation time
+    assert [arbitration_id for _, arbitration_id in bus.sent].index(0x300) < 4
+    for arbitration_id in (0x100, 0x200):
+        times = [time for time, sent_id in bus.sent if sent_id == arbitration_id]
+        assert len(times) == 5
+        assert min(b - a for a, b in zip(times, times[1:])) >= 0.005
+    assert writer.get_size() == 0
+    bus.shutdown()
@@ -0,0 +1,79 @@
+import asyncio
+import statistics
+import can
+import pytest
+from can_explorer.transport.canopen.nmt import IntervalStatistics, NmtCommand, NmtState, NmtSupervisor
+
+
+def heartbeat(node_id, state, timestamp):
+    return can.Message(timestamp=timestamp, arbitration_id=0x700 + node_id, data=[state], is_extended_id=False)
+
+
+async def test_missed_heartbeat_among_many_nodes():
+    loop = asyncio.get_running_loop()
+    lost, changes = [], []
+    supervisor = NmtSupervisor(
+        loop, lambda msg: True, on_node_lost=lost.append, on_state_changed=lambda *change: changes.append(change)
+    )
+    nodes = range(1, 101)
+    for node_id in nodes:
+        supervisor.monitor(node_id, period=0.05)
+    for beat in range(4):
+        supervisor.frames_received(
+            heartbeat(node_id, NmtState.OPERATIONAL, loop.time()) for node_id in nodes if beat < 2 or node_id != 7
+        )
+        await asyncio.sleep(0.04)
+    assert lost == [7]
+    assert not supervisor.node(7).alive and supervisor.node(8).alive
+    assert changes == [(node_id, NmtState.OPERATIONAL) for node_id in nodes]
+    intervals = supervisor.node(8).intervals
+    assert intervals.count == 3 and intervals.mean == pytest.approx(0.04, abs=0.02)
+    # Heard again
+    supervisor.frame_received(heartbeat(7, NmtState.PRE_OPERATIONAL, loop.time()))
+    assert changes[-1] == (7, NmtState.PRE_OPERATIONAL) and supervisor.node(7).alive
+    supervisor.close()
+
+
+async def test_node_guarding():
+    loop = asyncio.get_running_loop()
+    lost, sent = [], []
+    supervisor = NmtSupervisor(loop, lambda msg: answer(msg), on_node_lost=lost.append)
+    toggle = 0
+
+    def answer(msg):
+        nonlocal toggle
+        sent.append(msg)
+        if len(sent) <= 3:
+            loop.call_soon(supervisor.frame_received, heartbeat(5, NmtState.STOPPED | toggle, loop.time()))
+            toggle ^= 0x80
+
+    supervisor.guard(5, guard_time=0.02, life_time_factor=2)
+    # Lost two unanswered guard times after the third answer, each up to a timer wheel resolution late
+    for _ in range(100):
+        if lost:
+            break
+        await asyncio.sleep(0.01)
+    assert all(msg.is_remote_frame and msg.arbitration_id == 0x705 for msg in sent)
+    assert supervisor.node(5).state == NmtState.STOPPED
+    assert lost == [5]
+    supervisor.close()
+
+
+async def test_commands_emergencies_and_statistics():
+    sent, emergencies = [], []
+    supervisor = NmtSupervisor(asyncio.get_running_loop(), sent.append, on_emergency=emergencies.append)
+    supervisor.send_command(NmtCommand.START, 3)
+    assert bytes(sent[0].data) == b'\x01\x03' and sent[0].arbitration_id == 0
+    supervisor.frame_received(can.Message(arbitration_id=0x083, data=b'\x10\x81\x11\x01\x02\x03\x04\x05'))
+    # SYNC
+    supervisor.frame_received(can.Message(arbitration_id=0x080, data=b''))
+    assert [(e.node_id, e.error_code, e.error_register, e.data) for e in emergencies] == [
+        (3, 0x8110, 0x11, b'\x01\x02\x03\x04\x05')
+    ]
+    samples = [0.1, 0.12, 0.09, 0.1, 0.11]
+    intervals = IntervalStatistics()
+    for sample in samples:
+        intervals.add(sample)
+    assert intervals.mean == pytest.approx(statistics.mean(samples))
+    assert intervals.jitter == pytest.approx(statistics.stdev(samples))
+    assert (intervals.minimum, intervals.maximum) == (0.09, 0.12)
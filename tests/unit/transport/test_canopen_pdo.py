@@ -0,0 +1,114 @@
+import can
+import pytest
+from can_explorer.transport.canopen.errors import SdoAbortCode, SdoError
+from can_explorer.transport.canopen.pdo import (
+    DataType,
+    MappedVariable,
+    PdoDecoder,
+    PdoMapping,
+    load_eds,
+    mappings_from_dictionary,
+    upload_mappings,
+)
+
+EDS = '''
+[FileInfo]
+FileName=drive.eds
+
+[1800]
+ParameterName=TPDO1 communication parameter
+ObjectType=0x9
+SubNumber=2
+
+[1800sub1]
+ParameterName=COB-ID
+DataType=0x0007
+DefaultValue=$NODEID+0x180
+
+[1801sub1]
+ParameterName=COB-ID
+DataType=0x0007
+DefaultValue=0x80000280
+
+[1A00sub0]
+ParameterName=Number of entries
+DataType=0x0005
+DefaultValue=3
+
+[1A00sub1]
+DataType=0x0007
+DefaultValue=0x60410010
+
+[1A00sub2]
+DataType=0x0007
+DefaultValue=0x00050008
+
+[1A00sub3]
+DataType=0x0007
+DefaultValue=0x60640020
+
+[6041]
+ParameterName=Statusword
+DataType=0x0006
+
+[6064]
+ParameterName=Position actual value
+DataType=0x0004
+'''
+
+
+def test_eds_mapping_decoding(tmp_path):
+    path = tmp_path / 'drive.eds'
+    path.write_text(EDS)
+    dictionary = load_eds(path)
+    with pytest.raises(ValueError):
+        # The COB-ID depends on the node id
+        mappings_from_dictionary(dictionary)
+    mappings = mappings_from_dictionary(dictionary, node_id=5)
+    # The second TPDO is disabled
+    assert [(mapping.cob_id, mapping.transmit) for mapping in mappings] == [(0x185, True)]
+    decoder = PdoDecoder(mappings)
+    frames = [
+        can.Message(
+            timestamp=1.0, arbitration_id=0x185, data=b'\x37\x02\xff\xfe\xff\xff\xff\x00', is_extended_id=False
+        ),
+        can.Message(timestamp=2.0, arbitration_id=0x186, data=bytes(8), is_extended_id=False),
+        can.Message(timestamp=3.0, arbitration_id=0x185, data=b'\x37\x02', is_extended_id=False),
+    ]
+    pdos = decoder.decode_frames(frames)
+    assert [(pdo.timestamp, pdo.as_dict()) for pdo in pdos] == [
+        (1.0, {'Statusword': 0x237, 'Position actual value': -2})
+    ]
+    assert decoder.short_frames == 1
+
+
+def test_bit_field_mapping():
+    variables = (
+        MappedVariable(0x2000, 1, 1, DataType.BOOLEAN, 'enabled'),
+        MappedVariable(0x2000, 2, 12, DataType.INTEGER16, 'current'),
+        MappedVariable(0x0005, 0, 3, 0x0005, 'dummy3'),
+        MappedVariable(0x2000, 3, 24, DataType.UNSIGNED24, 'counter'),
+        MappedVariable(0x2000, 4, 32, DataType.REAL32, 'speed'),
+    )
+    decoder = PdoDecoder([PdoMapping(0x201, variables)])
+    layout = decoder.layouts[0x201]
+    assert layout.size == 9 and layout.names == ('enabled', 'current', 'counter', 'speed')
+    raw = 1 | (-3 & 0xFFF) << 1 | 0x123456 << 16 | 0x3FC00000 << 40
+    assert layout.unpack(raw.to_bytes(9, 'little')) == (True, -3, 0x123456, 1.5)
+
+
+async def test_upload_mappings():
+    objects = {
+        (0x1800, 1): (0x181).to_bytes(4, 'little'),
+        (0x1A00, 0): b'\x01',
+        (0x1A00, 1): (0x60410010).to_bytes(4, 'little'),
+    }
+
+    class Sdo:
+        async def upload(self, index, subindex):
+            if (index, subindex) not in objects:
+                raise SdoError(SdoAbortCode.OBJECT_DOES_NOT_EXIST, None)
+            return bytearray(objects[(index, subindex)])
+
+    mappings = await upload_mappings(Sdo())
+    assert mappings == [PdoMapping(0x181, (MappedVariable(0x6041, 0, 16, DataType.UNSIGNED16, '6041sub0'),))]
@@ -0,0 +1,151 @@
+import asyncio
+import binascii
+import can
+import pytest
+from can_explorer.transport.canopen.errors import SdoAbortCode, SdoError
+from can_explorer.transport.canopen.sdo import SdoClient
+
+
+class Server:
+    """SDO server of a node, answering through the event loop. Drops the listed block segments once"""
+
+    def __init__(self, loop, node_id, client, block_size=127, drop=()):
+        self.loop = loop
+        self.node_id = node_id
+        self.client = client
+        self.block_size = block_size
+        self.drop = set(drop)
+        self.objects = {}
+        self.aborts = []
+        self.segments = 0
+        self.state = None
+
+    def send(self, data):
+        msg = can.Message(arbitration_id=0x580 + self.node_id, data=bytes(data) + bytes(8 - len(data)))
+        self.loop.call_soon(self.client.frame_received, msg)
+
+    def frame_received(self, msg):
+        data = msg.data
+        command = data[0]
+        if self.state == 'block_download':
+            self.segments += 1
+            sequence = command & 0x7F
+            if sequence == self.expected and self.segments not in self.drop:
+                self.buffer += data[1:8]
+                self.expected += 1
+            if sequence == self.block_size or command & 0x80:
+                acknowledged, self.expected = self.expected - 1, 1
+                if command & 0x80 and acknowledged == sequence:
+                    self.state = None
+                self.send([0xA2, acknowledged, self.block_size])
+            return
+        key = (int.from_bytes(data[1:3], 'little'), data[3])
+        mux = bytes(data[1:4])
+        if command == 0x80:
+            self.aborts.append(int.from_bytes(data[4:8], 'little'))
+        elif command >> 5 == 2:
+            if key not in self.objects:
+                self.send(b'\x80' + mux + (0x06020000).to_bytes(4, 'little'))
+                return
+            self.value, self.offset = self.objects[key], 0
+            if 0 < len(self.value) <= 4:
+                self.send(bytes([0x43 | (4 - len(self.value)) << 2]) + mux + self.value)
+            else:
+                self.send(b'\x41' + mux + len(self.value).to_bytes(4, 'little'))
+        elif command >> 5 == 3:
+            chunk = self.value[self.offset : self.offset + 7]
+            self.offset += 7
+            self.send([command & 0x10 | (7 - len(chunk)) << 1 | (self.offset >= len(self.value))] + list(chunk))
+        elif command >> 5 == 1:
+            self.key, self.buffer = key, bytearray()
+            if command & 0x02:
+                self.objects[key] = bytes(data[4 : 8 - (command >> 2 & 0x03)])
+            self.send(b'\x60' + mux)
+        elif command >> 5 == 0:
+            self.buffer += data[1 : 8 - (command >> 1 & 0x07)]
+            if command & 0x01:
+                self.objects[self.key] = bytes(self.buffer)
+            self.send([0x20 | command & 0x10])
+        elif command >> 5 == 6 and not command & 0x01:
+            self.key, self.buffer, self.expected, self.state = key, bytearray(), 1, 'block_download'
+            self.send(b'\xa4' + mux + bytes([self.block_size]))
+        elif command >> 5 == 6:
+            del self.buffer[len(self.buffer) - (command >> 2 & 0x07) :]
+            assert binascii.crc_hqx(self.buffer, 0) == int.from_bytes(data[1:3], 'little')
+            self.objects[self.key] = bytes(self.buffer)
+            self.send([0xA1])
+        elif command == 0xA4:
+            self.value, self.offset, self.block_size = self.objects[key], 0, data[4]
+            self.send(b'\xc6' + mux + len(self.value).to_bytes(4, 'little'))
+        elif command == 0xA3:
+            self.send_block()
+        elif command == 0xA2:
+            self.offset = self.block_start + data[1] * 7
+            self.block_size = data[2]
+            if self.offset < len(self.value):
+                self.send_block()
+            else:
+                crc = binascii.crc_hqx(self.value, 0).to_bytes(2, 'little')
+                self.send(bytes([0xC1 | (-len(self.value)) % 7 << 2]) + crc)
+
+    def send_block(self):
+        self.block_start = offset = self.offset
+        for sequence in range(1, self.block_size + 1):
+            chunk = self.value[offset : offset + 7]
+            offset += 7
+            last = offset >= len(self.value)
+            self.segments += 1
+            if self.segments not in self.drop:
+                self.send(bytes([last << 7 | sequence]) + chunk)
+            if last:
+                break
+
+
+def network(loop, node_id, timeout=1.0, **kwargs):
+    servers = []
+    client = SdoClient(
+        loop, node_id, lambda msg: loop.call_soon(servers[0].frame_received, msg) or True, timeout=timeout
+    )
+    servers.append(Server(loop, node_id, client, **kwargs))
+    return client, servers[0]
+
+
+async def test_expedited_and_segmented_transfers():
+    client, server = network(asyncio.get_running_loop(), 5)
+    for size in (3, 4, 7, 20, 0):
+        value = bytes(range(size))
+        await client.download(0x2000, size, value)
+        assert server.objects[(0x2000, size)] == value
+        assert await client.upload(0x2000, size) == value
+    with pytest.raises(SdoError) as error:
+        await client.upload(0x2001, 0)
+    assert error.value.code == SdoAbortCode.OBJECT_DOES_NOT_EXIST
+    assert not server.aborts
+
+
+@pytest.mark.parametrize('size', [1, 7, 2000])
+async def test_block_transfers_to_several_nodes(size):
+    loop = asyncio.get_running_loop()
+    # Lost segments are repeated in the next block
+    nodes = [network(loop, node_id, block_size=10, drop=(3, 40)) for node_id in (1, 2, 3)]
+    values = [bytes([node_id]) * size for node_id in (1, 2, 3)]
+    await asyncio.gather(*(client.download(0x1F50, 1, value, block=True) for (client, _), value in zip(nodes, values)))
+    assert [server.objects[(0x1F50, 1)] for _, server in nodes] == values
+    for _, server in nodes:
+        server.segments = 0
+    uploaded = await asyncio.gather(*(client.upload(0x1F50, 1, block=True) for client, _ in nodes))
+    assert uploaded == values
+    assert not any(server.aborts for _, server in nodes)
+
+
+async def test_timeout_aborts_transfer():
+    sent = []
+    client = SdoClient(asyncio.get_running_loop(), 5, sent.append, timeout=0.05)
+    with pytest.raises(SdoError) as error:
+        await client.upload(0x1008, 0)
+    assert error.value.code == SdoAbortCode.TIMEOUT
+    assert [bytes(msg.data) for msg in sent] == [
+        b'\x40\x08\x10\x00\x00\x00\x00\x00',
+        b'\x80\x08\x10\x00\x00\x00\x04\x05',
+    ]
+    assert all(msg.arbitration_id == 0x605 for msg in sent)
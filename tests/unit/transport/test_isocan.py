@@ -0,0 +1,32 @@
+import asyncio
+import can
+from can_explorer.transport.base_protocol import CanProtocol
+from can_explorer.transport.can_connection import create_can_connection, CanType
+
+
+class RecordingProtocol(CanProtocol):
+    def __init__(self):
+        self.frames = []
+        self.batches = 0
+
+    def frames_received(self, frames):
+        self.batches += 1
+        self.frames.extend(frames)
+
+
+async def test_frames_are_received_in_batches():
+    receiving_bus = can.Bus(interface='virtual', channel='test_isocan')
+    with can.Bus(interface='virtual', channel='test_isocan') as sending_bus:
+        protocol, transport = create_can_connection(
+            asyncio.get_running_loop(), CanType.ISOCAN, RecordingProtocol, receiving_bus
+        )
+        for arbitration_id in range(500):
+            sending_bus.send(can.Message(arbitration_id=arbitration_id))
+        for _ in range(50):
+            if len(protocol.frames) == 500:
+                break
+            await asyncio.sleep(0.02)
+        transport.close()
+    assert [msg.arbitration_id for msg in protocol.frames] == list(range(500))
+    assert protocol.batches < 500
+    assert transport.is_closing()
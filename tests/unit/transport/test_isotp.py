@@ -0,0 +1,304 @@
+import asyncio
+import errno
+import threading
+import time
+import can
+import pytest
+from can.interfaces.virtual import VirtualBus
+from can_explorer.transport.base_protocol import CanProtocol
+from can_explorer.transport.isotp import session as isotp_session
+from can_explorer.transport.isotp.addressing import AddressInfo, AddressingType, TargetAddressingType
+from can_explorer.transport.isotp.isotp import create_isotp_endpoint
+from can_explorer.transport.isotp.errors import IsoTpError, NResult
+from can_explorer.transport.isotp.pdu import PDU, PCIType, parse_pci
+from can_explorer.transport.isotp.session import IsoTpSessionManager
+
+ADDRESSING = dict(
+    source_address=0x01,
+    target_address=0x02,
+    address_extension=0x00,
+    target_address_type=TargetAddressingType.PHYSICAL,
+    is_fd=False,
+)
+
+
+class FlowControllingEcu(threading.Thread):
+    """Peer answering FirstFrames and every block of `block_size` ConsecutiveFrames, if any, with a FlowControl"""
+
+    def __init__(self, bus, block_size, st_min):
+        super().__init__(daemon=True)
+        self.bus = bus
+        self.block_size = block_size
+        self.st_min = st_min
+        self.frames = []
+        self.done = threading.Event()
+
+    def send_flow_control(self):
+        data = [0x30, self.block_size, self.st_min, 0xCC, 0xCC, 0xCC, 0xCC, 0xCC]
+        self.bus.send(can.Message(arbitration_id=0x12, data=data, is_extended_id=False))
+
+    def run(self):
+        length = None
+        received = 0
+        while received != length:
+            msg = self.bus.recv(timeout=2.0)
+            if msg is None:
+                return
+            self.frames.append(msg)
+            if msg.data[0] >> 4 == 1:
+                length = (msg.data[0] & 0x0F) << 8 | msg.data[1]
+                received = 6
+                self.send_flow_control()
+                continue
+            received = min(length, received + 7)
+            block_index = len(self.frames) - 1
+            if received < length and self.block_size and block_index % self.block_size == 0:
+                self.send_flow_control()
+        self.done.set()
+
+
+async def test_segmented_transmission_respects_block_size_and_st_min():
+    transport_bus = can.Bus(interface='virtual', channel='test_isotp_tx')
+    ecu_bus = can.Bus(interface='virtual', channel='test_isotp_tx')
+    ecu = FlowControllingEcu(ecu_bus, block_size=4, st_min=0xF5)
+    ecu.start()
+    protocol, transport = create_isotp_endpoint(asyncio.get_running_loop(), CanProtocol, transport_bus, **ADDRESSING)
+    await asyncio.sleep(0)
+    payload = bytes(range(256)) * 2
+    transport.write(payload)
+    for _ in range(100):
+        if ecu.done.is_set():
+            break
+        await asyncio.sleep(0.02)
+    transport.shutdown()
+    transport_bus.shutdown()
+    ecu_bus.shutdown()
+    assert ecu.done.is_set()
+    first_frame, consecutive_frames = ecu.frames[0], ecu.frames[1:]
+    assert first_frame.arbitration_id == 0x21
+    assert [msg.data[0] for msg in consecutive_frames[:17]] == [0x20 | (n & 0x0F) for n in range(1, 18)]
+    received = bytes(first_frame.data[2:]) + b''.join(bytes(msg.data[1:]) for msg in consecutive_frames)
+    assert received[: len(payload)] == payload
+    gaps = [b.timestamp - a.timestamp for a, b in zip(consecutive_frames, consecutive_frames[1:])]
+    assert min(gaps) >= 0.0005
+
+
+async def test_sub_millisecond_st_min_is_met_closely():
+    transport_bus = can.Bus(interface='virtual', channel='test_isotp_st_min_us')
+    ecu_bus = can.Bus(interface='virtual', channel='test_isotp_st_min_us')
+    # STmin 0xF3: 300 us, below what the OS sleeps accurately
+    ecu = FlowControllingEcu(ecu_bus, block_size=0, st_min=0xF3)
+    ecu.start()
+    protocol, transport = create_isotp_endpoint(asyncio.get_running_loop(), CanProtocol, transport_bus, **ADDRESSING)
+    await asyncio.sleep(0)
+    transport.write(bytes(7 * 100))
+    for _ in range(100):
+        if ecu.done.is_set():
+            break
+        await asyncio.sleep(0.02)
+    transport.shutdown()
+    transport_bus.shutdown()
+    ecu_bus.shutdown()
+    assert ecu.done.is_set()
+    consecutive_frames = ecu.frames[1:]
+    gaps = sorted(b.timestamp - a.timestamp for a, b in zip(consecutive_frames, consecutive_frames[1:]))
+    assert gaps[0] >= 0.0003
+    # Finished by spinning rather than overshot by a sleep of the OS
+    assert gaps[len(gaps) // 2] < 0.0004
+
+
+class StalledBus(VirtualBus):
+    """Virtual bus whose transmit buffer stays full once ConsecutiveFrames are sent, as with a bus never acknowledging"""
+
+    def send(self, msg, timeout=None):
+        if msg.data[0] >> 4 == 2:
+            time.sleep(timeout or 0)
+            raise can.CanOperationError('Transmit buffer full')
+        super().send(msg, timeout)
+
+
+class BusOffBus(VirtualBus):
+    """Virtual bus whose controller goes bus-off once ConsecutiveFrames are sent"""
+
+    def send(self, msg, timeout=None):
+        if msg.data[0] >> 4 == 2:
+            raise can.CanOperationError('Bus off', error_code=errno.ENETDOWN)
+        super().send(msg, timeout)
+
+
+class ReceivingProtocol(CanProtocol):
+    def __init__(self):
+        self.messages = []
+        self.errors = []
+
+    def data_received(self, data):
+        self.messages.append(data)
+
+    def error_received(self, exc):
+        self.errors.append(exc)
+
+
+def segment(payload, arbitration_id=0x12):
+    length = len(payload)
+    frames = [bytes([0x10 | length >> 8, length & 0xFF]) + payload[:6]]
+    frames += [bytes([0x20 | (n + 1) & 0x0F]) + payload[6 + 7 * n : 13 + 7 * n] for n in range((length - 6 + 6) // 7)]
+    return [
+        can.Message(arbitration_id=arbitration_id, data=data.ljust(8, b'\xcc'), is_extended_id=False) for data in frames
+    ]
+
+
+async def test_segmented_reception_delivers_one_message():
+    transport_bus = can.Bus(interface='virtual', channel='test_isotp_rx')
+    ecu_bus = can.Bus(interface='virtual', channel='test_isotp_rx')
+    loop = asyncio.get_running_loop()
+    protocol, transport = create_isotp_endpoint(loop, ReceivingProtocol, transport_bus, **ADDRESSING)
+    await asyncio.sleep(0)
+    payload = bytes(range(256)) * 15
+    for msg in segment(payload):
+        ecu_bus.send(msg)
+    for _ in range(100):
+        if protocol.messages:
+            break
+        await asyncio.sleep(0.01)
+    flow_control = ecu_bus.recv(timeout=1.0)
+    transport.shutdown()
+    transport_bus.shutdown()
+    ecu_bus.shutdown()
+    assert protocol.messages == [payload]
+    assert not protocol.errors
+    assert flow_control.arbitration_id == 0x21
+    assert bytes(flow_control.data[:3]) == bytes([0x30, 0x00, 0x00])
+
+
+async def test_missing_consecutive_frame_times_out(monkeypatch):
+    monkeypatch.setattr(isotp_session, 'N_CR_TIMEOUT', 0.05)
+    transport_bus = can.Bus(interface='virtual', channel='test_isotp_n_cr')
+    ecu_bus = can.Bus(interface='virtual', channel='test_isotp_n_cr')
+    protocol, transport = create_isotp_endpoint(
+        asyncio.get_running_loop(), ReceivingProtocol, transport_bus, **ADDRESSING
+    )
+    await asyncio.sleep(0)
+    for msg in segment(bytes(30))[:2]:
+        ecu_bus.send(msg)
+    await asyncio.sleep(0.2)
+    transport.shutdown()
+    transport_bus.shutdown()
+    ecu_bus.shutdown()
+    assert not protocol.messages
+    assert len(protocol.errors) == 1
+    assert isinstance(protocol.errors[0], IsoTpError)
+    assert protocol.errors[0].result == NResult.N_TIMEOUT_Cr
+
+
+def test_escaped_first_frame_length():
+    addressing = AddressInfo(**ADDRESSING)
+    msg = can.Message(arbitration_id=0x12, data=[0x10, 0x00, 0x00, 0x01, 0x00, 0x00, 0xAA, 0xBB], is_extended_id=False)
+    pdu = PDU.from_can(msg, addressing)
+    assert pdu.data_length == 0x10000
+    assert bytes(pdu.data) == b'\xaa\xbb'
+
+
+def test_parse_pci_reports_invalid_frames_as_error_codes():
+    assert parse_pci(bytes([0x21, 1, 2])) == (NResult.N_OK, PCIType.CONSECUTIVE_FRAME, 1, 1, 0)
+    assert parse_pci(bytes([0xA0, 0x30, 0x04, 0xF5]), offset=1) == (
+        NResult.N_OK,
+        PCIType.FLOW_CONTROL_FRAME,
+        0,
+        4,
+        0xF5,
+    )
+    assert parse_pci(bytes([0x07, 1, 2]))[0] == NResult.N_ERROR
+    assert parse_pci(bytes([0x10, 0x04] + [0] * 6))[0] == NResult.N_ERROR
+    assert parse_pci(bytes([0x33, 0, 0]))[0] == NResult.N_INVALID_FS
+    assert parse_pci(bytes([0x50]))[0] == NResult.N_UNEXP_PDU
+    assert parse_pci(b'')[0] == NResult.N_ERROR
+    assert [PDU.encode_dlc(length, is_fd=True) for length in (8, 9, 12, 13, 64)] == [8, 9, 9, 10, 15]
+    assert PDU.decode_dlc(13, is_fd=True) == 32
+
+
+async def test_session_manager_demultiplexes_address_pairs():
+    manager_bus = can.Bus(interface='virtual', channel='test_isotp_sessions')
+    ecu_bus = can.Bus(interface='virtual', channel='test_isotp_sessions')
+    manager = IsoTpSessionManager(asyncio.get_running_loop(), manager_bus)
+    sessions = {}
+    for target in range(2, 6):
+        addressing = AddressInfo(**dict(ADDRESSING, target_address=target))
+        sessions[target] = manager.open_session(addressing, ReceivingProtocol)
+    for extension in (0xA0, 0xA1):
+        addressing = AddressInfo(
+            **dict(ADDRESSING, target_address=0x07, address_extension=extension),
+            addressing_type=AddressingType.MIXED_EXTENDED,
+        )
+        sessions[extension] = manager.open_session(addressing, ReceivingProtocol)
+    with pytest.raises(ValueError):
+        manager.open_session(sessions[3][1].addressing, ReceivingProtocol)
+    # Same address pair, other target addressing type: its frames could not be told apart
+    functional = AddressInfo(**dict(ADDRESSING, target_address=3, target_address_type=TargetAddressingType.FUNCTIONAL))
+    with pytest.raises(ValueError):
+        manager.open_session(functional, ReceivingProtocol)
+    assert manager.get_session(functional.session_key) is None
+    await asyncio.sleep(0)
+    ecu_bus.send(can.Message(arbitration_id=0x13, data=b'\x03\x01\x02\x03', is_extended_id=False))
+    ecu_bus.send(can.Message(arbitration_id=0x17, data=b'\xa1\x02\x0a\x0b', is_extended_id=False))
+    for msg in segment(bytes(range(20)), arbitration_id=0x15):
+        ecu_bus.send(msg)
+    for _ in range(100):
+        if sessions[5][0].messages:
+            break
+        await asyncio.sleep(0.01)
+    manager.close()
+    manager_bus.shutdown()
+    ecu_bus.shutdown()
+    assert sessions[3][0].messages == [b'\x01\x02\x03']
+    assert sessions[0xA1][0].messages == [b'\x0a\x0b']
+    assert sessions[5][0].messages == [bytes(range(20))]
+    assert not sessions[2][0].messages and not sessions[0xA0][0].messages
+
+
+async def test_consecutive_frame_not_sent_in_time_times_out(monkeypatch):
+    monkeypatch.setattr(isotp_session, 'N_AS_TIMEOUT', 0.05)
+    transport_bus = StalledBus(channel='test_isotp_n_as')
+    ecu_bus = can.Bus(interface='virtual', channel='test_isotp_n_as')
+    ecu = FlowControllingEcu(ecu_bus, block_size=0, st_min=0)
+    ecu.start()
+    protocol, transport = create_isotp_endpoint(
+        asyncio.get_running_loop(), ReceivingProtocol, transport_bus, **ADDRESSING
+    )
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    transport.write(bytes(100))
+    for _ in range(100):
+        if protocol.errors:
+            break
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    transport.shutdown()
+    transport_bus.shutdown()
+    ecu_bus.shutdown()
+    assert len(protocol.errors) == 1
+    assert isinstance(protocol.errors[0], IsoTpError)
+    assert protocol.errors[0].result == NResult.N_TIMEOUT_A
+    # Given up after N_As rather than after the retries of the write buffer
+    assert elapsed < 0.3
+
+
+async def test_bus_error_is_not_reported_as_timeout():
+    transport_bus = BusOffBus(channel='test_isotp_bus_off')
+    ecu_bus = can.Bus(interface='virtual', channel='test_isotp_bus_off')
+    ecu = FlowControllingEcu(ecu_bus, block_size=0, st_min=0)
+    ecu.start()
+    protocol, transport = create_isotp_endpoint(
+        asyncio.get_running_loop(), ReceivingProtocol, transport_bus, **ADDRESSING
+    )
+    await asyncio.sleep(0)
+    transport.write(bytes(100))
+    for _ in range(100):
+        if protocol.errors:
+            break
+        await asyncio.sleep(0.01)
+    transport.shutdown()
+    transport_bus.shutdown()
+    ecu_bus.shutdown()
+    assert len(protocol.errors) == 1
+    assert isinstance(protocol.errors[0], can.CanOperationError)
+    assert protocol.errors[0].error_code == errno.ENETDOWN
@@ -0,0 +1,38 @@
+import can
+from can_explorer.transport.isotp.addressing import AddressInfo, TargetAddressingType
+from can_explorer.transport.isotp.errors import NResult
+from can_explorer.transport.isotp.offline import reassemble
+
+ADDRESSING = AddressInfo(0x01, 0x02, 0x00, TargetAddressingType.PHYSICAL, is_fd=False)
+
+
+def frame(timestamp, arbitration_id, data):
+    return can.Message(
+        timestamp=timestamp, arbitration_id=arbitration_id, data=bytes(data).ljust(8, b'\xcc'), is_extended_id=False
+    )
+
+
+def test_reassembles_recorded_conversation():
+    payload = bytes(range(20))
+    frames = [
+        frame(0.0, 0x21, [0x02, 0x10, 0x03]),
+        frame(0.1, 0x300, [0x10, 0x14]),  # Other traffic
+        frame(0.2, 0x12, [0x10, 0x14, *payload[:6]]),
+        frame(0.3, 0x21, [0x30, 0x00, 0x00]),
+        frame(0.4, 0x12, [0x21, *payload[6:13]]),
+        frame(0.5, 0x12, [0x22, *payload[13:20]]),
+        frame(1.0, 0x12, [0x10, 0x14, *payload[:6]]),
+        frame(1.1, 0x12, [0x22, *payload[6:13]]),
+        frame(2.0, 0x12, [0x10, 0x14, *payload[:6]]),
+        frame(3.5, 0x12, [0x21, *payload[6:13]]),
+        frame(4.0, 0x21, [0x10, 0x14, *payload[:6]]),
+    ]
+    messages = list(reassemble(frames, ADDRESSING, batch_size=4))
+    assert [(m.arbitration_id, m.result, bytes(m.data)) for m in messages] == [
+        (0x21, NResult.N_OK, b'\x10\x03'),
+        (0x12, NResult.N_OK, payload),
+        (0x12, NResult.N_WRONG_SN, payload[:6]),
+        (0x12, NResult.N_TIMEOUT_Cr, payload[:6]),
+        (0x21, NResult.N_TIMEOUT_Cr, payload[:6]),
+    ]
+    assert (messages[1].start_timestamp, messages[1].end_timestamp) == (0.2, 0.5)
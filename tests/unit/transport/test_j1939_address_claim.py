@@ -0,0 +1,44 @@
+import asyncio
+from can_explorer.transport.j1939 import address_claim
+from can_explorer.transport.j1939.address_claim import AddressClaimManager, ClaimState
+from can_explorer.transport.j1939.addressing import Name
+from can_explorer.transport.j1939.pdu import decode_arbitration_id
+
+
+class Node:
+    def __init__(self, loop, network, name=None):
+        self.loop = loop
+        self.network = network
+        self.claims = AddressClaimManager(loop, self.send, name)
+        network.append(self)
+
+    def send(self, msg):
+        for node in self.network:
+            if node is not self:
+                self.loop.call_soon(node.claims.frame_received, msg, decode_arbitration_id(msg.arbitration_id))
+
+
+async def test_address_conflict_is_won_by_lower_name(monkeypatch):
+    monkeypatch.setattr(address_claim, 'CLAIM_TIMEOUT', 0.03)
+    loop = asyncio.get_running_loop()
+    network = []
+    strong_name = Name(identity_number=1, manufacturer_code=0x10)
+    weak_name = Name(identity_number=2, manufacturer_code=0x10, arbitrary_address_capable=True)
+    strong = Node(loop, network, strong_name)
+    weak = Node(loop, network, weak_name)
+    stubborn = Node(loop, network, Name(identity_number=3, manufacturer_code=0x10))
+    listener = Node(loop, network)
+    weak.claims.claim(0x80)
+    await asyncio.sleep(0.01)
+    strong.claims.claim(0x80)
+    stubborn.claims.claim(0x80)
+    await asyncio.sleep(0.1)
+    assert (strong.claims.state, strong.claims.address) == (ClaimState.CLAIMED, 0x80)
+    assert (weak.claims.state, weak.claims.address) == (ClaimState.CLAIMED, 0x81)
+    assert (stubborn.claims.state, stubborn.claims.address) == (ClaimState.CANNOT_CLAIM, None)
+    assert listener.claims.table() == {0x80: strong_name, 0x81: weak_name}
+    assert listener.claims.name_of(0x81) == weak_name
+    late = Node(loop, network)
+    late.claims.request_address_claims()
+    await asyncio.sleep(0.01)
+    assert late.claims.table() == listener.claims.table()
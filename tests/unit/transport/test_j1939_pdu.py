@@ -0,0 +1,26 @@
+import numpy as np
+from can_explorer.transport.j1939.pdu import MessageType, PDU, decode_arbitration_id, decode_arbitration_ids
+
+IDS = [0x18FEF100, 0x0CF00400, 0x18EA0017, 0x18EAFF17, 0x18E80017, 0x1CECFF10, 0x1CEF2010, 0x19ED0020]
+
+
+def test_batch_decoding_matches_cached_decoding():
+    batch = decode_arbitration_ids(np.array(IDS, dtype=np.uint32))
+    for arbitration_id, row in zip(IDS, batch):
+        pdu = decode_arbitration_id(arbitration_id)
+        assert pdu is decode_arbitration_id(arbitration_id)
+        assert pdu.arbitration_id == arbitration_id
+        for name in batch.dtype.names:
+            expected = getattr(pdu, name)
+            assert row[name] == (expected.value if name == 'message_type' else expected), name
+    assert [MessageType(value) for value in batch['message_type']] == [
+        MessageType.BROADCAST,
+        MessageType.BROADCAST,
+        MessageType.REQUEST,
+        MessageType.REQUEST,
+        MessageType.ACKNOWLEDGMENT,
+        MessageType.BROADCAST,
+        MessageType.COMMAND,
+        MessageType.GROUP_FUNCTION,
+    ]
+    assert PDU.from_pgn(0xFEF1, source_address=0x00) == decode_arbitration_id(0x18FEF100)
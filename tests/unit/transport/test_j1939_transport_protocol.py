@@ -0,0 +1,75 @@
+import asyncio
+import can
+import pytest
+from can_explorer.transport.j1939 import transport_protocol
+from can_explorer.transport.j1939.errors import AbortReason, J1939Error
+from can_explorer.transport.j1939.pdu import GLOBAL_ADDRESS, decode_arbitration_id
+from can_explorer.transport.j1939.transport_protocol import J1939TransportProtocol
+
+
+class Node:
+    """Transport protocol whose frames are delivered to the other nodes"""
+
+    def __init__(self, loop, address, network, **kwargs):
+        self.loop = loop
+        self.network = network
+        self.messages = []
+        self.errors = []
+        self.sent = []
+        self.tp = J1939TransportProtocol(loop, self.send, self.messages.append, self.errors.append, address, **kwargs)
+        network.append(self)
+
+    def send(self, msg):
+        self.sent.append(msg)
+        for node in self.network:
+            if node is not self:
+                self.loop.call_soon(node.frame_received, msg)
+
+    def frame_received(self, msg):
+        self.tp.frame_received(msg, decode_arbitration_id(msg.arbitration_id))
+
+
+@pytest.mark.parametrize('size', [100, 2000])
+async def test_connection_mode_transfer(size):
+    loop = asyncio.get_running_loop()
+    network = []
+    sender = Node(loop, 0x10, network)
+    receiver = Node(loop, 0x20, network, packets_per_cts=4)
+    listener = Node(loop, None, network)
+    payload = bytes(range(256)) * (size // 256) + bytes(size % 256)
+    await sender.tp.send(0xEF00, payload, destination_address=0x20)
+    await asyncio.sleep(0)
+    for node in (receiver, listener):
+        assert [(m.pgn, m.source_address, m.destination_address, bytes(m.data)) for m in node.messages] == [
+            (0xEF00, 0x10, 0x20, payload)
+        ]
+        assert not node.errors
+    assert not listener.sent
+    clear_to_send = [msg for msg in receiver.sent if msg.data[0] in (17, 21)]
+    assert len(clear_to_send) == -(-size // 28)
+
+
+async def test_broadcast_and_timeouts(monkeypatch):
+    monkeypatch.setattr(transport_protocol, 'BAM_PACKET_INTERVAL', 0.0)
+    loop = asyncio.get_running_loop()
+    network = []
+    sender = Node(loop, 0x10, network)
+    listener = Node(loop, None, network)
+    await sender.tp.send(0xFECA, bytes(range(20)))
+    await asyncio.sleep(0)
+    assert [(m.pgn, m.destination_address, bytes(m.data)) for m in listener.messages] == [
+        (0xFECA, GLOBAL_ADDRESS, bytes(range(20)))
+    ]
+    monkeypatch.setattr(transport_protocol, 'T3', 0.05)
+    with pytest.raises(J1939Error) as error:
+        await sender.tp.send(0xEF00, bytes(20), destination_address=0x30)
+    assert error.value.reason == AbortReason.TIMEOUT
+    await asyncio.sleep(0)
+    # Abort sent by the sender
+    assert [error.reason for error in listener.errors] == [AbortReason.TIMEOUT]
+    # The BAM without data transfer times out at the listener
+    monkeypatch.setattr(transport_protocol, 'T1', 0.05)
+    sender.send(can.Message(arbitration_id=0x1CECFF10, data=[32, 20, 0, 3, 0xFF, 0xCA, 0xFE, 0x00]))
+    await asyncio.sleep(0.15)
+    assert [error.reason for error in listener.errors] == [AbortReason.TIMEOUT] * 2
+    assert not listener.tp.receptions
@@ -0,0 +1,22 @@
+import asyncio
+from can_explorer.transport.timer import TimerWheel
+
+
+async def test_timer_wheel_expires_reset_and_stopped_timers():
+    loop = asyncio.get_running_loop()
+    wheel = TimerWheel(loop, resolution=0.005, slots=4)
+    expired = []
+    postponed = wheel.call_later(0.03, lambda: expired.append(('postponed', loop.time())))
+    stopped = wheel.call_later(0.01, lambda: expired.append(('stopped', loop.time())))
+    # Longer than one turn of the wheel
+    wheel.call_later(0.05, lambda: expired.append(('long', loop.time())))
+    start = loop.time()
+    stopped.stop()
+    await asyncio.sleep(0.02)
+    postponed.reset()
+    assert len(wheel) == 2
+    await asyncio.sleep(0.08)
+    assert [name for name, _ in expired] == ['long', 'postponed']
+    assert expired[0][1] - start >= 0.05
+    assert expired[1][1] - start >= 0.05
+    assert not postponed.is_armed and len(wheel) == 0